@@ -0,0 +1,211 @@
+"""Benchmarks for update_index / ChannelIndex, on synthetic channels.
+
+Packages are generated once (in setup_cache) for each combination of files per package and
+archive format, and every benchmark gets a fresh channel of hardlinks to the first N of them.
+Each timing is a single run (number = 1, and no warmup runs), so that setup can put the channel
+back in the state the benchmark expects."""
+import json
+import os
+import shutil
+import tempfile
+
+import libarchive
+
+from conda_build import api
+from conda_build.index import (CONDA_TARBALL_EXTENSIONS, ChannelIndex, _apply_instructions,
+                               _gather_channeldata_reference_packages)
+
+PACKAGE_COUNTS = [100, 1000]
+FILE_COUNTS = [10, 100]
+EXTENSIONS = ['.tar.bz2', '.tar.zst']
+SUBDIR = 'linux-64'
+
+_filters = {'.tar.bz2': 'bzip2', '.tar.zst': 'zstd'}
+
+
+def package_record(i):
+    """index.json of the i'th synthetic package: five versions of each name, each depending on
+    the previous name."""
+    name = 'pkg%d' % (i // 5)
+    record = {
+        'name': name,
+        'version': '1.%d' % (i % 5),
+        'build': 'h%08x_0' % i,
+        'build_number': 0,
+        'depends': ['pkg%d >=1.0' % (i // 5 - 1)] if i >= 5 else [],
+        'license': 'BSD-3-Clause',
+        'subdir': SUBDIR,
+        'timestamp': 1500000000000 + i,
+    }
+    return record
+
+
+def make_package(dir_path, i, n_files, ext):
+    record = package_record(i)
+    fn = '%s-%s-%s%s' % (record['name'], record['version'], record['build'], ext)
+    files = ['lib/%s/file_%d.txt' % (record['name'], j) for j in range(n_files)]
+    contents = {f: ('%s %d\n' % (f, i)) * 20 for f in files}
+    entries = {
+        'info/index.json': json.dumps(record),
+        'info/about.json': json.dumps({'summary': 'package %d' % i, 'license': record['license'],
+                                       'home': 'https://example.com/%s' % record['name']}),
+        'info/files': '\n'.join(files),
+        'info/paths.json': json.dumps({
+            'paths': [{'_path': f, 'path_type': 'hardlink', 'size_in_bytes': len(contents[f])}
+                      for f in files],
+            'paths_version': 1,
+        }),
+        'info/recipe/meta.yaml': 'package:\n  name: %s\n  version: %s\n' % (record['name'],
+                                                                          record['version']),
+    }
+    entries.update(contents)
+    path = os.path.join(dir_path, fn)
+    with libarchive.file_writer(path, 'gnutar', filter_name=_filters[ext]) as archive:
+        # info/ first, as conda-build writes them
+        for entry_path in sorted(entries, key=lambda p: (not p.startswith('info/'), p)):
+            content = entries[entry_path].encode('utf-8')
+            archive.add_file_from_memory(entry_path, len(content), content)
+    return path
+
+
+def make_channel(package_paths):
+    channel = tempfile.mkdtemp(prefix='index-benchmark-')
+    for subdir in (SUBDIR, 'noarch'):
+        os.makedirs(os.path.join(channel, subdir))
+    for path in package_paths:
+        add_package(channel, path)
+    return channel
+
+
+def add_package(channel, path):
+    dest = os.path.join(channel, SUBDIR, os.path.basename(path))
+    try:
+        os.link(path, dest)
+    except OSError:
+        shutil.copy2(path, dest)
+
+
+def index(channel):
+    api.update_index(channel, progress=False)
+
+
+class _ChannelBenchmark(object):
+    params = (PACKAGE_COUNTS, FILE_COUNTS, EXTENSIONS)
+    param_names = ['packages', 'files_per_package', 'extension']
+    number = 1
+    repeat = 3
+    warmup_time = 0
+    timeout = 600
+
+    def setup_cache(self):
+        # one more package than the largest channel, for AddPackage
+        packages = {}
+        for n_files in FILE_COUNTS:
+            for ext in set(EXTENSIONS) & set(CONDA_TARBALL_EXTENSIONS):
+                dir_path = os.path.abspath('packages-%d%s' % (n_files, ext))
+                os.makedirs(dir_path)
+                packages[(n_files, ext)] = [make_package(dir_path, i, n_files, ext)
+                                            for i in range(max(PACKAGE_COUNTS) + 1)]
+        return packages
+
+    def setup(self, packages, n_packages, n_files, ext):
+        if ext not in CONDA_TARBALL_EXTENSIONS:
+            # this conda does not index packages in this format
+            raise NotImplementedError
+        self.channel = make_channel(packages[(n_files, ext)][:n_packages])
+        self.extra_package = packages[(n_files, ext)][n_packages]
+
+    def teardown(self, *args):
+        shutil.rmtree(self.channel, ignore_errors=True)
+
+
+class ColdIndex(_ChannelBenchmark):
+    """Indexing a channel that has never been indexed."""
+    def time_cold_index(self, *args):
+        index(self.channel)
+
+    def peakmem_cold_index(self, *args):
+        index(self.channel)
+
+
+class NoopReindex(_ChannelBenchmark):
+    """Reindexing a channel in which nothing has changed."""
+    def setup(self, *args):
+        super(NoopReindex, self).setup(*args)
+        index(self.channel)
+
+    def time_noop_reindex(self, *args):
+        index(self.channel)
+
+    def peakmem_noop_reindex(self, *args):
+        index(self.channel)
+
+
+class AddPackage(_ChannelBenchmark):
+    """Reindexing after one package was added to an indexed channel."""
+    def setup(self, *args):
+        super(AddPackage, self).setup(*args)
+        index(self.channel)
+        add_package(self.channel, self.extra_package)
+
+    def time_index_after_add(self, *args):
+        index(self.channel)
+
+    def peakmem_index_after_add(self, *args):
+        index(self.channel)
+
+
+class BuildChannelData(_ChannelBenchmark):
+    """Building channeldata from an indexed channel's repodata2 and package caches."""
+    def setup(self, *args):
+        super(BuildChannelData, self).setup(*args)
+        index(self.channel)
+        self.channel_index = ChannelIndex(self.channel, None)
+        self.subdirs = [SUBDIR, 'noarch']
+        self.packages = []
+        for subdir in self.subdirs:
+            with open(os.path.join(self.channel, subdir, 'repodata2.json')) as fh:
+                self.packages.extend(json.load(fh)['packages'])
+
+    def _build_channeldata(self):
+        reference_packages = _gather_channeldata_reference_packages(self.packages)
+        return self.channel_index._build_channeldata(self.subdirs, reference_packages)
+
+    def time_build_channeldata(self, *args):
+        self._build_channeldata()
+
+    def peakmem_build_channeldata(self, *args):
+        self._build_channeldata()
+
+
+class ApplyPatchInstructions(object):
+    """Applying patch instructions to a subdir's repodata.  Instructions change the depends of
+    every other package, and remove or revoke a few."""
+    params = [1000, 10000, 100000]
+    param_names = ['packages']
+    number = 1
+    repeat = 5
+    warmup_time = 0
+
+    def setup(self, n_packages):
+        packages = {}
+        for i in range(n_packages):
+            record = package_record(i)
+            packages['%s-%s-%s.tar.bz2' % (record['name'], record['version'],
+                                           record['build'])] = record
+        fns = sorted(packages)
+        self.repodata = {'packages': packages, 'info': {'subdir': SUBDIR},
+                         'repodata_version': 1}
+        self.instructions = {
+            'patch_instructions_version': 1,
+            'packages': {fn: {'depends': packages[fn]['depends'] + ['libfoo >=2']}
+                         for fn in fns[::2]},
+            'remove': fns[::50],
+            'revoke': fns[25::50],
+        }
+
+    def time_apply_instructions(self, n_packages):
+        _apply_instructions(SUBDIR, self.repodata, self.instructions)
+
+    def peakmem_apply_instructions(self, n_packages):
+        _apply_instructions(SUBDIR, self.repodata, self.instructions)
@@ -31,48 +31,37 @@ def render(recipe_path, config=None, variants=None, permit_unsatisfiable_variant
     """Given path to a recipe, return the MetaData object(s) representing that recipe, with jinja2
        templates evaluated.
 
+    recipe_path may also be a list of recipe paths.  With jobs > 1 (or config.jobs), independent
+       recipes, variants and outputs are rendered in that many worker processes.
+
     Returns a list of (metadata, needs_download, needs_reparse in env) tuples"""
-    from conda_build.render import render_recipe, finalize_metadata
-    from conda_build.exceptions import DependencyNeedsBuildingError
-    from conda_build.conda_interface import NoPackagesFoundError
+    from conda_build.render import render_recipe, get_output_metas
+    from conda_build.conda_interface import string_types
+    from conda_build.utils import map_in_processes
     from collections import OrderedDict
+    from functools import partial
     config = get_or_merge_config(config, **kwargs)
 
+    if not isinstance(recipe_path, string_types):
+        # each recipe gets its own worker, which then renders its variants serially
+        recipe_config = config.copy()
+        recipe_config.jobs = 1
+        results = map_in_processes(partial(render, config=recipe_config, variants=variants,
+                                           permit_unsatisfiable_variants=permit_unsatisfiable_variants,
+                                           finalize=finalize, bypass_env_check=bypass_env_check),
+                                   recipe_path, jobs=config.jobs)
+        return [metadata_tuple for result in results for metadata_tuple in result]
+
     metadata_tuples = render_recipe(recipe_path, bypass_env_check=bypass_env_check,
                                     no_download_source=config.no_download_source,
                                     config=config, variants=variants,
                                     permit_unsatisfiable_variants=permit_unsatisfiable_variants)
     output_metas = OrderedDict()
-    for meta, download, render_in_env in metadata_tuples:
-        if not meta.skip() or not config.trim_skip:
-            for od, om in meta.get_output_metadata_set(
-                    permit_unsatisfiable_variants=permit_unsatisfiable_variants,
-                    permit_undefined_jinja=not finalize,
-                    bypass_env_check=bypass_env_check):
-                if not om.skip() or not config.trim_skip:
-                    if 'type' not in od or od['type'] == 'conda':
-                        if finalize and not om.final:
-                            try:
-                                om = finalize_metadata(om,
-                                        permit_unsatisfiable_variants=permit_unsatisfiable_variants)
-                            except (DependencyNeedsBuildingError, NoPackagesFoundError):
-                                if not permit_unsatisfiable_variants:
-                                    raise
-
-                        # remove outputs section from output objects for simplicity
-                        if not om.path and om.meta.get('outputs'):
-                            om.parent_outputs = om.meta['outputs']
-                            del om.meta['outputs']
-
-                        output_metas[om.dist(), om.config.variant.get('target_platform'),
-                                    tuple((var, om.config.variant[var])
-                                        for var in om.get_used_vars())] = \
-                            ((om, download, render_in_env))
-                    else:
-                        output_metas["{}: {}".format(om.type, om.name()), om.config.variant.get('target_platform'),
-                                    tuple((var, om.config.variant[var])
-                                        for var in om.get_used_vars())] = \
-                            ((om, download, render_in_env))
+    for outputs in map_in_processes(partial(get_output_metas, permit_unsatisfiable_variants,
+                                            finalize, bypass_env_check),
+                                    metadata_tuples, jobs=config.jobs):
+        for key, metadata_tuple in outputs:
+            output_metas[key] = metadata_tuple
 
     return list(output_metas.values())
 
@@ -95,8 +84,14 @@ def get_output_file_paths(recipe_path_or_metadata, no_download_source=False, con
     from conda_build.utils import get_skip_message
     config = get_or_merge_config(config, **kwargs)
 
-    if hasattr(recipe_path_or_metadata, '__iter__') and not isinstance(recipe_path_or_metadata,
-                                                                       string_types):
+    if (hasattr(recipe_path_or_metadata, '__iter__') and recipe_path_or_metadata and
+            all(isinstance(item, string_types) for item in recipe_path_or_metadata) and
+            not isinstance(recipe_path_or_metadata, string_types)):
+        # several recipes: render them together, in parallel if config.jobs allows
+        metadata = render(list(recipe_path_or_metadata), no_download_source=no_download_source,
+                          variants=variants, config=config, finalize=True, **kwargs)
+    elif hasattr(recipe_path_or_metadata, '__iter__') and not isinstance(recipe_path_or_metadata,
+                                                                         string_types):
         list_of_metas = [hasattr(item[0], 'config') for item in recipe_path_or_metadata
                         if len(item) == 3]
 
@@ -377,9 +372,11 @@ def create_metapackage(name, version, entry_points=(), build_string=None, build_
 
 def update_index(dir_paths, config=None, force=False, check_md5=False, remove=False, channel_name=None,
                  subdir=None, threads=None, patch_generator=None, verbose=False, progress=False,
-                 hotfix_source_repo=None, **kwargs):
+                 hotfix_source_repo=None, watch=False, watch_interval=2.0, write_shards=False,
+                 patch_cache=True, **kwargs):
     from locale import getpreferredencoding
     import os
+    from threading import Thread
     from .conda_interface import PY3
     from conda_build.index import update_index
     from conda_build.utils import ensure_list
@@ -388,11 +385,36 @@ def update_index(dir_paths, config=None, force=False, check_md5=False, remove=Fa
     if not PY3:
         dir_paths = [path.decode(getpreferredencoding()) for path in dir_paths]
 
+    index_kwargs = dict(check_md5=check_md5, channel_name=channel_name,
+                        patch_generator=patch_generator, threads=threads, verbose=verbose,
+                        progress=progress, hotfix_source_repo=hotfix_source_repo,
+                        subdirs=ensure_list(subdir), watch=watch, watch_interval=watch_interval,
+                        write_shards=write_shards, patch_cache=patch_cache)
+    if watch and len(dir_paths) > 1:
+        # watching never returns, so watch each channel from its own thread
+        watchers = [Thread(target=update_index, args=(path, ), kwargs=index_kwargs)
+                    for path in dir_paths]
+        for watcher in watchers:
+            watcher.daemon = True
+            watcher.start()
+        for watcher in watchers:
+            while watcher.is_alive():
+                watcher.join(1)
+        return
     for path in dir_paths:
-        update_index(path, check_md5=check_md5, channel_name=channel_name,
-                     patch_generator=patch_generator, threads=threads, verbose=verbose,
-                     progress=progress, hotfix_source_repo=hotfix_source_repo,
-                     subdirs=ensure_list(subdir))
+        update_index(path, **index_kwargs)
+
+
+def verify_index(dir_paths, subdir=None, threads=None, invalidate_cache=False):
+    """Check the packages in each of the channels at dir_paths against their repodata, without
+    changing the index.  Returns a list with one report per channel (see
+    conda_build.index.ChannelIndex.verify)."""
+    import os
+    from conda_build.index import verify_index, MAX_THREADS_DEFAULT
+    from conda_build.utils import ensure_list
+    return [verify_index(os.path.abspath(path), subdirs=ensure_list(subdir),
+                         threads=threads or MAX_THREADS_DEFAULT, invalidate_cache=invalidate_cache)
+            for path in _ensure_list(dir_paths)]
 
 
 def debug(recipe_or_package_path_or_metadata_tuples, path=None, test=False, output_id=None, config=None,
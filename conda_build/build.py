@@ -20,6 +20,7 @@ import subprocess
 import sys
 import time
 from tempfile import NamedTemporaryFile
+from threading import Thread
 
 # this is to compensate for a requests idna encoding error.  Conda is a better place to fix,
 #   eventually
@@ -71,8 +72,8 @@ from conda_build.post import (post_process, post_build,
                               fix_permissions, get_build_metadata)
 
 from conda_build.exceptions import indent, DependencyNeedsBuildingError, CondaBuildException
-from conda_build.variants import (set_language_env_vars, dict_of_lists_to_list_of_dicts,
-                                  get_package_variants)
+from conda_build.variants import (set_language_env_vars, get_package_variants,
+                                  VariantSpace)
 from conda_build.create_test import create_all_test_files
 
 import conda_build.noarch_python as noarch_python
@@ -1285,6 +1286,74 @@ def create_build_envs(m, notest):
                             is_cross=m.is_cross, is_conda=m.name() == 'conda')
 
 
+def _prefetch_test_packages(m, output_metas):
+    """Download the packages that the test and downstream-test environments of m's outputs will
+    need, so that testing starts with a warm package cache.
+
+    The outputs themselves are not built yet, so they are left out of these solves, and
+    environments that can't be solved without them are skipped.  This is best effort: anything
+    not fetched here is downloaded by test() as usual."""
+    log = utils.get_logger(__name__)
+    output_names = set(om.name() for _, om in output_metas)
+
+    def _spec_name(spec):
+        return spec.name if hasattr(spec, 'name') else spec.split()[0]
+
+    env_specs = []
+    for _, om in output_metas:
+        if om.skip():
+            continue
+        env_specs.append(utils.ensure_list(om.get_value('test/requires', [])) +
+                         utils.ensure_list(om.get_value('requirements/run', [])))
+        downstreams = om.meta.get('test', {}).get('downstreams')
+        if hasattr(downstreams, 'keys'):
+            downstreams = list(downstreams.keys())
+        for dep in utils.ensure_list(downstreams):
+            env_specs.append(om.ms_depends('run') + [MatchSpec(dep)])
+
+    for specs in env_specs:
+        specs = [utils.ensure_valid_spec(spec) for spec in specs
+                 if _spec_name(spec) not in output_names]
+        if not specs:
+            continue
+        try:
+            with TemporaryDirectory(prefix='_prefetch_') as tmpdir:
+                actions = environ.get_install_actions(tmpdir, tuple(specs), 'host',
+                                                      subdir=m.config.host_subdir,
+                                                      debug=m.config.debug,
+                                                      verbose=m.config.verbose,
+                                                      locking=m.config.locking,
+                                                      bldpkgs_dirs=tuple(m.config.bldpkgs_dirs),
+                                                      timeout=m.config.timeout,
+                                                      disable_pip=m.config.disable_pip,
+                                                      max_env_retry=m.config.max_env_retry,
+                                                      output_folder=m.config.output_folder,
+                                                      channel_urls=tuple(m.config.channel_urls))
+                actions = dict(actions)
+                for action in ('FETCH', 'EXTRACT'):
+                    if action in actions:
+                        actions[action] = [pkg for pkg in actions[action]
+                                           if not hasattr(pkg, 'name') or
+                                           pkg.name not in output_names]
+                wanted = [pkg for pkg in actions.get('LINK', []) if pkg.name not in output_names]
+                execute_download_actions(m, actions, 'host', package_subset=wanted,
+                                         require_files=True)
+        except Exception as e:
+            log.debug("Not prefetching packages for test environment with specs %s: %s",
+                      specs, e)
+
+
+def start_test_package_prefetch(m, output_metas):
+    """Run _prefetch_test_packages in a background thread, and return that thread.
+
+    conda is not safe to use from two threads at once, so the caller must join the thread before
+    doing anything else that touches conda (solving, fetching, indexing)."""
+    thread = Thread(target=_prefetch_test_packages, args=(m, output_metas))
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
 def build(m, stats, post=None, need_source_download=True, need_reparse_in_env=False,
           built_packages=None, notest=False, provision_only=False):
     '''
@@ -1433,53 +1502,64 @@ def build(m, stats, post=None, need_source_download=True, need_reparse_in_env=Fa
         if script:
             script = '\n'.join(script)
 
-        if isdir(src_dir):
-            build_stats = {}
-            if utils.on_win:
-                build_file = join(m.path, 'bld.bat')
-                if script:
-                    build_file = join(src_dir, 'bld.bat')
-                    with open(build_file, 'w') as bf:
-                        bf.write(script)
-                windows.build(m, build_file, stats=build_stats, provision_only=provision_only)
-            else:
-                build_file = join(m.path, 'build.sh')
-                if isfile(build_file) and script:
-                    raise CondaBuildException("Found a build.sh script and a build/script section"
-                                              "inside meta.yaml. Either remove the build.sh script "
-                                              "or remove the build/script section in meta.yaml.")
-                # There is no sense in trying to run an empty build script.
-                if isfile(build_file) or script:
-                    work_file, _ = write_build_scripts(m, script, build_file)
-                    if not provision_only:
-                        cmd = [shell_path] + (['-x'] if m.config.debug else []) + ['-e', work_file]
-
-                        # rewrite long paths in stdout back to their env variables
-                        if m.config.debug or m.config.no_rewrite_stdout_env:
-                            rewrite_env = None
-                        else:
-                            rewrite_vars = ['PREFIX', 'SRC_DIR']
-                            if not m.build_is_host:
-                                rewrite_vars.insert(1, 'BUILD_PREFIX')
-                            rewrite_env = {
-                                k: env[k]
-                                for k in rewrite_vars if k in env
-                            }
-                            for k, v in rewrite_env.items():
-                                print('{0} {1}={2}'
-                                        .format('set' if build_file.endswith('.bat') else 'export', k, v))
-
-                        # clear this, so that the activate script will get run as necessary
-                        del env['CONDA_BUILD']
-
-                        # this should raise if any problems occur while building
-                        utils.check_call_env(cmd, env=env, rewrite_stdout_env=rewrite_env,
-                                            cwd=src_dir, stats=build_stats)
-                        utils.remove_pycache_from_scripts(m.config.host_prefix)
-            if build_stats and not provision_only:
-                log_stats(build_stats, "building {}".format(m.name()))
-                if stats is not None:
-                    stats[stats_key(m, 'build')] = build_stats
+        prefetch = None
+        if not (notest or provision_only):
+            # fill the package cache for testing while the build script runs
+            prefetch = start_test_package_prefetch(m, output_metas)
+
+        try:
+            if isdir(src_dir):
+                build_stats = {}
+                if utils.on_win:
+                    build_file = join(m.path, 'bld.bat')
+                    if script:
+                        build_file = join(src_dir, 'bld.bat')
+                        with open(build_file, 'w') as bf:
+                            bf.write(script)
+                    windows.build(m, build_file, stats=build_stats, provision_only=provision_only)
+                else:
+                    build_file = join(m.path, 'build.sh')
+                    if isfile(build_file) and script:
+                        raise CondaBuildException("Found a build.sh script and a build/script section"
+                                                  "inside meta.yaml. Either remove the build.sh script "
+                                                  "or remove the build/script section in meta.yaml.")
+                    # There is no sense in trying to run an empty build script.
+                    if isfile(build_file) or script:
+                        work_file, _ = write_build_scripts(m, script, build_file)
+                        if not provision_only:
+                            cmd = [shell_path] + (['-x'] if m.config.debug else []) + ['-e', work_file]
+
+                            # rewrite long paths in stdout back to their env variables
+                            if m.config.debug or m.config.no_rewrite_stdout_env:
+                                rewrite_env = None
+                            else:
+                                rewrite_vars = ['PREFIX', 'SRC_DIR']
+                                if not m.build_is_host:
+                                    rewrite_vars.insert(1, 'BUILD_PREFIX')
+                                rewrite_env = {
+                                    k: env[k]
+                                    for k in rewrite_vars if k in env
+                                }
+                                for k, v in rewrite_env.items():
+                                    print('{0} {1}={2}'
+                                            .format('set' if build_file.endswith('.bat') else 'export', k, v))
+
+                            # clear this, so that the activate script will get run as necessary
+                            del env['CONDA_BUILD']
+
+                            # this should raise if any problems occur while building
+                            utils.check_call_env(cmd, env=env, rewrite_stdout_env=rewrite_env,
+                                                cwd=src_dir, stats=build_stats)
+                            utils.remove_pycache_from_scripts(m.config.host_prefix)
+                if build_stats and not provision_only:
+                    log_stats(build_stats, "building {}".format(m.name()))
+                    if stats is not None:
+                        stats[stats_key(m, 'build')] = build_stats
+        finally:
+            # even when the build fails, so that the thread is never left running while
+            #    the caller goes on to use conda
+            if prefetch:
+                prefetch.join()
 
     prefix_file_list = join(m.config.build_folder, 'prefix_files.txt')
     initial_files = set()
@@ -2266,7 +2346,7 @@ def build_tree(recipe_list, config, stats, build_only=False, post=False, notest=
                 to_build_recursive.append(metadata.name())
 
                 if not metadata.final:
-                    variants_ = (dict_of_lists_to_list_of_dicts(variants) if variants else
+                    variants_ = (VariantSpace(variants) if variants else
                                 get_package_variants(metadata))
 
                     # This is where reparsing happens - we need to re-evaluate the meta.yaml for any
@@ -2441,6 +2521,9 @@ for Python 3.5 and needs to be rebuilt."""
                                     .format(recipe) + str(e.message) + "\n" + extra_help)
             retried_recipes.append(os.path.basename(name))
             recipe_list.extendleft(add_recipes)
+        finally:
+            # the source snapshots shared by this recipe's variants are no longer needed
+            source.remove_pristine_sources()
 
     if post in [True, None]:
         # TODO: could probably use a better check for pkg type than this...
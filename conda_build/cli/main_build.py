@@ -319,6 +319,20 @@ different sets of packages."""
                  if cc_conda_build.get('cache_dir')
                  else cc_conda_build.get('cache_dir')),
     )
+    p.add_argument(
+        '--src-cache-max-size',
+        help=("Maximum size of the source cache, e.g. 20G.  The least recently used downloads "
+              "(and extracted sources) are removed once it grows larger than this."),
+        default=cc_conda_build.get('src_cache_max_size'),
+    )
+    p.add_argument(
+        '--src-cache-keep-extracted',
+        action='store_true',
+        help=("Keep unpacked source archives, and url sources with their patches applied, in "
+              "the source cache.  They are copied from there instead of extracting and "
+              "patching the same sources again for every build."),
+        default=cc_conda_build.get('src_cache_keep_extracted', 'false').lower() == 'true',
+    )
     p.add_argument(
         "--no-copy-test-source-files", dest="copy_test_source_files", action="store_false",
         default=cc_conda_build.get('copy_test_source_files', 'true').lower() == 'true',
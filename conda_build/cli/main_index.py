@@ -1,5 +1,6 @@
 from __future__ import absolute_import, division, print_function
 
+import json
 import logging
 import os
 import sys
@@ -59,6 +60,53 @@ def parse_args(args):
     p.add_argument(
         "--no-progress", help="Hide progress bars", action="store_false", dest="progress"
     )
+    p.add_argument(
+        "--no-patch-cache",
+        action="store_false",
+        dest="patch_cache",
+        help="""Run the patch generator for every subdir, instead of reusing its instructions for
+        subdirs whose packages and generator have not changed.  Needed after changing files
+        the generator reads, other than Python modules beside it.""",
+    )
+    p.add_argument(
+        "--shards",
+        action="store_true",
+        dest="write_shards",
+        help="""Also write repodata split into one content-addressed shard per package name
+        (<subdir>/shards/), with a repodata_shards.json manifest, so that clients can load
+        only the packages they need.""",
+    )
+    p.add_argument(
+        "--watch",
+        action="store_true",
+        help="""After indexing, keep running and update the index whenever packages are added,
+        replaced or removed.  Only the subdirs that changed are rewritten.  Uses filesystem
+        events if the watchdog package is installed, and polling otherwise.""",
+    )
+    p.add_argument(
+        "--watch-interval",
+        type=float,
+        default=2.0,
+        help="Seconds between checks for changed packages with --watch (default: %(default)s).",
+    )
+
+    p.add_argument(
+        "--verify",
+        action="store_true",
+        help="""Instead of indexing, check every package against repodata.json: its size and
+        digests, that the archive fully decompresses, and that info/index.json matches its
+        record.  Prints a JSON report, and exits non-zero if any package fails.""",
+    )
+    p.add_argument(
+        "--verify-report",
+        help="Write the --verify report to this file instead of printing it.",
+    )
+    p.add_argument(
+        "--verify-invalidate-cache",
+        action="store_true",
+        help="""With --verify, drop the cached stat entries of packages that fail, so that the
+        next index run re-extracts them.  Otherwise --verify writes nothing.""",
+    )
 
     args = p.parse_args(args)
     return p, args
@@ -66,9 +114,21 @@ def parse_args(args):
 
 def execute(args):
     _, args = parse_args(args)
+    if args.verify:
+        reports = api.verify_index(args.dir, subdir=args.subdir, threads=args.threads,
+                                   invalidate_cache=args.verify_invalidate_cache)
+        output = json.dumps(reports, indent=2, sort_keys=True)
+        if args.verify_report:
+            with open(args.verify_report, 'w') as fh:
+                fh.write(output)
+        else:
+            print(output)
+        return 1 if any(report['failed'] for report in reports) else 0
     api.update_index(args.dir, check_md5=args.check_md5, channel_name=args.channel_name,
                      threads=args.threads, subdir=args.subdir, patch_generator=args.patch_generator,
-                     verbose=args.verbose, progress=args.progress, hotfix_source_repo=args.hotfix_source_repo)
+                     verbose=args.verbose, progress=args.progress, hotfix_source_repo=args.hotfix_source_repo,
+                     watch=args.watch, watch_interval=args.watch_interval,
+                     write_shards=args.write_shards, patch_cache=args.patch_cache)
 
 
 def main():
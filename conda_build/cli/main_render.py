@@ -167,6 +167,13 @@ def parse_args(args):
         action='store_true',
         help='Enable verbose output from download tools and progress updates',
     )
+    p.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=1,
+        help=("Number of worker processes used to render independent variants and outputs. "
+              "Recipes that need their source to render are always rendered serially."),
+    )
     args, _ = p.parse_known_args(args)
     return p, args
 
@@ -89,10 +89,17 @@ def _get_default_settings():
             Setting('keep_old_work', False),
             Setting('_src_cache_root', abspath(expanduser(expandvars(
                 cc_conda_build.get('cache_dir')))) if cc_conda_build.get('cache_dir') else None),
+            # least recently used sources are evicted from src_cache beyond this size (e.g. 20G)
+            Setting('src_cache_max_size', cc_conda_build.get('src_cache_max_size')),
+            # keep unpacked (and patched) sources in src_cache, to copy rather than redo them
+            Setting('src_cache_keep_extracted', cc_conda_build.get('src_cache_keep_extracted',
+                                                                   'false').lower() == 'true'),
             Setting('copy_test_source_files', True),
 
             # should rendering cut out any skipped metadata?
             Setting('trim_skip', True),
+            # number of worker processes used to render independent variants and recipes
+            Setting('jobs', 1),
 
             # Disable the overlinking test for this package. This test checks that transitive DSOs
             # are not referenced by DSOs in the package being built. When this happens something
@@ -5,18 +5,22 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 import bz2
 from collections import OrderedDict, defaultdict
+import copy
 from datetime import datetime
+import hashlib
 
 import json
 from numbers import Number
 import os
-from os.path import abspath, basename, getmtime, getsize, isdir, isfile, join, lexists, splitext, dirname
+from os.path import abspath, basename, getmtime, isdir, isfile, join, lexists, splitext, dirname
 from shutil import copy2, move
 import subprocess
 import tarfile
 from tempfile import gettempdir
+import threading
 import time
 from uuid import uuid4
+import zipfile
 
 # Lots of conda internals here.  Should refactor to use exports.
 from conda.common.compat import ensure_binary
@@ -40,8 +44,9 @@ import libarchive
 from . import conda_interface, utils
 from .conda_interface import MatchSpec, VersionOrder, human_bytes, context
 from .conda_interface import CondaError, CondaHTTPError, get_index, url_path
-from .conda_interface import download, TemporaryDirectory
-from .utils import glob, get_logger, FileNotFoundError, PermissionError
+from .conda_interface import download, TemporaryDirectory, string_types
+from .repodata_shards import REPODATA_SHARDS_FN, SHARDS_DIR
+from .utils import glob, get_logger, tar_xf, FileNotFoundError, PermissionError
 
 try:
     from conda.base.constants import CONDA_TARBALL_EXTENSIONS
@@ -57,6 +62,12 @@ except ImportError:
 
 log = get_logger(__name__)
 
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    Observer = None
+
 try:
     from conda.common.io import ThreadLimitedThreadPoolExecutor, as_completed
 except ImportError:
@@ -133,9 +144,13 @@ cached_index = None
 local_subdir = ""
 cached_channels = []
 channel_data = {}
+# run_exports answered from the index, keyed by package url.  Reset along with the index.
+run_exports_index = {}
 
 
 MAX_THREADS_DEFAULT = os.cpu_count() if (hasattr(os, "cpu_count") and os.cpu_count() > 1) else 1
+# how many subdirs' repodata an index run holds at once while patching (see _write_outputs)
+MAX_SUBDIRS_IN_FLIGHT = 4
 LOCK_TIMEOUT_SECS = 3 * 3600
 LOCKFILE_NAME = ".lock"
 DEFAULT_SUBDIRS = (
@@ -162,6 +177,73 @@ except ImportError:  # pragma: no cover
     from conda._vendor.toolz.itertoolz import concat, concatv, groupby  # NOQA
 
 
+class BuildIndex(dict):
+    """The merged index from get_build_index: a plain {record: record} dict, plus hash indexes
+    by dist_name and by name that are built on first use."""
+
+    def __init__(self, *args, **kwargs):
+        super(BuildIndex, self).__init__(*args, **kwargs)
+        self._by_dist_name = None
+        self._by_name = None
+
+    def _reset(self):
+        self._by_dist_name = self._by_name = None
+
+    def __setitem__(self, key, value):
+        super(BuildIndex, self).__setitem__(key, value)
+        self._reset()
+
+    def __delitem__(self, key):
+        super(BuildIndex, self).__delitem__(key)
+        self._reset()
+
+    def update(self, *args, **kwargs):
+        super(BuildIndex, self).update(*args, **kwargs)
+        self._reset()
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self._reset()
+        return super(BuildIndex, self).setdefault(key, default)
+
+    def pop(self, key, *default):
+        self._reset()
+        return super(BuildIndex, self).pop(key, *default)
+
+    def popitem(self):
+        self._reset()
+        return super(BuildIndex, self).popitem()
+
+    def clear(self):
+        super(BuildIndex, self).clear()
+        self._reset()
+
+    def _build_indexes(self):
+        by_dist_name = {}
+        by_name = defaultdict(list)
+        for record in self:
+            # first record wins, matching a scan over the index
+            by_dist_name.setdefault(record.dist_name, record)
+            by_name[record.name].append(record)
+        self._by_dist_name, self._by_name = by_dist_name, dict(by_name)
+
+    def get_by_dist_name(self, dist_name):
+        """Return the record with this dist_name, or None."""
+        if self._by_dist_name is None:
+            self._build_indexes()
+        return self._by_dist_name.get(dist_name)
+
+    def get_by_name(self, name):
+        """Return the list of records for package name (possibly empty)."""
+        if self._by_name is None:
+            self._build_indexes()
+        return self._by_name.get(name, [])
+
+
 def _download_channeldata(channel_url):
     with TemporaryDirectory() as td:
         tf = os.path.join(td, "channeldata.json")
@@ -234,21 +316,21 @@ def get_build_index(subdir, bldpkgs_dir, output_folder=None, clear_cache=False,
                 if subdir == 'noarch':
                     subdir = conda_interface.subdir
                 try:
-                    cached_index = get_index(channel_urls=urls,
-                                    prepend=not omit_defaults,
-                                    use_local=False,
-                                    use_cache=False,
-                                    platform=subdir)
+                    cached_index = BuildIndex(get_index(channel_urls=urls,
+                                                        prepend=not omit_defaults,
+                                                        use_local=False,
+                                                        use_cache=False,
+                                                        platform=subdir))
                 # HACK: defaults does not have the many subfolders we support.  Omit it and
                 #          try again.
                 except CondaHTTPError:
                     if 'defaults' in urls:
                         urls.remove('defaults')
-                    cached_index = get_index(channel_urls=urls,
-                                             prepend=omit_defaults,
-                                             use_local=False,
-                                             use_cache=False,
-                                             platform=subdir)
+                    cached_index = BuildIndex(get_index(channel_urls=urls,
+                                                        prepend=omit_defaults,
+                                                        use_local=False,
+                                                        use_cache=False,
+                                                        platform=subdir))
 
             expanded_channels = {rec.channel for rec in cached_index.values()}
 
@@ -256,13 +338,8 @@ def get_build_index(subdir, bldpkgs_dir, output_folder=None, clear_cache=False,
             # we need channeldata.json too, as it is a more reliable source of run_exports data
             for channel in expanded_channels:
                 if channel.scheme == "file":
-                    location = channel.location
-                    if utils.on_win:
-                        location = location.lstrip("/")
-                    elif (not os.path.isabs(channel.location) and
-                            os.path.exists(os.path.join(os.path.sep, channel.location))):
-                        location = os.path.join(os.path.sep, channel.location)
-                    channeldata_file = os.path.join(location, channel.name, 'channeldata.json')
+                    channeldata_file = os.path.join(_get_channel_location(channel), channel.name,
+                                                    'channeldata.json')
                     retry = 0
                     max_retries = 10
                     while retry < max_retries:
@@ -286,12 +363,58 @@ def get_build_index(subdir, bldpkgs_dir, output_folder=None, clear_cache=False,
                     packages.update(channel_data[channel.name])
                     superchannel['packages'] = packages
             channel_data['defaults'] = superchannel
+            run_exports_index.clear()
         local_index_timestamp = os.path.getmtime(index_file)
         local_subdir = subdir
         cached_channels = channel_urls
     return cached_index, local_index_timestamp, channel_data
 
 
+def _get_channel_location(channel):
+    location = channel.location
+    if utils.on_win:
+        location = location.lstrip("/")
+    elif (not os.path.isabs(channel.location) and
+            os.path.exists(os.path.join(os.path.sep, channel.location))):
+        location = os.path.join(os.path.sep, channel.location)
+    return location
+
+
+def _run_exports_from_index(pkg, channel_data):
+    channel = pkg.channel
+    # local channels keep the exact run_exports of each file in their index cache
+    if channel.scheme == "file":
+        cache_path = os.path.join(_get_channel_location(channel), channel.name, pkg.subdir,
+                                  '.cache', 'run_exports', pkg.fn + '.json')
+        try:
+            with open(cache_path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            pass
+    package_data = channel_data.get(channel.name, {}).get('packages', {}).get(pkg.name)
+    if not package_data or 'run_exports' not in package_data:
+        return None
+    run_exports = package_data['run_exports']
+    if run_exports and all(isinstance(v, dict) for v in run_exports.values()):
+        # newer channeldata records run_exports per version
+        return run_exports.get(pkg.version)
+    # otherwise it only describes the channel's reference package for this name
+    if package_data.get('reference_package') == "%s/%s" % (pkg.subdir, pkg.fn):
+        return run_exports
+    return None
+
+
+def get_run_exports_from_index(pkg, channel_data):
+    """Look up the run_exports of a package record in channeldata and in the local index cache,
+    without downloading the package.  Returns None when the index can't answer."""
+    if not hasattr(pkg, 'channel') or not hasattr(pkg, 'fn'):
+        return None
+    key = getattr(pkg, 'url', None) or (pkg.channel.name, pkg.subdir, pkg.fn)
+    if key not in run_exports_index:
+        run_exports_index[key] = _run_exports_from_index(pkg, channel_data)
+    return run_exports_index[key]
+
+
 def _ensure_valid_channel(local_folder, subdir):
     for folder in {subdir, 'noarch'}:
         path = os.path.join(local_folder, folder)
@@ -300,7 +423,8 @@ def _ensure_valid_channel(local_folder, subdir):
 
 
 def update_index(dir_path, check_md5=False, channel_name=None, patch_generator=None, threads=MAX_THREADS_DEFAULT,
-                 verbose=False, progress=False, hotfix_source_repo=None, subdirs=None, warn=True):
+                 verbose=False, progress=False, hotfix_source_repo=None, subdirs=None, warn=True,
+                 watch=False, watch_interval=2.0, write_shards=False, patch_cache=True):
     """
     If dir_path contains a directory named 'noarch', the path tree therein is treated
     as though it's a full channel, with a level of subdirs, each subdir having an update
@@ -310,6 +434,8 @@ def update_index(dir_path, check_md5=False, channel_name=None, patch_generator=N
     one '*.tar.bz2' file, the directory is assumed to be a standard subdir, and only repodata.json
     information will be updated.
 
+    With watch=True, this does not return: after indexing, the channel is kept indexed as
+    packages change (see ChannelIndex.watch).
     """
     base_path, dirname = os.path.split(dir_path)
     if dirname in DEFAULT_SUBDIRS:
@@ -318,11 +444,24 @@ def update_index(dir_path, check_md5=False, channel_name=None, patch_generator=N
                     "Please update your code to point it at the channel root, rather than a subdir.")
         return update_index(base_path, check_md5=check_md5, channel_name=channel_name,
                             threads=threads, verbose=verbose, progress=progress,
-                            hotfix_source_repo=hotfix_source_repo)
-    return ChannelIndex(dir_path, channel_name, subdirs=subdirs, threads=threads,
-                        deep_integrity_check=check_md5).index(patch_generator=patch_generator, verbose=verbose,
-                                                              progress=progress,
-                                                              hotfix_source_repo=hotfix_source_repo)
+                            hotfix_source_repo=hotfix_source_repo, watch=watch,
+                            watch_interval=watch_interval, write_shards=write_shards,
+                            patch_cache=patch_cache)
+    channel_index = ChannelIndex(dir_path, channel_name, subdirs=subdirs, threads=threads,
+                                 deep_integrity_check=check_md5, write_shards=write_shards,
+                                 patch_cache=patch_cache)
+    if watch:
+        return channel_index.watch(patch_generator=patch_generator, verbose=verbose,
+                                   hotfix_source_repo=hotfix_source_repo, interval=watch_interval)
+    return channel_index.index(patch_generator=patch_generator, verbose=verbose,
+                               progress=progress, hotfix_source_repo=hotfix_source_repo)
+
+
+def verify_index(dir_path, subdirs=None, threads=MAX_THREADS_DEFAULT, invalidate_cache=False):
+    """Check every package in the channel at dir_path against its repodata.json.  See
+    ChannelIndex.verify for the report returned."""
+    channel_index = ChannelIndex(dir_path, None, subdirs=subdirs, threads=threads)
+    return channel_index.verify(invalidate_cache=invalidate_cache)
 
 
 def _determine_namespace(info):
@@ -364,6 +503,7 @@ def _make_seconds(timestamp):
 REPODATA_VERSION = 1
 CHANNELDATA_VERSION = 1
 REPODATA_JSON_FN = 'repodata.json'
+REPODATA_DELTAS_FN = 'repodata_deltas.jsonl'
 CHANNELDATA_FIELDS = (
     "description",
     "dev_url",
@@ -407,13 +547,19 @@ def _clear_newline_chars(record, field_name):
 
 
 def _apply_instructions(subdir, repodata, instructions):
+    """Patch repodata with instructions.  Records that change are replaced by changed copies,
+    so the records in repodata['packages'] may be shared with other repodata."""
     repodata.setdefault("removed", [])
-    utils.merge_or_update_dict(repodata.get('packages', {}), instructions.get('packages', {}), merge=False,
+    packages = repodata.setdefault('packages', {})
+    patched = {fn: copy.deepcopy(packages[fn]) for fn in instructions.get('packages', {})
+               if fn in packages}
+    utils.merge_or_update_dict(patched, instructions.get('packages', {}), merge=False,
                                add_missing_keys=False)
+    packages.update(patched)
 
     for fn in instructions.get('revoke', ()):
-        repodata['packages'][fn]['revoked'] = True
-        repodata['packages'][fn]['depends'].append('package_has_been_revoked')
+        packages[fn] = dict(packages[fn], revoked=True,
+                            depends=packages[fn]['depends'] + ['package_has_been_revoked'])
 
     for fn in instructions.get('remove', ()):
         popped = repodata['packages'].pop(fn, None)
@@ -453,49 +599,148 @@ def _get_jinja2_environment():
     return environment
 
 
-def _maybe_write(path, content, write_newline_end=False, content_is_binary=False):
-    temp_path = join(gettempdir(), str(uuid4()))
+# path: (md5, size, mtime) of files the indexer has written or hashed.  A file whose size and
+#    mtime still match its entry is not read again to report its md5; deciding whether to
+#    write a file always looks at the file itself.  Emptied when it reaches this many entries.
+FILE_DIGESTS_CACHE_SIZE = 50000
+_file_digests = {}
+_DIGESTS_FN = 'digests.json'
+
+
+def _remember_digest(path, md5, stat_result=None):
+    stat_result = stat_result or os.stat(path)
+    _cache_put(_file_digests, path, (md5, stat_result.st_size, stat_result.st_mtime),
+               FILE_DIGESTS_CACHE_SIZE)
+
+
+def _has_content(path, content, newline):
+    # compared a block at a time, so large files (like repodata.json) aren't held twice
+    with open(path, 'rb') as fh:
+        offset = 0
+        while offset < len(content):
+            block = fh.read(min(65536, len(content) - offset))
+            if not block or block != content[offset:offset + len(block)]:
+                return False
+            offset += len(block)
+        return fh.read() == newline
+
+
+def _file_digest(path, stat_result=None):
+    """Return (md5, size, mtime) of path, only hashing it if it is not already known."""
+    stat_result = stat_result or os.stat(path)
+    digest = _file_digests.get(path)
+    if not digest or tuple(digest[1:]) != (stat_result.st_size, stat_result.st_mtime):
+        _remember_digest(path, utils.md5_file(path), stat_result)
+        digest = _file_digests[path]
+    return digest
+
 
+def _maybe_write(path, content, write_newline_end=False, content_is_binary=False):
     if not content_is_binary:
         content = ensure_binary(content)
-    with open(temp_path, 'wb') as fh:
-        fh.write(content)
-        if write_newline_end:
-            fh.write(b'\n')
+    newline = b'\n' if write_newline_end else b''
+    md5 = hashlib.md5(content)
+    md5.update(newline)
+    md5 = md5.hexdigest()
     if isfile(path):
-        if utils.md5_file(temp_path) == utils.md5_file(path):
+        stat_result = os.stat(path)
+        if (stat_result.st_size == len(content) + len(newline) and
+                _has_content(path, content, newline)):
             # No need to change mtimes. The contents already match.
-            os.unlink(temp_path)
+            _remember_digest(path, md5, stat_result)
             return False
+
+    temp_path = join(gettempdir(), str(uuid4()))
+    with open(temp_path, 'wb') as fh:
+        fh.write(content)
+        fh.write(newline)
     # log.info("writing %s", path)
     try:
         move(temp_path, path)
     except PermissionError:
         utils.copy_into(temp_path, path)
         os.unlink(temp_path)
+    _remember_digest(path, md5)
     return True
 
 
-def _gather_channeldata_reference_packages(all_repodata_packages):
-    groups = groupby('name', all_repodata_packages)
-    reference_packages = []
-    for group in groups.values():
+def _make_version_key(version_keys):
+    """Return a sort key function for version strings that parses each distinct version only
+    once.  version_keys is the dict the parsed VersionOrder objects are kept in, so passing the
+    same dict around shares them between sorts (and subdirs)."""
+    def version_key(version):
         try:
-            version_groups = groupby('version', group)
-            latest_version = sorted(version_groups, key=VersionOrder)[-1]
-            build_number_groups = groupby('build_number', version_groups[latest_version])
-            latest_build_number = sorted(build_number_groups)[-1]
-            ref_pkg = sorted(build_number_groups[latest_build_number],
-                                key=lambda x: x['subdir'])[-1]
-            ref_pkg["subdirs"] = sorted(set(rec['subdir'] for rec in group))
-            ref_pkg["reference_package"] = "%s/%s" % (ref_pkg["subdir"], ref_pkg["fn"])
-            reference_packages.append(ref_pkg)
-        except KeyError as e:
-            log.warn("group {} failed to gather channeldata.  Error was {}.  Skipping this one...".format(group, e))
-    return reference_packages
+            return version_keys[version]
+        except KeyError:
+            version_keys[version] = key = VersionOrder(version)
+            return key
+    return version_key
 
 
-def _collect_namemap(subdirs, patched_repodata, patch_instructions):
+class _ReferencePackage(object):
+    """The newest package of one name seen so far: its sort key, the subdirs the name is in, and
+    the fields of its record that channeldata uses."""
+    __slots__ = ('key', 'subdirs', 'record')
+
+    def __init__(self):
+        self.key = None
+        self.subdirs = set()
+        self.record = None
+
+
+_REFERENCE_PACKAGE_FIELDS = frozenset(CHANNELDATA_FIELDS) | {'name', 'fn', 'subdir'}
+
+
+def _update_reference_packages(reference_packages, packages, version_key):
+    """Fold package records into reference_packages ({name: _ReferencePackage}).  The reference
+    package of a name is its newest: highest version, then build number, then subdir.  Only a
+    summary of each name is kept, so subdirs can be folded in one at a time."""
+    for rec in packages:
+        try:
+            key = (version_key(rec['version']), rec['build_number'], rec['subdir'])
+            name = rec['name']
+        except KeyError as e:
+            log.warn("package {} failed to gather channeldata.  Error was {}.  Skipping this one...".format(rec, e))
+            continue
+        ref = reference_packages.get(name)
+        if ref is None:
+            reference_packages[name] = ref = _ReferencePackage()
+        ref.subdirs.add(rec['subdir'])
+        if ref.key is None or key >= ref.key:
+            ref.key = key
+            ref.record = {k: v for k, v in rec.items() if k in _REFERENCE_PACKAGE_FIELDS}
+
+
+def _reference_package_records(reference_packages):
+    records = []
+    for ref in reference_packages.values():
+        record = dict(ref.record)
+        record["subdirs"] = sorted(ref.subdirs)
+        record["reference_package"] = "%s/%s" % (record["subdir"], record["fn"])
+        records.append(record)
+    return records
+
+
+def _gather_channeldata_reference_packages(all_repodata_packages, version_keys=None):
+    version_key = _make_version_key({} if version_keys is None else version_keys)
+    reference_packages = {}
+    _update_reference_packages(reference_packages, all_repodata_packages, version_key)
+    return _reference_package_records(reference_packages)
+
+
+def _collect_namekeys(namekeys, packages):
+    """Record the namekey ("namespace:name") of each of the package records in packages, in
+    namekeys ({name_in_channel: [namekeys, in the order seen]}).  The records are left as
+    they are."""
+    for info in packages.values():
+        namespace, name_in_channel, name = _determine_namespace(dict(info))
+        subdir_namekeys = namekeys.setdefault(name_in_channel, [])
+        namekey = namespace + ":" + name
+        if namekey not in subdir_namekeys:
+            subdir_namekeys.append(namekey)
+
+
+def _make_namemap(namekeys, patch_instructions):
     external_dependencies = {
         name_in_channel: namekey
         for pi in patch_instructions.values()
@@ -505,25 +750,17 @@ def _collect_namemap(subdirs, patched_repodata, patch_instructions):
     namemap.update(external_dependencies)
 
     ambiguous_namekeys = defaultdict(set)  # name, namekey
-    for subdir in subdirs:
-        repodata = patched_repodata[subdir]
-        for info in repodata['packages'].values():
-            namespace, name_in_channel, name = _determine_namespace(info)
-            namekey = namespace + ":" + name
-            # TODO: this name_in_channel thing should be dropped if the package has an explicitly assigned namespace
-            if name_in_channel in namemap:
-                # This assertion is important. It guarantees that we don't have packages bridging namespaces.
-                # assert namekey == namemap[name_in_channel], (subdir, namekey, namemap[name_in_channel])
-                if namekey != namemap[name_in_channel]:
-                    ambiguous_namekeys[name_in_channel].add(namemap[name_in_channel])
-                    ambiguous_namekeys[name_in_channel].add(namekey)
-                    # ambiguous_namekeys.append((subdir, name_in_channel, namekey, namemap[name_in_channel], fn))
-            else:
-                namemap[name_in_channel] = namekey
+    for name_in_channel, package_namekeys in namekeys.items():
+        # TODO: this name_in_channel thing should be dropped if the package has an explicitly assigned namespace
+        namekey = namemap.setdefault(name_in_channel, package_namekeys[0])
+        # This check is important. It guarantees that we don't have packages bridging namespaces.
+        if any(other != namekey for other in package_namekeys):
+            ambiguous_namekeys[name_in_channel].add(namekey)
+            ambiguous_namekeys[name_in_channel].update(package_namekeys)
     return namemap, ambiguous_namekeys
 
 
-def _warn_on_ambiguous_namekeys(ambiguous_namekeys, subdirs, patched_repodata):
+def _warn_on_ambiguous_namekeys(ambiguous_packages):
     """
     The following packages ambiguously straddle namespaces and require metadata correction:
         package_name:
@@ -534,55 +771,69 @@ def _warn_on_ambiguous_namekeys(ambiguous_namekeys, subdirs, patched_repodata):
             - subdir/fn3.tar.bz2
             - subdir/fn4.tar.bz2
 
-    The associated packages are being removed from the index.
+    The associated packages have been removed from repodata2 (see _augment_subdir).
     """
-    if ambiguous_namekeys:
-        abc = defaultdict(lambda: defaultdict(list))
-        for subdir in subdirs:
-            repodata = patched_repodata[subdir]
-            for fn, info in repodata['packages'].items():
-                if info["name"] in ambiguous_namekeys:
-                    abc[info["name"]][info["namespace"]].append(subdir + "/" + fn)
-
+    if ambiguous_packages:
         builder = ["WARNING: The following packages ambiguously straddle namespaces and require metadata correction:"]
-        for package_name in sorted(abc):
+        for package_name in sorted(ambiguous_packages):
             builder.append("  %s:" % package_name)
-            for namespace in sorted(abc[package_name]):
+            for namespace in sorted(ambiguous_packages[package_name]):
                 builder.append("    %s:" % namespace)
-                for subdir_fn in sorted(abc[package_name][namespace]):
+                for subdir_fn in sorted(ambiguous_packages[package_name][namespace]):
                     builder.append("      - %s" % subdir_fn)
-                    subdir, fn = subdir_fn.split("/")
-                    popped = patched_repodata[subdir]["packages"].pop(fn, None)
-                    if popped:
-                        patched_repodata[subdir]["removed"].append(fn)
         # we remove them from the v2 repodata, not b1
         # builder.append("The associated packages are being removed from the index.")
         builder.append('')
         log.warn("\n".join(builder))
 
 
+# Dependency strings repeat heavily across packages and subdirs, so parsing and formatting them
+#    is memoized.  The caches are emptied when they reach this many entries.
+MATCHSPEC_CACHE_SIZE = 100000
+_spec_names = {}  # dep_str: spec name, or None if the spec already has a namespace
+_namespaced_specs = {}  # (dep_str, namekey): conda_build_form of the namespaced spec
+
+
+def _cache_put(cache, key, value, max_size=MATCHSPEC_CACHE_SIZE):
+    if len(cache) >= max_size:
+        cache.clear()
+    cache[key] = value
+
+
 def _add_namespace_to_spec(fn, info, dep_str, namemap, missing_dependencies, subdir):
     if not conda_interface.conda_46:
         return dep_str
 
-    spec = MatchSpec(dep_str)
-    if hasattr(spec, 'namespace') and spec.namespace:
+    try:
+        spec_name = _spec_names[dep_str]
+    except KeyError:
+        spec = MatchSpec(dep_str)
+        spec_name = None if hasattr(spec, 'namespace') and spec.namespace else spec.name
+        _cache_put(_spec_names, dep_str, spec_name)
+    if spec_name is None:
         # this spec is fine
         return dep_str
     else:
         # look up namekey
         # spec.name refers to name_in_channel; need to convert to namekey, but the
         #   correct namekey might not even be in the channel
-        if spec.name not in namemap:
-            missing_dependencies[spec.name].append(subdir + "/" + fn)
+        if spec_name not in namemap:
+            missing_dependencies[spec_name].append(subdir + "/" + fn)
             return dep_str
-        namekey = namemap[spec.name]
+        namekey = namemap[spec_name]
+        try:
+            return _namespaced_specs[(dep_str, namekey)]
+        except KeyError:
+            pass
         namespace, name = namekey.split(":", 1)
+        spec = MatchSpec(dep_str)
         try:
             spec = MatchSpec(spec, namespace=namespace, name=name)
         except CondaError:
             spec = MatchSpec(spec, name=name)
-        return spec.conda_build_form()
+        spec_str = spec.conda_build_form()
+        _cache_put(_namespaced_specs, (dep_str, namekey), spec_str)
+        return spec_str
 
 
 def _make_build_string(build, build_number):
@@ -594,7 +845,7 @@ def _make_build_string(build, build_number):
     return build_string
 
 
-def _warn_on_missing_dependencies(missing_dependencies, patched_repodata):
+def _warn_on_missing_dependencies(missing_dependencies):
     """
     The following dependencies do not exist in the channel and are not declared
     as external dependencies:
@@ -606,7 +857,7 @@ def _warn_on_missing_dependencies(missing_dependencies, patched_repodata):
         - subdir/fn3.tar.bz2
         - subdir/fn4.tar.bz2
 
-    The associated packages are being removed from the index.
+    The associated packages have been removed from repodata2 (see _augment_subdir).
     """
 
     if missing_dependencies:
@@ -618,52 +869,99 @@ def _warn_on_missing_dependencies(missing_dependencies, patched_repodata):
             builder.append("  %s" % dep_name)
             for subdir_fn in sorted(missing_dependencies[dep_name]):
                 builder.append("    - %s" % subdir_fn)
-                subdir, fn = subdir_fn.split("/")
-                popped = patched_repodata[subdir]["packages"].pop(fn, None)
-                if popped:
-                    patched_repodata[subdir]["removed"].append(fn)
 
         builder.append("The associated packages are being removed from the index.")
         builder.append('')
         log.warn("\n".join(builder))
 
 
-def _augment_repodata(subdirs, patched_repodata, patch_instructions):
-    augmented_repodata = {}
-
+def _augment_subdir_repodata(subdir, repodata, namemap, missing_dependencies):
+    for fn, info in repodata['packages'].items():
+        info['record_version'] = 1
+        if 'constrains' in info:
+            constrains_names = set(dep.split()[0] for dep in info["constrains"])
+            try:
+                info['constrains2'] = [_add_namespace_to_spec(fn, info, dep, namemap, missing_dependencies, subdir)
+                                    for dep in info['constrains']]
+                info['depends2'] = [_add_namespace_to_spec(fn, info, dep, namemap, missing_dependencies, subdir)
+                                    for dep in info['depends'] if dep.split()[0] not in constrains_names]
+            except CondaError as e:
+                log.warn("Encountered a file ({}) that conda does not like.  Error was: {}.  Skipping this one...".format(fn, e))
+        else:
+            try:
+                info['depends2'] = [_add_namespace_to_spec(fn, info, dep, namemap, missing_dependencies, subdir)
+                                    for dep in info['depends']]
+            except CondaError as e:
+                log.warn("Encountered a file ({}) that conda does not like.  Error was: {}.  Skipping this one...".format(fn, e))
+        # info['build_string'] =_make_build_string(info["build"], info["build_number"])
+
+
+def _augment_subdir(subdir, repodata, namemap, ambiguous_namekeys, patch_instructions,
+                    ambiguous_packages, missing_dependencies):
+    """Return one subdir's patched repodata augmented for repodata2.  Records are copied
+    before they are changed, so repodata is left as it is.
+
+    namemap and ambiguous_namekeys come from _make_namemap, over all subdirs.  Packages
+    straddling namespaces, or depending on packages that aren't in the channel, are removed;
+    they are added to ambiguous_packages and missing_dependencies, to warn about once all
+    subdirs are done."""
     # TODO: handle packages that need to be renamed
 
-    # Step 1. Collect all package names and associated namespaces.
-    #         Attach namespace to every package.
-    namemap, ambiguous_namekeys = _collect_namemap(subdirs, patched_repodata, patch_instructions)
-    _warn_on_ambiguous_namekeys(ambiguous_namekeys, subdirs, patched_repodata)
-    missing_dependencies = defaultdict(list)
+    # Step 1. Attach namespace to every package.
+    packages = {fn: dict(info) for fn, info in repodata['packages'].items()}
+    repodata = dict(repodata, packages=packages)
+    for info in packages.values():
+        _determine_namespace(info)
+    for fn, info in list(packages.items()):
+        if info["name"] in ambiguous_namekeys:
+            ambiguous_packages[info["name"]][info["namespace"]].append(subdir + "/" + fn)
+            del packages[fn]
+
+    # Step 2. Add depends2 and constrains2, and other fields.
+    subdir_missing_dependencies = defaultdict(list)
+    _augment_subdir_repodata(subdir, repodata, namemap, subdir_missing_dependencies)
+    repodata["removed"] = list(patch_instructions.get("remove", []))
+    for dep_name, subdir_fns in subdir_missing_dependencies.items():
+        missing_dependencies[dep_name].extend(subdir_fns)
+        for subdir_fn in subdir_fns:
+            fn = subdir_fn.split("/")[1]
+            if packages.pop(fn, None):
+                repodata["removed"].append(fn)
+    return repodata
 
-    # Step 2. Add depends2 and constrains2, and other fields
-    for subdir in subdirs:
-        repodata = patched_repodata[subdir]
-        for fn, info in repodata['packages'].items():
-            info['record_version'] = 1
-            if 'constrains' in info:
-                constrains_names = set(dep.split()[0] for dep in info["constrains"])
-                try:
-                    info['constrains2'] = [_add_namespace_to_spec(fn, info, dep, namemap, missing_dependencies, subdir)
-                                        for dep in info['constrains']]
-                    info['depends2'] = [_add_namespace_to_spec(fn, info, dep, namemap, missing_dependencies, subdir)
-                                        for dep in info['depends'] if dep.split()[0] not in constrains_names]
-                except CondaError as e:
-                    log.warn("Encountered a file ({}) that conda does not like.  Error was: {}.  Skipping this one...".format(fn, e))
-            else:
-                try:
-                    info['depends2'] = [_add_namespace_to_spec(fn, info, dep, namemap, missing_dependencies, subdir)
-                                        for dep in info['depends']]
-                except CondaError as e:
-                    log.warn("Encountered a file ({}) that conda does not like.  Error was: {}.  Skipping this one...".format(fn, e))
-            # info['build_string'] =_make_build_string(info["build"], info["build_number"])
-        repodata["removed"] = patch_instructions[subdir].get("remove", [])
-        augmented_repodata[subdir] = repodata
-    _warn_on_missing_dependencies(missing_dependencies, patched_repodata)
-    return augmented_repodata
+
+def _augment_subdir_job(namemap, ambiguous_namekeys, job):
+    """_augment_subdir for one subdir of ChannelIndex._write_outputs, made to run in a worker
+    process.  job is (subdir, repodata, patch_instructions), where repodata may instead be the
+    path of the subdir's repodata.json, which is then read here rather than in the main process.
+    Returns the augmented repodata, and the ambiguous packages and missing dependencies found,
+    as plain dicts."""
+    subdir, repodata, patch_instructions = job
+    if isinstance(repodata, string_types):
+        with open(repodata) as fh:
+            repodata = json.load(fh)
+    ambiguous_packages = defaultdict(lambda: defaultdict(list))
+    missing_dependencies = defaultdict(list)
+    repodata = _augment_subdir(subdir, repodata, namemap, ambiguous_namekeys, patch_instructions,
+                               ambiguous_packages, missing_dependencies)
+    return (repodata, {name: dict(namespaces) for name, namespaces in ambiguous_packages.items()},
+            dict(missing_dependencies))
+
+
+def _compact_record(record, strings):
+    """Return a copy of a package record whose keys and string values (including those in
+    lists, like depends) are the shared copies kept in strings, so that the many repeats
+    across a channel are stored once."""
+    def intern_string(value):
+        return strings.setdefault(value, value)
+    compact = {}
+    for key, value in record.items():
+        if isinstance(value, string_types):
+            value = intern_string(value)
+        elif isinstance(value, list):
+            value = [intern_string(v) if isinstance(v, string_types) else v for v in value]
+        compact[intern_string(key)] = value
+    return compact
 
 
 def _cache_post_install_details(loaded_json_text, all_paths, post_install_cache_path):
@@ -744,6 +1042,16 @@ def _cache_recipe_log(tar_path, recipe_log_path):
         fh.write(binary_recipe_log)
 
 
+def _parse_legacy_run_exports(text, name):
+    # info/run_exports, from before run_exports.yaml: one weak spec per line.  Like
+    #    render._read_specs_from_package, leave out the package pinning itself.
+    if hasattr(text, "decode"):
+        text = text.decode("utf-8")
+    weak_specs = set(spec.rstrip() for spec in text.splitlines()
+                     if spec.strip() and not (name and spec.startswith(name)))
+    return {'weak': sorted(weak_specs)} if weak_specs else {}
+
+
 def get_run_exports(tar_or_folder_path):
     run_exports = {}
     if os.path.isfile(tar_or_folder_path):
@@ -755,7 +1063,13 @@ def get_run_exports(tar_or_folder_path):
                 binary_run_exports = _tar_xf_file(tar_or_folder_path, 'info/run_exports.yaml')
                 run_exports = yaml.safe_load(binary_run_exports)
             except KeyError:
-                log.debug("%s has no run_exports file (this is OK)" % tar_or_folder_path)
+                try:
+                    legacy_run_exports = _tar_xf_file(tar_or_folder_path, 'info/run_exports')
+                    name = json.loads(_tar_xf_file(tar_or_folder_path, 'info/index.json')
+                                      .decode('utf-8')).get('name')
+                    run_exports = _parse_legacy_run_exports(legacy_run_exports, name)
+                except KeyError:
+                    log.debug("%s has no run_exports file (this is OK)" % tar_or_folder_path)
     elif os.path.isdir(tar_or_folder_path):
         try:
             with open(os.path.join(tar_or_folder_path, 'info', 'run_exports.json')) as f:
@@ -765,7 +1079,17 @@ def get_run_exports(tar_or_folder_path):
                 with open(os.path.join(tar_or_folder_path, 'info', 'run_exports.yaml')) as f:
                     run_exports = yaml.safe_load(f)
             except (IOError, FileNotFoundError):
-                log.debug("%s has no run_exports file (this is OK)" % tar_or_folder_path)
+                try:
+                    with open(os.path.join(tar_or_folder_path, 'info', 'run_exports')) as f:
+                        legacy_run_exports = f.read()
+                    try:
+                        with open(os.path.join(tar_or_folder_path, 'info', 'index.json')) as f:
+                            name = json.load(f).get('name')
+                    except (IOError, FileNotFoundError):
+                        name = None
+                    run_exports = _parse_legacy_run_exports(legacy_run_exports, name)
+                except (IOError, FileNotFoundError):
+                    log.debug("%s has no run_exports file (this is OK)" % tar_or_folder_path)
     return run_exports
 
 
@@ -838,26 +1162,8 @@ def _get_source_repo_git_info(path):
     return commits
 
 
-@contextlib.contextmanager
-def _tmp_chdir(dest):
-    curdir = os.getcwd()
-    try:
-        os.chdir(dest)
-        yield
-    finally:
-        os.chdir(curdir)
-
-
 def _tar_xf(tarball, dir_path):
-    flags = libarchive.extract.EXTRACT_TIME | \
-            libarchive.extract.EXTRACT_PERM | \
-            libarchive.extract.EXTRACT_SECURE_NODOTDOT | \
-            libarchive.extract.EXTRACT_SECURE_SYMLINKS | \
-            libarchive.extract.EXTRACT_SECURE_NOABSOLUTEPATHS
-    if not os.path.isabs(tarball):
-        tarball = os.path.join(os.getcwd(), tarball)
-    with _tmp_chdir(dir_path):
-        libarchive.extract_file(tarball, flags)
+    tar_xf(tarball, dir_path)
 
 
 def _tar_xf_file(tarball, entries):
@@ -892,6 +1198,122 @@ def _tar_xf_getnames(tarball):
     return result
 
 
+def _read_entries_fully(archive):
+    index_json = None
+    for entry in archive:
+        if entry.name == 'info/index.json':
+            index_json = b''.join(bytes(block) for block in entry.get_blocks())
+        else:
+            for _ in entry.get_blocks():
+                pass
+    return index_json
+
+
+class _KeepReadErrors(object):
+    """A file object for libarchive.stream_reader, which can't pass on errors raised while it
+    reads (like a bad zip member crc); they end the stream, and are kept here to raise."""
+
+    def __init__(self, fh):
+        self.fh = fh
+        self.error = None
+
+    def seekable(self):
+        return False
+
+    def readinto(self, buf):
+        try:
+            return self.fh.readinto(buf)
+        except Exception as e:
+            self.error = e
+            return 0
+
+
+def _read_archive_fully(tar_path):
+    """Decompress every entry of the package at tar_path, returning the content of its
+    info/index.json (None if it has none).  Raises if any part fails to decompress."""
+    if not tar_path.endswith('.conda'):
+        with libarchive.file_reader(tar_path) as archive:
+            return _read_entries_fully(archive)
+    # .conda packages are zips of tarballs, which are read as they are unzipped; zipfile checks
+    #    each member's crc once it has been read to the end
+    index_json = None
+    with zipfile.ZipFile(tar_path) as zf:
+        for name in zf.namelist():
+            with zf.open(name) as member:
+                if name.endswith(('.tar', '.tar.zst', '.tar.bz2')):
+                    stream = _KeepReadErrors(member)
+                    try:
+                        with libarchive.stream_reader(stream) as archive:
+                            index_json = _read_entries_fully(archive) or index_json
+                    except libarchive.exception.ArchiveError:
+                        if stream.error:
+                            raise stream.error
+                        raise
+                    if stream.error:
+                        raise stream.error
+                for _ in iter(lambda: member.read(65536), b''):
+                    pass
+    return index_json
+
+
+VERIFY_INDEX_FIELDS = ('name', 'version', 'build', 'build_number', 'subdir')
+
+
+def _verify_package(args):
+    """Check one package against its repodata record.  Runs in a worker process.
+
+    args is (subdir, fn, tar_path, record, removed), where record is None for packages that
+    are not in repodata.json, and removed says whether repodata.json lists the package as
+    removed.  A removed package has no record to check against, so only its archive is checked.
+    Returns a dict with 'subdir', 'fn', 'removed' and a list of 'problems', empty if the package
+    is sound."""
+    subdir, fn, tar_path, record, removed = args
+    result = {'subdir': subdir, 'fn': fn, 'removed': removed, 'problems': []}
+    problems = result['problems']
+    if not isfile(tar_path):
+        problems.append("package file is missing")
+        return result
+    if record is None:
+        if not removed:
+            problems.append("package is not in %s" % REPODATA_JSON_FN)
+        record = {}
+
+    md5, sha256, size = hashlib.md5(), hashlib.sha256(), 0
+    try:
+        with open(tar_path, 'rb') as fh:
+            for block in iter(lambda: fh.read(65536), b''):
+                md5.update(block)
+                sha256.update(block)
+                size += len(block)
+    except Exception as e:
+        problems.append("package file can't be read: %s" % e)
+        return result
+    actual = {'size': size, 'md5': md5.hexdigest(), 'sha256': sha256.hexdigest()}
+    for key in ('size', 'md5', 'sha256'):
+        if key in record and record[key] != actual[key]:
+            problems.append("%s is %s, but repodata records %s" % (key, actual[key], record[key]))
+
+    try:
+        index_json = _read_archive_fully(tar_path)
+    except Exception as e:
+        # anything going wrong with one package is reported with it, rather than ending the run
+        problems.append("archive does not decompress: %s" % e)
+        return result
+    if index_json is None:
+        problems.append("archive has no info/index.json")
+        return result
+    try:
+        index_json = json.loads(index_json.decode('utf-8'))
+    except (JSONDecodeError, UnicodeDecodeError) as e:
+        problems.append("info/index.json is not valid json: %s" % e)
+        return result
+    for key in VERIFY_INDEX_FIELDS:
+        if key in record and key in index_json and record[key] != index_json[key]:
+            problems.append("info/index.json has %s %r, but repodata records %r"
+                            % (key, index_json[key], record[key]))
+    return result
+
+
 def _collect_commits(package_order, hotfix_source_repo, cutoff_time):
     commit_info = {}
 
@@ -917,15 +1339,190 @@ def _collect_commits(package_order, hotfix_source_repo, cutoff_time):
     return sorted_commit_info
 
 
+_patch_generators = {}
+
+
+def _load_patch_generator(gen_patch_path):
+    """Import the patch generator module at gen_patch_path, once per version of the file."""
+    stat_result = os.stat(gen_patch_path)
+    key = (gen_patch_path, stat_result.st_mtime, stat_result.st_size)
+    if key not in _patch_generators:
+        # https://stackoverflow.com/a/41595552/2127762
+        try:
+            from importlib.util import spec_from_file_location, module_from_spec
+            spec = spec_from_file_location('a_b', gen_patch_path)
+            mod = module_from_spec(spec)
+
+            spec.loader.exec_module(mod)
+        # older pythons
+        except ImportError:
+            import imp
+            mod = imp.load_source('a_b', gen_patch_path)
+        _patch_generators[key] = mod
+    return _patch_generators[key]
+
+
+def _patch_generator_hash(gen_patch_path):
+    """Hash a patch generator for the cache of what it generated: its own contents, and the
+    names, sizes and mtimes of the other Python modules in its directory, which it may import.
+    Modules further down (in a helper package, say) and data files it reads are not looked at;
+    index with patch_cache=False (--no-patch-cache) after changing those."""
+    hasher = hashlib.sha256(ensure_binary(utils.sha256_checksum(gen_patch_path)))
+    gen_patch_dir = dirname(abspath(gen_patch_path))
+    for fn in sorted(os.listdir(gen_patch_dir)):
+        path = join(gen_patch_dir, fn)
+        if not fn.endswith('.py') or path == abspath(gen_patch_path) or not isfile(path):
+            continue
+        stat_result = os.stat(path)
+        hasher.update(ensure_binary('\0%s:%d:%r' % (fn, stat_result.st_size, stat_result.st_mtime)))
+    return hasher.hexdigest()
+
+
+def _generate_patch_instructions(gen_patch_path, subdir_and_repodata):
+    subdir, repodata = subdir_and_repodata
+    instructions = _load_patch_generator(gen_patch_path)._patch_repodata(repodata, subdir)
+    if instructions.get('patch_instructions_version', 0) > 1:
+        raise RuntimeError("Incompatible patch instructions version")
+    return instructions
+
+
+def _repodata_hash(repodata):
+    return hashlib.sha256(ensure_binary(json.dumps(repodata, sort_keys=True))).hexdigest()
+
+
+def _json_pointer_escape(token):
+    return token.replace('~', '~0').replace('/', '~1')
+
+
+def _patched_fns(instructions):
+    """Filenames whose repodata entries the given patch instructions touch."""
+    return set(concatv(instructions.get('packages', {}), instructions.get('revoke', ()),
+                       instructions.get('remove', ())))
+
+
+def _make_repodata_delta(old_fns, old_removed, repodata, changed_fns):
+    """JSON patch (RFC 6902) operations taking the previous repodata to repodata, given the
+    previous filenames and the filenames whose records may have changed."""
+    packages = repodata['packages']
+    ops = []
+    for fn in sorted(changed_fns):
+        path = '/packages/' + _json_pointer_escape(fn)
+        if fn in packages:
+            ops.append({'op': 'replace' if fn in old_fns else 'add', 'path': path,
+                        'value': packages[fn]})
+        elif fn in old_fns:
+            ops.append({'op': 'remove', 'path': path})
+    if repodata.get('removed', []) != old_removed:
+        ops.append({'op': 'add', 'path': '/removed', 'value': repodata.get('removed', [])})
+    return ops
+
+
+class _PollingChannelWatcher(object):
+    """Finds added, changed and removed packages by comparing stat snapshots of each subdir."""
+
+    def __init__(self, channel_root, subdirs):
+        self.channel_root = channel_root
+        self.subdirs = subdirs
+        self._snapshots = {subdir: self._snapshot(subdir) for subdir in subdirs}
+
+    def _snapshot(self, subdir):
+        subdir_path = join(self.channel_root, subdir)
+        snapshot = {}
+        try:
+            fns = os.listdir(subdir_path)
+        except EnvironmentError:
+            return snapshot
+        for fn in fns:
+            if fn.endswith(CONDA_TARBALL_EXTENSIONS):
+                try:
+                    stat_result = os.lstat(join(subdir_path, fn))
+                except EnvironmentError:
+                    continue
+                snapshot[fn] = (stat_result.st_mtime, stat_result.st_size)
+        return snapshot
+
+    def changes(self):
+        changes = {}
+        for subdir in self.subdirs:
+            old, new = self._snapshots[subdir], self._snapshot(subdir)
+            changed = set(fn for fn in set(old) | set(new) if old.get(fn) != new.get(fn))
+            if changed:
+                changes[subdir] = changed
+            self._snapshots[subdir] = new
+        return changes
+
+    def stop(self):
+        pass
+
+
+class _EventChannelWatcher(object):
+    """Collects added, changed and removed packages from filesystem events (inotify on Linux)."""
+
+    def __init__(self, channel_root, subdirs):
+        self.channel_root = channel_root
+        self.subdirs = subdirs
+        self._changes = defaultdict(set)
+        self._lock = threading.Lock()
+        handler = FileSystemEventHandler()
+        handler.on_any_event = self._on_event
+        self._observer = Observer()
+        for subdir in subdirs:
+            self._observer.schedule(handler, join(channel_root, subdir), recursive=False)
+        self._observer.start()
+
+    def _on_event(self, event):
+        if event.is_directory:
+            return
+        for path in (event.src_path, getattr(event, 'dest_path', None)):
+            if not path:
+                continue
+            subdir_path, fn = os.path.split(path)
+            subdir = basename(subdir_path)
+            if subdir in self.subdirs and fn.endswith(CONDA_TARBALL_EXTENSIONS):
+                with self._lock:
+                    self._changes[subdir].add(fn)
+
+    def changes(self):
+        with self._lock:
+            changes, self._changes = self._changes, defaultdict(set)
+        return dict(changes)
+
+    def stop(self):
+        self._observer.stop()
+        self._observer.join()
+
+
 class ChannelIndex(object):
 
     def __init__(self, channel_root, channel_name, subdirs=None, threads=MAX_THREADS_DEFAULT,
-                 deep_integrity_check=False):
+                 deep_integrity_check=False, write_shards=False, patch_cache=True):
         self.channel_root = abspath(channel_root)
         self.channel_name = channel_name or basename(channel_root.rstrip('/'))
         self._subdirs = subdirs
         self.thread_executor = ThreadLimitedThreadPoolExecutor(threads)
+        self.max_workers = threads or MAX_THREADS_DEFAULT
         self.deep_integrity_check = deep_integrity_check
+        self.write_shards = write_shards
+        self.patch_cache = patch_cache
+        # state kept between updates when watching; see watch()
+        self._resident = False
+        self._packages = {}
+        self._stat_caches = {}
+        self._patched_repodata = {}
+        self._patch_instructions = {}
+        self._repodata2 = {}
+        # what the repodata2 of every subdir was augmented with
+        self._namemap = None
+        self._ambiguous_namekeys = None
+        # for repodata deltas: what the previous generation of each subdir's repodata held, and
+        #    which packages have changed since
+        self._previous_repodata = {}
+        self._changed_fns = {}
+        # version string: VersionOrder, shared by all the sorting done for this channel
+        self._version_keys = {}
+        # the strings of package records, shared between records (see _compact_record)
+        self._strings = {}
+        self._load_digests()
 
     def index(self, patch_generator, hotfix_source_repo=None, verbose=False, progress=False):
         if verbose:
@@ -944,46 +1541,330 @@ class ChannelIndex(object):
 
             # Step 1. Lock local channel.
             with utils.try_acquire_locks([utils.get_lock(self.channel_root)], timeout=900):
-                # Step 2. Collect repodata from packages.
-                repodata_from_packages = {}
                 with tqdm(total=len(subdirs), disable=(verbose or not progress)) as t:
-                    for subdir in subdirs:
+                    # Step 2. Collect repodata from packages, as each subdir comes up.
+                    def load_repodata(subdir):
                         t.set_description("Subdir: %s" % subdir)
                         t.update()
                         _ensure_valid_channel(self.channel_root, subdir)
-                        repodata_from_packages[subdir] = self.index_subdir(subdir, verbose=verbose, progress=progress)
-
-                # Step 3. Apply patch instructions.
-                patched_repodata = {}
-                patch_instructions = {}
-                for subdir in subdirs:
-                    patched_repodata[subdir], patch_instructions[subdir] = self._patch_repodata(
-                        subdir, repodata_from_packages[subdir], patch_generator)
-
-                # Step 4. Save patched and augmented repodata.
-                for subdir in subdirs:
-                    # If the contents of repodata have changed, write a new repodata.json file.
-                    # Also create associated index.html.
-                    self._write_repodata(subdir, patched_repodata[subdir])
-
-                # Step 5. Augment repodata with additional information.
-                augmented_repodata = _augment_repodata(subdirs, patched_repodata, patch_instructions)
-
-                # Step 6. Create and save repodata2.json
-                repodata2 = {}
-                for subdir in subdirs:
-                    repodata2[subdir] = self._create_repodata2(subdir, augmented_repodata[subdir])
-                    changed = self._write_repodata2(subdir, repodata2[subdir])
-                    if changed:
-                        self._write_subdir_index_html(subdir, repodata2[subdir])
-
-                # Step 7. Create and write channeldata.
-                all_repodata_packages = tuple(concat(repodata["packages"] for repodata in repodata2.values()))
-                reference_packages = _gather_channeldata_reference_packages(all_repodata_packages)
-                channel_data, package_mtimes = self._build_channeldata(subdirs, reference_packages)
-                self._write_channeldata_index_html(channel_data)
-                self._write_channeldata_rss(channel_data, package_mtimes, hotfix_source_repo)
-                self._write_channeldata(channel_data)
+                        return self.index_subdir(subdir, verbose=verbose, progress=progress)
+
+                    self._write_outputs(subdirs, load_repodata, patch_generator,
+                                        hotfix_source_repo)
+
+    def verify(self, invalidate_cache=False):
+        """Check every package in the channel, in a pool of worker processes: its size, md5 and
+        sha256 against repodata.json, that the whole archive decompresses, and that its
+        info/index.json agrees with its record.  Packages missing from either side are
+        reported too, except for those that repodata.json lists as removed (by patch
+        instructions): only their archives are checked, and their problems do not count as
+        failures.
+
+        Returns a report of the form
+            {
+              'channel': '/path/to/channel',
+              'packages': [{'subdir': 'linux-64', 'fn': 'a-1.0-0.tar.bz2', 'removed': False,
+                            'problems': []}, ...],
+              'checked': 10,
+              'failed': 1,
+            }
+
+        Nothing is written, unless invalidate_cache is True: then the stat cache entries of the
+        packages that failed are dropped, so that the next index run re-extracts them."""
+        if self._subdirs:
+            subdirs = sorted(set(self._subdirs))
+        else:
+            subdirs = sorted(subdir for subdir in os.listdir(self.channel_root)
+                             if subdir in DEFAULT_SUBDIRS and isdir(join(self.channel_root, subdir)))
+        items = []
+        for subdir in subdirs:
+            subdir_path = join(self.channel_root, subdir)
+            if not isdir(subdir_path):
+                continue
+            try:
+                with open(join(subdir_path, REPODATA_JSON_FN)) as fh:
+                    repodata = json.load(fh)
+            except (EnvironmentError, JSONDecodeError):
+                repodata = {}
+            records = repodata.get('packages', {})
+            removed = set(repodata.get('removed', ()))
+            fns = set(records) | set(fn for fn in os.listdir(subdir_path)
+                                     if fn.endswith(CONDA_TARBALL_EXTENSIONS))
+            items.extend((subdir, fn, join(subdir_path, fn), records.get(fn), fn in removed)
+                         for fn in sorted(fns))
+
+        results = utils.map_in_processes(_verify_package, items, self.max_workers)
+        failed = [result for result in results if result['problems'] and not result['removed']]
+        if invalidate_cache:
+            for subdir, results_for_subdir in groupby('subdir', failed).items():
+                stat_cache_path = join(self.channel_root, subdir, '.cache', 'stat.json')
+                try:
+                    with open(stat_cache_path) as fh:
+                        stat_cache = json.load(fh) or {}
+                except (EnvironmentError, JSONDecodeError):
+                    continue
+                for result in results_for_subdir:
+                    stat_cache.pop(result['fn'], None)
+                with open(stat_cache_path, 'w') as fh:
+                    json.dump(stat_cache, fh)
+        return {
+            'channel': self.channel_root,
+            'packages': results,
+            'checked': len(results),
+            'failed': len(failed),
+        }
+
+    def _write_outputs(self, changed_subdirs, load_repodata, patch_generator,
+                       hotfix_source_repo=None):
+        """Rebuild the outputs of changed_subdirs, and the channel's.  load_repodata(subdir)
+        returns the repodata collected from the packages of a changed subdir.
+
+        Subdirs are taken through the steps a few at a time, and unless the index is resident
+        (see watch()) their repodata is let go once written, so memory use follows the largest
+        subdirs rather than the whole channel.  That takes two passes, as augmenting any subdir
+        needs the names of the packages in all of them: the first patches and writes
+        repodata.json, noting the names, and the second reads repodata.json back to augment it
+        into repodata2.json.  Both passes work on batches of up to MAX_SUBDIRS_IN_FLIGHT subdirs
+        (and no more than max_workers): in the first, the batch's patch generators run side by
+        side, and in the second the batch is augmented in worker processes, which read back
+        repodata.json themselves.  When resident, the second pass also redoes unchanged subdirs
+        if those names changed.  Channeldata only keeps a summary of each package
+        name."""
+        changed_subdirs = set(changed_subdirs)
+        namekeys = OrderedDict()
+        batch_size = max(1, min(self.max_workers, MAX_SUBDIRS_IN_FLIGHT))
+        for start in range(0, len(self.subdirs), batch_size):
+            batch = self.subdirs[start:start + batch_size]
+            # Step 3. Apply patch instructions.
+            batch_repodata = self._patch_subdirs(
+                [subdir for subdir in batch if subdir in changed_subdirs], load_repodata,
+                patch_generator)
+            for subdir in batch:
+                if subdir in changed_subdirs:
+                    patched_repodata = batch_repodata.pop(subdir)
+                    # Step 4. Save patched repodata.
+                    #    If the contents of repodata have changed, write a new repodata.json file.
+                    self._write_repodata(subdir, patched_repodata)
+                    if self.write_shards:
+                        self._write_repodata_shards(subdir, patched_repodata)
+                    if self._resident:
+                        self._patched_repodata[subdir] = patched_repodata
+                else:
+                    patched_repodata = self._patched_repodata[subdir]
+                _collect_namekeys(namekeys, patched_repodata['packages'])
+                del patched_repodata
+        namemap, ambiguous_namekeys = _make_namemap(namekeys, self._patch_instructions)
+        del namekeys
+        augmented_subdirs = changed_subdirs
+        if self._resident:
+            # dependencies are resolved across subdirs, so new or removed names can change the
+            #    repodata2 of subdirs whose packages did not change
+            if (namemap, ambiguous_namekeys) != (self._namemap, self._ambiguous_namekeys):
+                augmented_subdirs = set(self.subdirs)
+            self._namemap, self._ambiguous_namekeys = namemap, ambiguous_namekeys
+
+        ambiguous_packages = defaultdict(lambda: defaultdict(list))
+        missing_dependencies = defaultdict(list)
+        reference_packages = {}
+        version_key = _make_version_key(self._version_keys)
+        augment = partial(_augment_subdir_job, namemap, ambiguous_namekeys)
+        for start in range(0, len(self.subdirs), batch_size):
+            batch = self.subdirs[start:start + batch_size]
+            # Step 5. Augment repodata with additional information.
+            to_augment = [subdir for subdir in batch if subdir in augmented_subdirs]
+            results = utils.map_in_processes(augment, [
+                (subdir,
+                 self._patched_repodata[subdir] if self._resident
+                 else join(self.channel_root, subdir, REPODATA_JSON_FN),
+                 self._patch_instructions[subdir])
+                for subdir in to_augment], jobs=self.max_workers)
+            batch_repodata = {}
+            for subdir, (repodata, subdir_ambiguous, subdir_missing) in zip(to_augment, results):
+                batch_repodata[subdir] = repodata
+                for name, namespaces in subdir_ambiguous.items():
+                    for namespace, subdir_fns in namespaces.items():
+                        ambiguous_packages[name][namespace].extend(subdir_fns)
+                for dep_name, subdir_fns in subdir_missing.items():
+                    missing_dependencies[dep_name].extend(subdir_fns)
+            del results
+            for subdir in batch:
+                if subdir in augmented_subdirs:
+                    # Step 6. Create and save repodata2.json.  Also create associated index.html.
+                    repodata2 = self._create_repodata2(subdir, batch_repodata.pop(subdir))
+                    if self._write_repodata2(subdir, repodata2):
+                        self._write_subdir_index_html(subdir, repodata2)
+                    if self._resident:
+                        self._repodata2[subdir] = repodata2
+                else:
+                    repodata2 = self._repodata2[subdir]
+                _update_reference_packages(reference_packages, repodata2["packages"], version_key)
+                del repodata2
+        _warn_on_ambiguous_namekeys(ambiguous_packages)
+        _warn_on_missing_dependencies(missing_dependencies)
+
+        # Step 7. Create and write channeldata.
+        channel_data, package_mtimes = self._build_channeldata(
+            self.subdirs, _reference_package_records(reference_packages))
+        self._write_channeldata_index_html(channel_data)
+        self._write_channeldata_rss(channel_data, package_mtimes, hotfix_source_repo)
+        self._write_channeldata(channel_data)
+        self._save_digests()
+
+    def _patch_subdirs(self, subdirs, load_repodata, patch_generator):
+        """Collect the repodata of subdirs with load_repodata(subdir), and patch it.  Their patch
+        instructions are generated together.  Returns {subdir: patched repodata}."""
+        repodata_from_packages = OrderedDict((subdir, load_repodata(subdir)) for subdir in subdirs)
+        generated_instructions = self._create_patch_instructions_for_subdirs(
+            subdirs, repodata_from_packages, patch_generator)
+        patched = {}
+        for subdir in subdirs:
+            previous_instructions = self._patch_instructions.get(subdir)
+            if previous_instructions is None:
+                previous_instructions = self._load_instructions(subdir)
+            patched[subdir], self._patch_instructions[subdir] = self._patch_repodata(
+                subdir, repodata_from_packages.pop(subdir), patch_generator,
+                instructions=generated_instructions.get(subdir))
+            if self._patch_instructions[subdir] != previous_instructions:
+                # re-patched records count as changed too
+                self._changed_fns.setdefault(subdir, set()).update(
+                    _patched_fns(previous_instructions) |
+                    _patched_fns(self._patch_instructions[subdir]))
+        return patched
+
+    def _compact_record(self, record):
+        return _compact_record(record, self._strings)
+
+    def _load_digests(self):
+        # digests of the channel's files from previous runs, reported (in index.html) while the
+        #    file's size and mtime still match
+        try:
+            with open(join(self.channel_root, '.cache', _DIGESTS_FN)) as fh:
+                digests = json.load(fh)
+        except (EnvironmentError, JSONDecodeError):
+            return
+        for relpath, digest in digests.items():
+            path = join(self.channel_root, relpath)
+            if path not in _file_digests:
+                _cache_put(_file_digests, path, tuple(digest), FILE_DIGESTS_CACHE_SIZE)
+
+    def _save_digests(self):
+        prefix = join(self.channel_root, '')
+        digests = {path[len(prefix):]: digest for path, digest in list(_file_digests.items())
+                   if path.startswith(prefix) and lexists(path)}
+        cache_path = join(self.channel_root, '.cache')
+        try:
+            if not isdir(cache_path):
+                os.makedirs(cache_path)
+            with open(join(cache_path, _DIGESTS_FN), 'w') as fh:
+                json.dump(digests, fh)
+        except EnvironmentError as e:
+            log.debug("could not save file digests: %s", e)
+
+    def watch(self, patch_generator, hotfix_source_repo=None, verbose=False, interval=2.0,
+              debounce=1.0, stop_event=None):
+        """Index the channel, then keep it indexed as packages are added, replaced or removed.
+
+        Repodata, stat caches and channeldata stay in memory between updates, so an update only
+        extracts the changed packages and rewrites the outputs of the subdirs they are in.
+        Changes come from filesystem events when watchdog is installed, and from polling the
+        subdirs every `interval` seconds otherwise.  An update happens once no further changes
+        have been seen for `debounce` seconds.  Runs until stop_event (a threading.Event) is set.
+        """
+        self._resident = True
+        stop_event = stop_event or threading.Event()
+        # start watching before the initial index, so that nothing is missed in between
+        subdirs = self._subdirs or [subdir for subdir in DEFAULT_SUBDIRS
+                                    if isdir(join(self.channel_root, subdir))]
+        subdirs = sorted(set(subdirs) | {'noarch'})
+        for subdir in subdirs:
+            _ensure_valid_channel(self.channel_root, subdir)
+        watcher = (_EventChannelWatcher if Observer else _PollingChannelWatcher)(
+            self.channel_root, subdirs)
+        try:
+            self._subdirs = subdirs
+            self.index(patch_generator, hotfix_source_repo=hotfix_source_repo, verbose=verbose)
+            log.info("Watching %s for package changes", self.channel_root)
+            pending = defaultdict(set)
+            last_change = None
+            while not stop_event.is_set():
+                changes = watcher.changes()
+                if changes:
+                    for subdir, fns in changes.items():
+                        pending[subdir].update(fns)
+                    last_change = time.time()
+                elif pending and time.time() - last_change >= debounce:
+                    updated = self.update_subdirs(pending, patch_generator,
+                                                  hotfix_source_repo=hotfix_source_repo,
+                                                  verbose=verbose)
+                    if updated:
+                        log.info("Updated index for %s", ', '.join(updated))
+                    pending = defaultdict(set)
+                stop_event.wait(min(interval, debounce) if pending else interval)
+        finally:
+            watcher.stop()
+
+    def update_subdirs(self, changes, patch_generator, hotfix_source_repo=None, verbose=False):
+        """Bring the index up to date with changes, a {subdir: filenames} mapping of packages
+        that were added, replaced or removed, using the state kept in memory by watch().
+
+        Returns the subdirs whose repodata changed."""
+        level = logging.DEBUG if verbose else logging.ERROR
+        with utils.LoggingContext(level, loggers=[__name__]):
+            with utils.try_acquire_locks([utils.get_lock(self.channel_root)], timeout=900):
+                repodata_from_packages = {}
+                for subdir, fns in changes.items():
+                    if subdir in self.subdirs and self._update_subdir_packages(subdir, fns):
+                        repodata_from_packages[subdir] = {
+                            'packages': dict(self._packages[subdir]),
+                            'info': {
+                                'subdir': subdir,
+                            },
+                            'repodata_version': REPODATA_VERSION,
+                        }
+                updated = sorted(repodata_from_packages)
+                if updated:
+                    self._write_outputs(updated, repodata_from_packages.pop, patch_generator,
+                                        hotfix_source_repo)
+        return updated
+
+    def _update_subdir_packages(self, subdir, fns):
+        subdir_path = join(self.channel_root, subdir)
+        packages = self._packages[subdir]
+        stat_cache = self._stat_caches[subdir]
+        stat_cache_original = stat_cache.copy()
+        changed = False
+        self._changed_fns[subdir] = set(fns)
+        extract_set = []
+        for fn in sorted(fns):
+            try:
+                stat_result = os.lstat(join(subdir_path, fn))
+            except EnvironmentError:
+                if fn in packages:
+                    del packages[fn]
+                    changed = True
+                stat_cache.pop(fn, None)
+                continue
+            if (fn not in packages or
+                    stat_cache.get(fn) != {'mtime': stat_result.st_mtime,
+                                           'size': stat_result.st_size}):
+                extract_set.append(fn)
+        futures = tuple(self.thread_executor.submit(self._extract_to_cache, subdir, fn)
+                        for fn in extract_set)
+        for future in as_completed(futures):
+            fn, mtime, size, index_json = future.result()
+            if index_json is not None:
+                stat_cache[fn] = {'mtime': mtime, 'size': size}
+                packages[fn] = self._compact_record(index_json)
+                changed = True
+            elif fn in packages:
+                # corrupt (perhaps still being written); drop it until it changes again
+                del packages[fn]
+                stat_cache.pop(fn, None)
+                changed = True
+        if stat_cache != stat_cache_original:
+            with open(join(subdir_path, '.cache', 'stat.json'), 'w') as fh:
+                json.dump(stat_cache, fh)
+        return changed
 
     def index_subdir(self, subdir, verbose=False, progress=False):
         subdir_path = join(self.channel_root, subdir)
@@ -1000,14 +1881,22 @@ class ChannelIndex(object):
         log.debug("found %d conda packages in %s" % (len(fns_in_subdir), subdir))
 
         # load current/old repodata
+        old_repodata_sha256 = None
         try:
-            with open(repodata_json_path) as fh:
-                old_repodata = json.load(fh) or {}
-        except (EnvironmentError, JSONDecodeError):
+            with open(repodata_json_path, 'rb') as fh:
+                old_repodata_binary = fh.read()
+            old_repodata = json.loads(old_repodata_binary.decode('utf-8')) or {}
+            old_repodata_sha256 = hashlib.sha256(old_repodata_binary).hexdigest()
+        except (EnvironmentError, JSONDecodeError, UnicodeDecodeError):
             # log.info("no repodata found at %s", repodata_json_path)
             old_repodata = {}
         old_repodata_packages = old_repodata.get("packages", {})
         old_repodata_fns = set(old_repodata_packages)
+        self._previous_repodata[subdir] = {
+            'fns': old_repodata_fns,
+            'removed': old_repodata.get('removed', []),
+            'sha256': old_repodata_sha256,
+        }
 
         # Load stat cache. The stat cache has the form
         #   {
@@ -1023,7 +1912,7 @@ class ChannelIndex(object):
                     stat_cache = json.load(fh) or {}
             except (EnvironmentError, JSONDecodeError):
                 pass
-        stat_cache_original = stat_cache.copy()
+        stat_cache_changed = False
 
         try:
             # calculate all the paths and figure out what we're going to do with them
@@ -1062,6 +1951,7 @@ class ChannelIndex(object):
             for fn in removed_set:
                 if fn in stat_cache:
                     del stat_cache[fn]
+                    stat_cache_changed = True
 
             new_repodata_packages = {}
             for fn in sorted(unchanged_set):
@@ -1092,7 +1982,10 @@ class ChannelIndex(object):
                         t.set_description("Hash & extract: %s" % fn)
                         t.update()
                         stat_cache[fn] = {'mtime': mtime, 'size': size}
-                        new_repodata_packages[fn] = index_json
+                        stat_cache_changed = True
+                        new_repodata_packages[fn] = self._compact_record(index_json)
+
+            self._changed_fns[subdir] = set(concatv(add_set, update_set, remove_set))
 
             new_repodata = {
                 'packages': new_repodata_packages,
@@ -1102,10 +1995,15 @@ class ChannelIndex(object):
                 'repodata_version': REPODATA_VERSION,
             }
         finally:
-            if stat_cache != stat_cache_original:
+            if stat_cache_changed:
                 # log.info("writing stat cache to %s", stat_cache_path)
                 with open(stat_cache_path, 'w') as fh:
                     json.dump(stat_cache, fh)
+        if self._resident:
+            # patching removes packages from new_repodata (but leaves their records alone), so
+            #    keep our own mapping of what the packages say
+            self._packages[subdir] = dict(new_repodata_packages)
+            self._stat_caches[subdir] = stat_cache
         return new_repodata
 
     def _ensure_dirs(self, subdir):
@@ -1203,7 +2101,7 @@ class ChannelIndex(object):
         log.debug("loading index cache %s" % index_cache_path)
         with open(index_cache_path) as fh:
             index_json = json.load(fh)
-        return index_json
+        return self._compact_record(index_json)
 
     def _load_all_from_cache(self, subdir, fn):
         subdir_path = join(self.channel_root, subdir)
@@ -1238,14 +2136,15 @@ class ChannelIndex(object):
             channel_icon_fn = "%s.%s" % (data['name'], icon_ext)
             icon_url = "icons/" + channel_icon_fn
             icon_channel_path = join(self.channel_root, 'icons', channel_icon_fn)
-            icon_md5 = utils.md5_file(icon_cache_path)
-            icon_hash = "md5:%s:%s" % (icon_md5, getsize(icon_cache_path))
+            icon_md5, icon_size, _ = _file_digest(icon_cache_path)
+            icon_hash = "md5:%s:%s" % (icon_md5, icon_size)
             data.update(icon_hash=icon_hash, icon_url=icon_url)
             if lexists(icon_channel_path) and utils.md5_file(icon_channel_path) != icon_md5:
                 os.unlink(icon_channel_path)
             if not lexists(icon_channel_path):
                 # log.info("writing icon from %s to %s", icon_cache_path, icon_channel_path)
                 copy2(icon_cache_path, icon_channel_path)
+                _remember_digest(icon_channel_path, icon_md5)
 
         # have to stat again, because we don't have access to the stat cache here
         data['mtime'] = mtime
@@ -1270,22 +2169,100 @@ class ChannelIndex(object):
         new_repodata_binary = json.dumps(repodata, indent=2, sort_keys=True,
                                   separators=(',', ': ')).encode("utf-8")
         write_result = _maybe_write(repodata_json_path, new_repodata_binary, write_newline_end=True)
+        new_sha256 = hashlib.sha256(new_repodata_binary + b'\n').hexdigest()
         if write_result:
             repodata_bz2_path = repodata_json_path + ".bz2"
             bz2_content = bz2.compress(new_repodata_binary)
             _maybe_write(repodata_bz2_path, bz2_content, content_is_binary=True)
+            self._write_repodata_delta(subdir, repodata, new_sha256)
+        # this is now the previous generation for the next delta (when watching)
+        self._previous_repodata[subdir] = {
+            'fns': set(repodata['packages']),
+            'removed': list(repodata.get('removed', [])),
+            'sha256': new_sha256,
+        }
+        self._changed_fns.pop(subdir, None)
         return write_result
 
+    def _write_repodata_shards(self, subdir, repodata):
+        """Write repodata split by package name: one shard per name, stored under
+        shards/<sha256 of the shard>.json, and a repodata_shards.json manifest mapping each name
+        to its shard.  Shards that did not change keep their file.  Ones no longer in the
+        manifest are kept for one more generation, for clients that fetched the previous
+        manifest just before this one was written, and removed once the manifest changes
+        again."""
+        subdir_path = join(self.channel_root, subdir)
+        shards_path = join(subdir_path, SHARDS_DIR)
+        if not isdir(shards_path):
+            os.makedirs(shards_path)
+        shards = {}
+        for name, fns in groupby(lambda fn: repodata['packages'][fn]['name'],
+                                 repodata['packages']).items():
+            shard = {
+                'info': repodata.get('info', {'subdir': subdir}),
+                'packages': {fn: repodata['packages'][fn] for fn in fns},
+            }
+            content = ensure_binary(json.dumps(shard, sort_keys=True, separators=(',', ':')))
+            shards[name] = shard_hash = hashlib.sha256(content).hexdigest()
+            shard_path = join(shards_path, shard_hash + '.json')
+            if not isfile(shard_path):
+                _maybe_write(shard_path, content, content_is_binary=True)
+        manifest = {
+            'info': repodata.get('info', {'subdir': subdir}),
+            'repodata_version': repodata.get('repodata_version', REPODATA_VERSION),
+            'shards': shards,
+        }
+        manifest_path = join(subdir_path, REPODATA_SHARDS_FN)
+        try:
+            with open(manifest_path) as fh:
+                previous_shards = json.load(fh).get('shards', {})
+        except (EnvironmentError, JSONDecodeError):
+            previous_shards = {}
+        if _maybe_write(manifest_path, json.dumps(manifest, indent=2, sort_keys=True,
+                                                  separators=(',', ': ')), True):
+            keep = set(shard_hash + '.json'
+                       for shard_hash in set(shards.values()) | set(previous_shards.values()))
+            for fn in os.listdir(shards_path):
+                if fn not in keep:
+                    os.unlink(join(shards_path, fn))
+
+    def _write_repodata_delta(self, subdir, repodata, new_sha256):
+        """Append the change from the previous repodata.json to repodata to the subdir's
+        repodata_deltas.jsonl.
+
+        Each line is one generation: {"from": sha256 of the previous repodata.json,
+        "to": sha256 of the new one, "timestamp": ..., "patch": [JSON patch operations]}.
+        A client holding the file with hash "from" can apply "patch" and check the result against
+        "to", then carry on down the chain.  The operations come from the packages known to have
+        changed, rather than from diffing the two documents."""
+        previous = self._previous_repodata.get(subdir)
+        if not previous or not previous['sha256']:
+            # no previous generation (or not one we know about) to start a delta from
+            return
+        ops = _make_repodata_delta(previous['fns'], previous['removed'], repodata,
+                                   self._changed_fns.get(subdir, ()))
+        delta = {
+            'from': previous['sha256'],
+            'to': new_sha256,
+            'timestamp': int(time.time()),
+            'patch': ops,
+        }
+        deltas_path = join(self.channel_root, subdir, REPODATA_DELTAS_FN)
+        with open(deltas_path, 'ab') as fh:
+            fh.write(ensure_binary(json.dumps(delta, sort_keys=True, separators=(',', ':'))))
+            fh.write(b'\n')
+
     def _write_subdir_index_html(self, subdir, repodata):
         repodata_packages = repodata["packages"]
         subdir_path = join(self.channel_root, subdir)
 
         def _add_extra_path(extra_paths, path):
             if isfile(join(self.channel_root, path)):
+                md5, size, mtime = _file_digest(path)
                 extra_paths[basename(path)] = {
-                    'size': getsize(path),
-                    'timestamp': int(getmtime(path)),
-                    'md5': utils.md5_file(path),
+                    'size': size,
+                    'timestamp': int(mtime),
+                    'md5': md5,
                 }
 
         extra_paths = OrderedDict()
@@ -1376,25 +2353,7 @@ class ChannelIndex(object):
         gen_patch_path = patch_generator or join(self.channel_root, 'gen_patch.py')
         if isfile(gen_patch_path):
             log.debug("using patch generator %s for %s" % (gen_patch_path, subdir))
-
-            # https://stackoverflow.com/a/41595552/2127762
-            try:
-                from importlib.util import spec_from_file_location, module_from_spec
-                spec = spec_from_file_location('a_b', gen_patch_path)
-                mod = module_from_spec(spec)
-
-                spec.loader.exec_module(mod)
-            # older pythons
-            except ImportError:
-                import imp
-                mod = imp.load_source('a_b', gen_patch_path)
-
-            instructions = mod._patch_repodata(repodata, subdir)
-
-            if instructions.get('patch_instructions_version', 0) > 1:
-                raise RuntimeError("Incompatible patch instructions version")
-
-            return instructions
+            return _generate_patch_instructions(gen_patch_path, (subdir, repodata))
         else:
             if patch_generator:
                 raise ValueError("Specified metadata patch file '{}' does not exist.  Please try an absolute "
@@ -1402,6 +2361,52 @@ class ChannelIndex(object):
                                  .format(patch_generator))
             return {}
 
+    def _create_patch_instructions_for_subdirs(self, subdirs, repodata_from_packages,
+                                               patch_generator=None):
+        """Run the patch generator for each of subdirs, in worker processes.
+
+        Results are cached in each subdir's .cache, keyed by the hashes of the generator (see
+        _patch_generator_hash) and of the repodata it is given, so subdirs whose packages have
+        not changed (with an unchanged generator) are not patched again.  Not all of the
+        generator's inputs can be seen, so with patch_cache=False every subdir is patched
+        again (and the results cached anew).  Returns {subdir: instructions}; subdirs that
+        don't use a patch generator script are left out."""
+        gen_patch_path = patch_generator or join(self.channel_root, 'gen_patch.py')
+        if (patch_generator and patch_generator.endswith("bz2")) or not isfile(gen_patch_path):
+            return {}
+        generator_hash = _patch_generator_hash(gen_patch_path)
+        instructions = {}
+        to_generate = []
+        for subdir in subdirs:
+            key = generator_hash + ':' + _repodata_hash(repodata_from_packages[subdir])
+            cache_path = join(self.channel_root, subdir, '.cache', 'patch_instructions.json')
+            try:
+                with open(cache_path) as fh:
+                    cached = json.load(fh)
+            except (EnvironmentError, JSONDecodeError):
+                cached = {}
+            if self.patch_cache and cached.get('key') == key:
+                log.debug("using cached patch instructions for %s" % subdir)
+                instructions[subdir] = cached['instructions']
+            else:
+                to_generate.append((subdir, key, cache_path))
+
+        if to_generate:
+            log.debug("using patch generator %s for %s" % (
+                gen_patch_path, ', '.join(subdir for subdir, _, _ in to_generate)))
+        # generators may change what they are given; when watching, that is shared with the
+        #    packages kept in memory
+        maybe_copy = copy.deepcopy if self._resident else (lambda repodata: repodata)
+        results = utils.map_in_processes(
+            partial(_generate_patch_instructions, gen_patch_path),
+            [(subdir, maybe_copy(repodata_from_packages[subdir])) for subdir, _, _ in to_generate],
+            jobs=self.max_workers)
+        for (subdir, key, cache_path), subdir_instructions in zip(to_generate, results):
+            instructions[subdir] = subdir_instructions
+            with open(cache_path, 'w') as fh:
+                json.dump({'key': key, 'instructions': subdir_instructions}, fh)
+        return instructions
+
     def _write_patch_instructions(self, subdir, instructions):
         new_patch = json.dumps(instructions, indent=2, sort_keys=True, separators=(',', ': '))
         patch_instructions_path = join(self.channel_root, subdir, 'patch_instructions.json')
@@ -1418,8 +2423,11 @@ class ChannelIndex(object):
                 return instructions
         return {}
 
-    def _patch_repodata(self, subdir, repodata, patch_generator=None):
-        if patch_generator and patch_generator.endswith("bz2"):
+    def _patch_repodata(self, subdir, repodata, patch_generator=None, instructions=None):
+        if instructions is not None:
+            # already generated, by _create_patch_instructions_for_subdirs
+            pass
+        elif patch_generator and patch_generator.endswith("bz2"):
             instructions = self._load_patch_instructions_tarball(subdir, patch_generator)
         else:
             instructions = self._create_patch_instructions(subdir, repodata, patch_generator)
@@ -1483,10 +2491,11 @@ class ChannelIndex(object):
             if info.get('revoked'):
                 revoked_set.add(fn)
 
+        version_key = _make_version_key(self._version_keys)
         sort_key = lambda x: (
             x["namespace"] == "global" and "0" or x["namespace"],
             x["name"],
-            VersionOrder(x["version"]),
+            version_key(x["version"]),
             x["build_number"],
             # x["build_string"],
             x["build"],
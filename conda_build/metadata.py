@@ -416,6 +416,31 @@ default_structs = {
 }
 
 
+def _copy_meta(obj, memo=None):
+    """Deep copy of parsed metadata.  Metadata is made of dicts, lists and scalars, which can be
+    copied much faster than copy.deepcopy does for arbitrary objects.  Containers that appear
+    more than once are copied once, like deepcopy would."""
+    if memo is None:
+        memo = {}
+    if obj is None or isinstance(obj, (string_types, bool, int, float)):
+        return obj
+    if id(obj) in memo:
+        return memo[id(obj)]
+    if type(obj) in (dict, OrderedDict):
+        new = type(obj)()
+        memo[id(obj)] = new
+        for k, v in obj.items():
+            new[k] = _copy_meta(v, memo)
+    elif type(obj) is list:
+        new = []
+        memo[id(obj)] = new
+        new.extend(_copy_meta(v, memo) for v in obj)
+    else:
+        new = copy.deepcopy(obj, memo)
+        memo[id(obj)] = new
+    return new
+
+
 def sanitize(meta):
     """
     Sanitize the meta-data to remove aliases/handle deprecation
@@ -486,7 +511,8 @@ def _str_version(package_meta):
 FIELDS = {
     'package': {'name', 'version'},
     'source': {'fn', 'url', 'md5', 'sha1', 'sha256', 'path',
-               'git_url', 'git_tag', 'git_branch', 'git_rev', 'git_depth',
+               'git_url', 'git_tag', 'git_branch', 'git_rev', 'git_depth', 'git_filter',
+               'git_sparse_paths',
                'hg_url', 'hg_tag',
                'svn_url', 'svn_rev', 'svn_ignore_externals',
                'folder',
@@ -834,7 +860,20 @@ def stringify_numbers():
             loader.yaml_implicit_resolvers[ch] = implicit_resolver_backup[ch]
 
 
+class _SharedMeta(object):
+    """The number of MetaData objects sharing one set of parsed contents; see MetaData.meta."""
+    __slots__ = ('holders', )
+
+    def __init__(self):
+        self.holders = 1
+
+
 class MetaData(object):
+    # parsed contents shared with copies (None when private), and whether references into
+    #    them may have been handed out
+    _meta_share = None
+    _meta_exposed = True
+
     def __init__(self, path, config=None, variant=None):
 
         self.undefined_jinja_vars = []
@@ -861,6 +900,35 @@ class MetaData(object):
         self.config.disable_pip = self.disable_pip
         # establish whether this recipe should squish build and host together
 
+    @property
+    def meta(self):
+        # copy() shares the parsed contents between the original and the copy, as long as no
+        #    references into them have been handed out.  Whichever object accesses them first
+        #    then makes its private copy, and the last one left keeps the shared contents.
+        #    Nested values can be modified by whoever gets them, so any access counts as a write.
+        self._own_meta()
+        self._meta_exposed = True
+        return self._meta
+
+    @meta.setter
+    def meta(self, value):
+        self._release_meta()
+        self._meta = value
+        # whoever assigned value may still hold it
+        self._meta_exposed = True
+
+    def _release_meta(self):
+        if self._meta_share is not None:
+            self._meta_share.holders -= 1
+            self._meta_share = None
+
+    def _own_meta(self):
+        if self._meta_share is not None:
+            shared = self._meta_share.holders > 1
+            self._release_meta()
+            if shared:
+                self._meta = _copy_meta(self._meta)
+
     @property
     def is_cross(self):
         return (bool(self.get_depends_top_and_out('host')) or
@@ -1074,7 +1142,8 @@ class MetaData(object):
         if autotype and default is None and field in default_structs:
             default = default_structs[field]()
 
-        section_data = self.get_section(section)
+        # read without making a private copy of shared contents.  Containers are checked below.
+        section_data = self._meta.get(section, {})
         if isinstance(section_data, dict):
             assert not index, \
                 "Got non-zero index ({}), but section {} is not a list.".format(index, section)
@@ -1105,6 +1174,12 @@ class MetaData(object):
         if value is None:
             value = default
 
+        if value is not default and isinstance(value, (dict, list, set)):
+            # this one might get modified.  Take it from our own copy.
+            if self._meta_share is not None:
+                self.meta
+                return self.get_value(name, default=default, autotype=autotype)
+            self._meta_exposed = True
         return value
 
     def check_fields(self):
@@ -1127,7 +1202,7 @@ class MetaData(object):
         return True
 
     def name(self, fail_ok=False):
-        res = self.meta.get('package', {}).get('name', '')
+        res = self._meta.get('package', {}).get('name', '')
         if not res and not fail_ok:
             sys.exit('Error: package/name missing in: %r' % self.meta_path)
         res = text_type(res)
@@ -1750,8 +1825,18 @@ class MetaData(object):
     def copy(self):
         new = copy.copy(self)
         new.config = self.config.copy()
-        new.config.variant = copy.deepcopy(self.config.variant)
-        new.meta = copy.deepcopy(self.meta)
+        if self._meta_exposed and self._meta_share is None:
+            # the contents may still be changed through references held elsewhere, which the
+            #    copy must not see
+            new._meta = _copy_meta(self._meta)
+        else:
+            # contents are copied lazily, by whichever of the two accesses them first; see the
+            #    meta property
+            if self._meta_share is None:
+                self._meta_share = _SharedMeta()
+            self._meta_share.holders += 1
+            new._meta_share = self._meta_share
+        new._meta_exposed = False
         new.type = getattr(self, 'type', 'conda')
         return new
 
@@ -1943,7 +2028,7 @@ class MetaData(object):
                 # save only one element from this key
                 reduced_collapsed_variants[key] = utils.ensure_list(next(iter(values)))
 
-        out = variants.dict_of_lists_to_list_of_dicts(reduced_collapsed_variants)
+        out = variants.VariantSpace(reduced_collapsed_variants)
         return out
 
     def get_output_metadata_set(self, permit_undefined_jinja=False,
@@ -7,6 +7,7 @@
 from __future__ import absolute_import, division, print_function
 
 from collections import OrderedDict, defaultdict
+from functools import partial
 from locale import getpreferredencoding
 import json
 import os
@@ -29,14 +30,15 @@ from .conda_interface import pkgs_dirs
 from .conda_interface import conda_43
 from .conda_interface import specs_from_url
 from .conda_interface import memoized
+from .conda_interface import NoPackagesFoundError
 
 from conda_build import exceptions, utils, environ
 from conda_build.metadata import MetaData, combine_top_level_metadata_with_output
 import conda_build.source as source
 from conda_build.variants import (get_package_variants, list_of_dicts_to_dict_of_lists,
-                                  filter_by_key_value)
+                                  filter_by_key_value, VariantSpace)
 from conda_build.exceptions import DependencyNeedsBuildingError
-from conda_build.index import get_build_index
+from conda_build.index import get_build_index, get_run_exports_from_index
 # from conda_build.jinja_context import pin_subpackage_against_outputs
 
 try:
@@ -203,10 +205,26 @@ def _filter_run_exports(specs, ignore_list):
     return filtered_specs
 
 
-def find_pkg_dir_or_file_in_pkgs_dirs(pkg_dist, m, files_only=False):
+def _get_pkgs_dirs_inventory(m):
+    """List the contents of every pkgs dir once, so that looking for many packages does not
+    stat each of them in every pkgs dir."""
+    inventory = OrderedDict()
+    for pkgs_dir in pkgs_dirs + list(m.config.bldpkgs_dirs):
+        try:
+            inventory[pkgs_dir] = set(os.listdir(pkgs_dir))
+        except (IOError, OSError):
+            inventory[pkgs_dir] = set()
+    return inventory
+
+
+def find_pkg_dir_or_file_in_pkgs_dirs(pkg_dist, m, files_only=False, inventory=None):
     _pkgs_dirs = pkgs_dirs + list(m.config.bldpkgs_dirs)
     pkg_loc = None
     for pkgs_dir in _pkgs_dirs:
+        if (inventory is not None and pkgs_dir in inventory and
+                pkg_dist not in inventory[pkgs_dir] and
+                pkg_dist + CONDA_TARBALL_EXTENSIONS[0] not in inventory[pkgs_dir]):
+            continue
         pkg_dir = os.path.join(pkgs_dir, pkg_dist)
         pkg_file = os.path.join(pkgs_dir, pkg_dist + CONDA_TARBALL_EXTENSIONS[0])
         if not files_only and os.path.isdir(pkg_dir):
@@ -287,32 +305,37 @@ def execute_download_actions(m, actions, env, package_subset=None, require_files
     package_subset = utils.ensure_list(package_subset)
     selected_packages = set()
     if package_subset:
+        linked = set(packages)
+        linked_by_name = {}
+        for link_pkg in packages:
+            linked_by_name.setdefault(link_pkg.name, link_pkg)
         for pkg in package_subset:
             if hasattr(pkg, 'name'):
-                if pkg in packages:
+                if pkg in linked:
                     selected_packages.add(pkg)
             else:
                 pkg_name = pkg.split()[0]
-                for link_pkg in packages:
-                    if pkg_name == link_pkg.name:
-                        selected_packages.add(link_pkg)
-                        break
+                if pkg_name in linked_by_name:
+                    selected_packages.add(linked_by_name[pkg_name])
         packages = selected_packages
 
+    inventory = _get_pkgs_dirs_inventory(m)
+
     for pkg in packages:
         if hasattr(pkg, 'dist_name'):
             pkg_dist = pkg.dist_name
         else:
             pkg = strip_channel(pkg)
             pkg_dist = pkg.split(' ')[0]
-        pkg_loc = find_pkg_dir_or_file_in_pkgs_dirs(pkg_dist, m, files_only=require_files)
+        pkg_loc = find_pkg_dir_or_file_in_pkgs_dirs(pkg_dist, m, files_only=require_files,
+                                                    inventory=inventory)
 
         # ran through all pkgs_dirs, and did not find package or folder.  Download it.
         # TODO: this is a vile hack reaching into conda's internals. Replace with
         #    proper conda API when available.
         if not pkg_loc and conda_43:
             try:
-                pkg_record = [_ for _ in index if _.dist_name == pkg_dist][0]
+                pkg_record = index.get_by_dist_name(pkg_dist)
                 # the conda 4.4 API uses a single `link_prefs` kwarg
                 # whereas conda 4.3 used `index` and `link_dists` kwargs
                 pfe = ProgressiveFetchExtract(link_prefs=(index[pkg_record],))
@@ -332,24 +355,46 @@ def execute_download_actions(m, actions, env, package_subset=None, require_files
 
 
 def get_upstream_pins(m, actions, env):
-    """Download packages from specs, then inspect each downloaded package for additional
-    downstream dependency specs.  Return these additional specs."""
+    """Find additional downstream dependency specs (run_exports) for the packages from specs.
+    These come from the index (channeldata and local index caches) where possible; only
+    packages the index can't answer for are downloaded and inspected."""
 
     env_specs = m.meta.get('requirements', {}).get(env, [])
     explicit_specs = [req.split(' ')[0] for req in env_specs] if env_specs else []
     linked_packages = actions.get('LINK', [])
     linked_packages = [pkg for pkg in linked_packages if pkg.name in explicit_specs]
 
-    pkg_locs_and_dists = execute_download_actions(m, actions, env=env,
-                                                  package_subset=linked_packages)
-
     ignore_list = utils.ensure_list(m.get_value('build/ignore_run_exports'))
 
+    _, _, channel_data = get_build_index(getattr(m.config, '{}_subdir'.format(env)),
+                                         bldpkgs_dir=m.config.bldpkgs_dir,
+                                         output_folder=m.config.output_folder,
+                                         channel_urls=m.config.channel_urls,
+                                         debug=m.config.debug, verbose=m.config.verbose,
+                                         locking=m.config.locking, timeout=m.config.timeout)
     additional_specs = {}
-    for (loc, dist) in pkg_locs_and_dists.values():
-        specs = _read_specs_from_package(loc, dist)
-        additional_specs = utils.merge_dicts_of_lists(additional_specs,
-                                                      _filter_run_exports(specs, ignore_list))
+    missing_packages = []
+    for pkg in linked_packages:
+        specs = get_run_exports_from_index(pkg, channel_data)
+        if specs is None:
+            missing_packages.append(pkg)
+        else:
+            additional_specs = utils.merge_dicts_of_lists(additional_specs,
+                                                          _filter_run_exports(specs, ignore_list))
+
+    if missing_packages:
+        # only fetch what the index could not answer for
+        actions = dict(actions)
+        for action in ('FETCH', 'EXTRACT'):
+            if action in actions:
+                actions[action] = [pkg for pkg in actions[action]
+                                   if not hasattr(pkg, 'name') or pkg in missing_packages]
+        pkg_locs_and_dists = execute_download_actions(m, actions, env=env,
+                                                      package_subset=missing_packages)
+        for (loc, dist) in pkg_locs_and_dists.values():
+            specs = _read_specs_from_package(loc, dist)
+            additional_specs = utils.merge_dicts_of_lists(additional_specs,
+                                                          _filter_run_exports(specs, ignore_list))
     return additional_specs
 
 
@@ -643,10 +688,67 @@ def reparse(metadata):
     return metadata
 
 
+def _render_variant(metadata, used_variables, allow_no_other_outputs, bypass_env_check,
+                    variant):
+    """Render one top-level variant of metadata.  Returns the key that distribute_variants uses
+    to deduplicate, and a (metadata, need_download, need_reparse_in_env) tuple."""
+    mv = metadata.copy()
+    mv.config.variant = variant
+
+    pin_run_as_build = variant.get('pin_run_as_build', {})
+    if mv.numpy_xx and 'numpy' not in pin_run_as_build:
+        pin_run_as_build['numpy'] = {'min_pin': 'x.x', 'max_pin': 'x.x'}
+
+    conform_dict = {}
+    for key in used_variables:
+        # We use this variant in the top-level recipe.
+        # constrain the stored variants to only this version in the output
+        #     variant mapping
+        conform_dict[key] = variant[key]
+
+    for key, values in conform_dict.items():
+        mv.config.variants = (filter_by_key_value(mv.config.variants, key, values,
+                                                  'distribute_variants_reduction') or
+                              mv.config.variants)
+
+    pin_run_as_build = variant.get('pin_run_as_build', {})
+    if mv.numpy_xx and 'numpy' not in pin_run_as_build:
+        pin_run_as_build['numpy'] = {'min_pin': 'x.x', 'max_pin': 'x.x'}
+
+    if isinstance(mv.config.variants, VariantSpace):
+        mv.config.variants = mv.config.variants.with_value('pin_run_as_build',
+                                                           pin_run_as_build)
+    else:
+        numpy_pinned_variants = []
+        for _variant in mv.config.variants:
+            _variant['pin_run_as_build'] = pin_run_as_build
+            numpy_pinned_variants.append(_variant)
+        mv.config.variants = numpy_pinned_variants
+
+    mv.config.squished_variants = list_of_dicts_to_dict_of_lists(mv.config.variants)
+
+    if mv.needs_source_for_render and mv.variant_in_source:
+        mv.parse_again()
+        utils.rm_rf(mv.config.work_dir)
+        source.provide(mv)
+        mv.parse_again()
+
+    try:
+        mv.parse_until_resolved(allow_no_other_outputs=allow_no_other_outputs,
+                                bypass_env_check=bypass_env_check)
+    except SystemExit:
+        pass
+    need_source_download = (not mv.needs_source_for_render or not mv.source_provided)
+
+    return ((mv.dist(),
+             mv.config.variant.get('target_platform', mv.config.subdir),
+             tuple((var, mv.config.variant.get(var)) for var in mv.get_used_vars())),
+            (mv, need_source_download, None))
+
+
 def distribute_variants(metadata, variants, permit_unsatisfiable_variants=False,
                         allow_no_other_outputs=False, bypass_env_check=False):
     rendered_metadata = {}
-    need_source_download = True
 
     # don't bother distributing python if it's a noarch package
     if metadata.noarch or metadata.noarch_python:
@@ -671,56 +773,15 @@ def distribute_variants(metadata, variants, permit_unsatisfiable_variants=False,
     used_variables = metadata.get_used_loop_vars(force_global=False)
     top_loop = metadata.get_reduced_variant_set(used_variables)
 
-    for variant in top_loop:
-        mv = metadata.copy()
-        mv.config.variant = variant
-
-        pin_run_as_build = variant.get('pin_run_as_build', {})
-        if mv.numpy_xx and 'numpy' not in pin_run_as_build:
-            pin_run_as_build['numpy'] = {'min_pin': 'x.x', 'max_pin': 'x.x'}
-
-        conform_dict = {}
-        for key in used_variables:
-            # We use this variant in the top-level recipe.
-            # constrain the stored variants to only this version in the output
-            #     variant mapping
-            conform_dict[key] = variant[key]
-
-        for key, values in conform_dict.items():
-            mv.config.variants = (filter_by_key_value(mv.config.variants, key, values,
-                                                      'distribute_variants_reduction') or
-                                  mv.config.variants)
-
-        pin_run_as_build = variant.get('pin_run_as_build', {})
-        if mv.numpy_xx and 'numpy' not in pin_run_as_build:
-            pin_run_as_build['numpy'] = {'min_pin': 'x.x', 'max_pin': 'x.x'}
+    # variants are independent of each other, so they can be rendered in worker processes.  Not
+    #    when source is needed to render, though - all variants share one work dir.
+    jobs = 1 if metadata.needs_source_for_render else metadata.config.jobs
+    for key, rendered in utils.map_in_processes(
+            partial(_render_variant, metadata, used_variables, allow_no_other_outputs,
+                    bypass_env_check),
+            top_loop, jobs=jobs):
+        rendered_metadata[key] = rendered
 
-        numpy_pinned_variants = []
-        for _variant in mv.config.variants:
-            _variant['pin_run_as_build'] = pin_run_as_build
-            numpy_pinned_variants.append(_variant)
-        mv.config.variants = numpy_pinned_variants
-
-        mv.config.squished_variants = list_of_dicts_to_dict_of_lists(mv.config.variants)
-
-        if mv.needs_source_for_render and mv.variant_in_source:
-            mv.parse_again()
-            utils.rm_rf(mv.config.work_dir)
-            source.provide(mv)
-            mv.parse_again()
-
-        try:
-            mv.parse_until_resolved(allow_no_other_outputs=allow_no_other_outputs,
-                                    bypass_env_check=bypass_env_check)
-        except SystemExit:
-            pass
-        need_source_download = (not mv.needs_source_for_render or not mv.source_provided)
-
-        rendered_metadata[(mv.dist(),
-                           mv.config.variant.get('target_platform', mv.config.subdir),
-                           tuple((var, mv.config.variant.get(var))
-                                 for var in mv.get_used_vars()))] = \
-                                    (mv, need_source_download, None)
     # list of tuples.
     # each tuple item is a tuple of 3 items:
     #    metadata, need_download, need_reparse_in_env
@@ -737,6 +798,44 @@ def expand_outputs(metadata_tuples):
     return list(expanded_outputs.values())
 
 
+def get_output_metas(permit_unsatisfiable_variants, finalize, bypass_env_check, metadata_tuple):
+    """Expand one (metadata, need_download, need_reparse_in_env) tuple from render_recipe into
+    its outputs.  Returns a list of (key, tuple) pairs; api.render deduplicates on the key."""
+    meta, download, render_in_env = metadata_tuple
+    trim_skip = meta.config.trim_skip
+    output_metas = []
+    if meta.skip() and trim_skip:
+        return output_metas
+    for od, om in meta.get_output_metadata_set(
+            permit_unsatisfiable_variants=permit_unsatisfiable_variants,
+            permit_undefined_jinja=not finalize,
+            bypass_env_check=bypass_env_check):
+        if om.skip() and trim_skip:
+            continue
+        if 'type' not in od or od['type'] == 'conda':
+            if finalize and not om.final:
+                try:
+                    om = finalize_metadata(om,
+                            permit_unsatisfiable_variants=permit_unsatisfiable_variants)
+                except (DependencyNeedsBuildingError, NoPackagesFoundError):
+                    if not permit_unsatisfiable_variants:
+                        raise
+
+            # remove outputs section from output objects for simplicity
+            if not om.path and om.meta.get('outputs'):
+                om.parent_outputs = om.meta['outputs']
+                del om.meta['outputs']
+
+            name = om.dist()
+        else:
+            name = "{}: {}".format(om.type, om.name())
+        output_metas.append(((name, om.config.variant.get('target_platform'),
+                              tuple((var, om.config.variant[var])
+                                    for var in om.get_used_vars())),
+                             (om, download, render_in_env)))
+    return output_metas
+
+
 def render_recipe(recipe_path, config, no_download_source=False, variants=None,
                   permit_unsatisfiable_variants=True, reset_build_id=True, bypass_env_check=False):
     """Returns a list of tuples, each consisting of
@@ -753,9 +852,7 @@ def render_recipe(recipe_path, config, no_download_source=False, variants=None,
     if isfile(arg):
         if arg.endswith(('.tar', '.tar.gz', '.tgz', '.tar.bz2')):
             recipe_dir = tempfile.mkdtemp()
-            t = tarfile.open(arg, 'r:*')
-            t.extractall(path=recipe_dir)
-            t.close()
+            utils.tar_xf(arg, recipe_dir)
             need_cleanup = True
         elif arg.endswith('.yaml'):
             recipe_dir = os.path.dirname(arg)
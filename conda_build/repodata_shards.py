@@ -0,0 +1,81 @@
+# (c) Continuum Analytics, Inc. / http://continuum.io
+# All Rights Reserved
+#
+# conda is distributed under the terms of the BSD 3-clause license.
+# Consult LICENSE.txt or http://opensource.org/licenses/BSD-3-Clause.
+
+"""Client side of sharded repodata.
+
+conda index --shards writes, next to each subdir's repodata.json, one shard per package name
+(shards/<sha256 of the shard>.json, in the form of repodata.json holding just that name's
+packages) and a repodata_shards.json manifest mapping each name to its shard (see
+ChannelIndex._write_repodata_shards).  load_repodata_shards reads only the shards a set of
+package names needs.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import hashlib
+import json
+import os
+from os.path import basename
+
+from .conda_interface import download, TemporaryDirectory
+
+REPODATA_SHARDS_FN = 'repodata_shards.json'
+SHARDS_DIR = 'shards'
+
+
+def _read_channel_file(url):
+    if '://' not in url:
+        with open(url, 'rb') as fh:
+            return fh.read()
+    with TemporaryDirectory() as td:
+        tf = os.path.join(td, basename(url))
+        download(url, tf)
+        with open(tf, 'rb') as fh:
+            return fh.read()
+
+
+def load_repodata_shards(channel_url, subdir, names, subdirs=None):
+    """Load repodata for just the packages named in names, and the packages they depend on
+    (transitively), from a channel indexed with sharded repodata (conda index --shards).
+
+    Names are looked up in all of subdirs (by default subdir and noarch), as the packages of
+    one subdir depend on those of noarch and vice versa.  channel_url may be a url or a local
+    path.  Returns {subdir: dict in the form of repodata.json, holding only those packages}."""
+    if subdirs is None:
+        subdirs = [subdir, 'noarch'] if subdir != 'noarch' else [subdir]
+    manifests = {}
+    for shard_subdir in subdirs:
+        subdir_url = '/'.join((channel_url.rstrip('/'), shard_subdir))
+        manifests[shard_subdir] = json.loads(
+            _read_channel_file('/'.join((subdir_url, REPODATA_SHARDS_FN))).decode('utf-8'))
+    packages = {shard_subdir: {} for shard_subdir in subdirs}
+    seen = set()
+    to_load = list(names)
+    while to_load:
+        name = to_load.pop()
+        if name in seen:
+            continue
+        seen.add(name)
+        for shard_subdir in subdirs:
+            shard_hash = manifests[shard_subdir]['shards'].get(name)
+            if shard_hash is None:
+                continue
+            subdir_url = '/'.join((channel_url.rstrip('/'), shard_subdir))
+            content = _read_channel_file('/'.join((subdir_url, SHARDS_DIR, shard_hash + '.json')))
+            if hashlib.sha256(content).hexdigest() != shard_hash:
+                raise RuntimeError("Repodata shard for %s in %s does not match its hash"
+                                   % (name, subdir_url))
+            for fn, info in json.loads(content.decode('utf-8'))['packages'].items():
+                packages[shard_subdir][fn] = info
+                to_load.extend(dep.split()[0] for dep in info.get('depends', ()))
+    return {
+        shard_subdir: {
+            'info': manifests[shard_subdir]['info'],
+            'packages': packages[shard_subdir],
+            'repodata_version': manifests[shard_subdir]['repodata_version'],
+        }
+        for shard_subdir in subdirs
+    }
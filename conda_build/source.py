@@ -1,23 +1,32 @@
 from __future__ import absolute_import, division, print_function
 
+import atexit
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import io
+import json
 import locale
 import os
 from os.path import join, isdir, isfile, abspath, basename, exists, normpath, expanduser
 import re
 import shutil
+import stat
+import subprocess
 from subprocess import CalledProcessError
 import sys
+import tempfile
+import threading
 import time
+from uuid import uuid4
 
 from .conda_interface import download, TemporaryDirectory
-from .conda_interface import hashsum_file
 
 from conda_build.os_utils import external
 from conda_build.conda_interface import url_path, CondaHTTPError
 from conda_build.utils import (decompressible_exts, tar_xf, safe_print_unicode, copy_into, on_win, ensure_list,
                                check_output_env, check_call_env, convert_path_for_cygwin_or_msys2,
-                               get_logger, rm_rf, LoggingContext)
+                               get_logger, rm_rf, LoggingContext, parse_size)
 
 
 if on_win:
@@ -28,6 +37,9 @@ if sys.version_info[0] == 3:
 else:
     from urlparse import urljoin
 
+# upper bound on the number of url sources fetched at the same time
+MAX_CONCURRENT_DOWNLOADS = 8
+
 git_submod_re = re.compile(r'(?:.+)\.(.+)\.(?:.+)\s(.+)')
 ext_re = re.compile(r"(.*?)(\.(?:tar\.)?[^.]+)$")
 
@@ -36,6 +48,128 @@ def append_hash_to_fn(fn, hash_value):
     return ext_re.sub(r"\1_{}\2".format(hash_value[:10]), fn)
 
 
+# The source cache is content-addressed: every download is stored once, as
+#    <src_cache>/sha256/<sha256 digest><extension>, whatever url or filename it came from.
+#    <src_cache>/extracted/<digest> optionally holds the unpacked tree of an archive,
+#    <src_cache>/patched/<key> the tree of a recipe's url sources after its patches, and
+#    <src_cache>/index.json maps recipe md5/sha1 hashes to digests, and records the size of the
+#    extracted and patched trees.  Sources without a hash are always downloaded again, so urls
+#    are not recorded.
+_source_index_lock = threading.Lock()
+
+
+def _source_index_path(cache_folder):
+    return join(cache_folder, 'index.json')
+
+
+def _read_source_index(cache_folder):
+    try:
+        with open(_source_index_path(cache_folder)) as f:
+            index = json.load(f)
+    except (IOError, OSError, ValueError):
+        index = {}
+    # written by earlier versions, and never read
+    index.pop('urls', None)
+    for section in ('hashes', 'extracted', 'patched'):
+        index.setdefault(section, {})
+    return index
+
+
+def _update_source_index(cache_folder, update):
+    """Apply update(index) to the source index and write it back atomically.  The index is only
+    a shortcut to the store, so a concurrent writer winning the race just costs a download."""
+    with _source_index_lock:
+        index = _read_source_index(cache_folder)
+        update(index)
+        index_path = _source_index_path(cache_folder)
+        tmp_path = index_path + '.' + uuid4().hex
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f, indent=2, sort_keys=True)
+        if hasattr(os, 'replace'):
+            os.replace(tmp_path, index_path)
+        else:
+            rm_rf(index_path)
+            os.rename(tmp_path, index_path)
+
+
+def _source_ext(fn):
+    match = ext_re.match(fn)
+    return match.group(2) if match else ''
+
+
+def _source_store_path(cache_folder, digest, ext):
+    return join(cache_folder, 'sha256', digest + ext)
+
+
+def _source_store_digest(path):
+    """The sha256 digest of a file in the source store, or None for any other path."""
+    if basename(os.path.dirname(path)) != 'sha256':
+        return None
+    digest = basename(path)[:64]
+    return digest if len(digest) == 64 else None
+
+
+def _hash_file(path, hash_types):
+    hashes = {tp: hashlib.new(tp) for tp in hash_types}
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            for h in hashes.values():
+                h.update(chunk)
+    return {tp: h.hexdigest() for tp, h in hashes.items()}
+
+
+def _touch(path):
+    try:
+        os.utime(path, None)
+    except (IOError, OSError):
+        pass
+
+
+def _add_to_source_store(cache_folder, path, source_dict, ext):
+    """Check path against the recipe's hash, then move it into the store.  Returns its new
+    path."""
+    recipe_hash_type = next((tp for tp in ('md5', 'sha1', 'sha256') if tp in source_dict), None)
+    hashes = _hash_file(path, {'sha256', recipe_hash_type or 'sha256'})
+    if recipe_hash_type and hashes[recipe_hash_type] != source_dict[recipe_hash_type]:
+        rm_rf(path)
+        raise RuntimeError("%s mismatch: '%s' != '%s'" %
+                           (recipe_hash_type.upper(), hashes[recipe_hash_type],
+                            source_dict[recipe_hash_type]))
+    digest = hashes['sha256']
+    store_path = _source_store_path(cache_folder, digest, ext)
+    if not isdir(os.path.dirname(store_path)):
+        os.makedirs(os.path.dirname(store_path))
+    if isfile(store_path):
+        # same content from another url or filename: keep just the one copy
+        rm_rf(path)
+        _touch(store_path)
+    else:
+        shutil.move(path, store_path)
+
+    if recipe_hash_type in ('md5', 'sha1'):
+        def update(index):
+            index['hashes']['%s:%s' % (recipe_hash_type, source_dict[recipe_hash_type])] = digest
+        _update_source_index(cache_folder, update)
+    return store_path
+
+
+def _find_in_source_store(cache_folder, source_dict, ext):
+    if 'sha256' in source_dict:
+        digest = source_dict['sha256']
+    else:
+        hash_type = next((tp for tp in ('md5', 'sha1') if tp in source_dict), None)
+        if not hash_type:
+            return None
+        digest = _read_source_index(cache_folder)['hashes'].get(
+            '%s:%s' % (hash_type, source_dict[hash_type]))
+    if digest:
+        path = _source_store_path(cache_folder, digest, ext)
+        if isfile(path):
+            _touch(path)
+            return path
+    return None
+
+
 def download_to_cache(cache_folder, recipe_path, source_dict, verbose=False):
     ''' Download a source to the local cache. '''
     log = get_logger(__name__)
@@ -48,74 +182,101 @@ def download_to_cache(cache_folder, recipe_path, source_dict, verbose=False):
     if not isinstance(source_urls, list):
         source_urls = [source_urls]
     unhashed_fn = fn = source_dict['fn'] if 'fn' in source_dict else basename(source_urls[0])
-    hash_added = False
     for hash_type in ('md5', 'sha1', 'sha256'):
         if hash_type in source_dict:
             fn = append_hash_to_fn(fn, source_dict[hash_type])
-            hash_added = True
             break
     else:
         log.warn("No hash (md5, sha1, sha256) provided for {}.  Source download forced.  "
                  "Add hash to recipe to use source cache.".format(unhashed_fn))
-    path = join(cache_folder, fn)
-    if isfile(path):
+    ext = _source_ext(unhashed_fn)
+
+    path = _find_in_source_store(cache_folder, source_dict, ext)
+    if path:
         if verbose:
             log.info('Found source in cache: %s' % fn)
-    else:
+        return path, unhashed_fn
+
+    # sources cached by older conda-build versions sit next to the store.  Move them in.
+    legacy_path = join(cache_folder, fn)
+    if fn != unhashed_fn and isfile(legacy_path):
         if verbose:
-            log.info('Downloading source to cache: %s' % fn)
-
-        for url in source_urls:
-            if "://" not in url:
-                if url.startswith('~'):
-                    url = expanduser(url)
-                if not os.path.isabs(url):
-                    url = os.path.normpath(os.path.join(recipe_path, url))
-                url = url_path(url)
-            else:
-                if url.startswith('file:///~'):
-                    url = 'file:///' + expanduser(url[8:]).replace('\\', '/')
-            try:
-                if verbose:
-                    log.info("Downloading %s" % url)
-                with LoggingContext():
-                    download(url, path)
-            except CondaHTTPError as e:
-                log.warn("Error: %s" % str(e).strip())
-                rm_rf(path)
-            except RuntimeError as e:
-                log.warn("Error: %s" % str(e).strip())
-                rm_rf(path)
-            else:
-                if verbose:
-                    log.info("Success")
-                break
-        else:  # no break
+            log.info('Found source in cache: %s' % fn)
+        return _add_to_source_store(cache_folder, legacy_path, source_dict, ext), unhashed_fn
+
+    if verbose:
+        log.info('Downloading source to cache: %s' % fn)
+    path = join(cache_folder, '%s.%s.part' % (fn, uuid4().hex[:8]))
+    for url in source_urls:
+        if "://" not in url:
+            if url.startswith('~'):
+                url = expanduser(url)
+            if not os.path.isabs(url):
+                url = os.path.normpath(os.path.join(recipe_path, url))
+            url = url_path(url)
+        else:
+            if url.startswith('file:///~'):
+                url = 'file:///' + expanduser(url[8:]).replace('\\', '/')
+        try:
+            if verbose:
+                log.info("Downloading %s" % url)
+            with LoggingContext():
+                download(url, path)
+        except CondaHTTPError as e:
+            log.warn("Error: %s" % str(e).strip())
+            rm_rf(path)
+        except RuntimeError as e:
+            log.warn("Error: %s" % str(e).strip())
             rm_rf(path)
-            raise RuntimeError("Could not download %s" % url)
-
-    hashed = None
-    for tp in ('md5', 'sha1', 'sha256'):
-        if tp in source_dict:
-            expected_hash = source_dict[tp]
-            hashed = hashsum_file(path, tp)
-            if expected_hash != hashed:
-                rm_rf(path)
-                raise RuntimeError("%s mismatch: '%s' != '%s'" %
-                           (tp.upper(), hashed, expected_hash))
+        else:
+            if verbose:
+                log.info("Success")
             break
+    else:  # no break
+        rm_rf(path)
+        raise RuntimeError("Could not download %s" % url)
 
-    # this is really a fallback.  If people don't provide the hash, we still need to prevent
-    #    collisions in our source cache, but the end user will get no benefirt from the cache.
-    if not hash_added:
-        if not hashed:
-            hashed = hashsum_file(path, 'sha256')
-        dest_path = append_hash_to_fn(path, hashed)
-        if not os.path.isfile(dest_path):
-            shutil.move(path, dest_path)
-        path = dest_path
+    return _add_to_source_store(cache_folder, path, source_dict, ext), unhashed_fn
 
-    return path, unhashed_fn
+
+def trim_source_cache(cache_folder, max_size, keep=()):
+    """Evict the least recently used downloads and extracted trees from the source cache until
+    it takes up no more than max_size bytes (or a size string such as 20G).  Digests in keep
+    are never evicted."""
+    max_size = parse_size(max_size)
+    if not max_size or not isdir(cache_folder):
+        return
+    index = _read_source_index(cache_folder)
+    entries = []
+    store_dir = join(cache_folder, 'sha256')
+    for fn in (os.listdir(store_dir) if isdir(store_dir) else ()):
+        path = join(store_dir, fn)
+        entries.append((os.path.getmtime(path), os.path.getsize(path), fn[:64], path))
+    for section in ('extracted', 'patched'):
+        section_dir = join(cache_folder, section)
+        for digest in (os.listdir(section_dir) if isdir(section_dir) else ()):
+            path = join(section_dir, digest)
+            entries.append((os.path.getmtime(path), index[section].get(digest, 0), digest, path))
+
+    total = sum(entry[1] for entry in entries)
+    evicted = False
+    for _, size, digest, path in sorted(entries):
+        if total <= max_size:
+            break
+        if digest in keep:
+            continue
+        rm_rf(path)
+        total -= size
+        evicted = True
+    if evicted:
+        remaining = set(fn[:64] for fn in os.listdir(store_dir)) if isdir(store_dir) else set()
+
+        def update(index):
+            index['hashes'] = {k: v for k, v in index['hashes'].items() if v in remaining}
+            for section in ('extracted', 'patched'):
+                index[section] = {k: v for k, v in index[section].items()
+                                  if isdir(join(cache_folder, section, k))}
+        _update_source_index(cache_folder, update)
 
 
 def hoist_single_extracted_folder(nested_folder):
@@ -133,10 +294,78 @@ def hoist_single_extracted_folder(nested_folder):
             shutil.move(os.path.join(tmpdir, entry), os.path.join(parent, entry))
 
 
+def _move_extracted_into(extracted_dir, src_dir):
+    """Move the extracted contents of a source into src_dir.  An archive that holds a single
+    folder has that folder's contents hoisted up one level; when src_dir is still empty that
+    is a single directory rename."""
+    flist = os.listdir(extracted_dir)
+    nested_folder = os.path.join(extracted_dir, flist[0]) if len(flist) == 1 else None
+    if nested_folder and os.path.isdir(nested_folder) and not os.path.islink(nested_folder):
+        if not os.listdir(src_dir):
+            os.rmdir(src_dir)
+            shutil.move(nested_folder, src_dir)
+            os.chmod(src_dir, os.stat(src_dir).st_mode | stat.S_IRWXU)
+            return
+        extracted_dir = nested_folder
+        flist = os.listdir(extracted_dir)
+    for f in flist:
+        shutil.move(os.path.join(extracted_dir, f), os.path.join(src_dir, f))
+
+
+def _copy_tree(src, dst):
+    """Copy the contents of src into the existing, empty dst - as reflinks, where the
+    filesystem supports them."""
+    if sys.platform.startswith('linux'):
+        try:
+            subprocess.check_call(['cp', '-a', '--reflink=auto', os.path.join(src, '.'), dst])
+            return
+        except (OSError, CalledProcessError):
+            rm_rf(dst)
+            os.makedirs(dst)
+    copy_into(src, dst, symlinks=True, locking=False)
+
+
+def _get_extracted_source(cache_folder, src_path):
+    """Return the cached extracted tree of an archive in the source store, extracting it on
+    first use.  Returns None for files outside of the store."""
+    digest = _source_store_digest(src_path)
+    if not digest:
+        return None
+    extracted = join(cache_folder, 'extracted', digest)
+    if isdir(extracted):
+        _touch(extracted)
+        return extracted
+    if not isdir(os.path.dirname(extracted)):
+        os.makedirs(os.path.dirname(extracted))
+    tmpdir = join(cache_folder, '.extracting-' + uuid4().hex[:8])
+    os.makedirs(tmpdir)
+    try:
+        tar_xf(src_path, tmpdir)
+        size = sum(os.path.getsize(join(root, fn)) for root, _, files in os.walk(tmpdir)
+                   for fn in files if not os.path.islink(join(root, fn)))
+        try:
+            os.rename(tmpdir, extracted)
+        except OSError:
+            # another build extracted the same archive first
+            if not isdir(extracted):
+                raise
+            return extracted
+    finally:
+        rm_rf(tmpdir)
+
+    def update(index):
+        index['extracted'][digest] = size
+    _update_source_index(cache_folder, update)
+    return extracted
+
+
 def unpack(source_dict, src_dir, cache_folder, recipe_path, croot, verbose=False,
-           timeout=900, locking=True):
-    ''' Uncompress a downloaded source. '''
-    src_path, unhashed_fn = download_to_cache(cache_folder, recipe_path, source_dict, verbose)
+           timeout=900, locking=True, downloaded=None, keep_extracted=False):
+    ''' Uncompress a downloaded source.  downloaded is the result of download_to_cache, if the
+    source has already been fetched.  With keep_extracted, the unpacked archive is kept in the
+    source cache and copied from there next time.  Returns the path of the downloaded file. '''
+    src_path, unhashed_fn = downloaded or download_to_cache(cache_folder, recipe_path,
+                                                            source_dict, verbose)
 
     if not isdir(src_dir):
         os.makedirs(src_dir)
@@ -145,7 +374,11 @@ def unpack(source_dict, src_dir, cache_folder, recipe_path, croot, verbose=False
     with TemporaryDirectory(dir=croot) as tmpdir:
         unhashed_dest = os.path.join(tmpdir, unhashed_fn)
         if src_path.lower().endswith(decompressible_exts):
-            tar_xf(src_path, tmpdir)
+            extracted = keep_extracted and _get_extracted_source(cache_folder, src_path)
+            if extracted:
+                _copy_tree(extracted, tmpdir)
+            else:
+                tar_xf(src_path, tmpdir)
         else:
             # In this case, the build script will need to deal with unpacking the source
             print("Warning: Unrecognized source format. Source file will be copied to the SRC_DIR")
@@ -155,17 +388,96 @@ def unpack(source_dict, src_dir, cache_folder, recipe_path, croot, verbose=False
             # This allows test_files or about.license_file to locate files in the wheel,
             # as well as `pip install name-version.whl` as install command
             copy_into(src_path, unhashed_dest, timeout, locking=locking)
-        flist = os.listdir(tmpdir)
-        folder = os.path.join(tmpdir, flist[0])
-        if len(flist) == 1 and os.path.isdir(folder):
-            hoist_single_extracted_folder(folder)
-        flist = os.listdir(tmpdir)
-        for f in flist:
-            shutil.move(os.path.join(tmpdir, f), os.path.join(src_dir, f))
+        _move_extracted_into(tmpdir, src_dir)
+    return src_path
+
+
+def download_sources(source_dicts, cache_folder, recipe_path, verbose=False):
+    """Fetch all url sources into the source cache at the same time.  Returns a dict mapping
+    the position of each url source in source_dicts to its download_to_cache result."""
+    url_sources = OrderedDict()
+    for i, source_dict in enumerate(source_dicts):
+        if 'url' in source_dict:
+            key = json.dumps({k: source_dict.get(k) for k in ('url', 'fn', 'md5', 'sha1', 'sha256')},
+                             sort_keys=True, default=str)
+            url_sources.setdefault(key, []).append(i)
+    downloads = {}
+    if len(url_sources) < 2:
+        for indices in url_sources.values():
+            result = download_to_cache(cache_folder, recipe_path, source_dicts[indices[0]],
+                                       verbose)
+            downloads.update((i, result) for i in indices)
+        return downloads
+
+    # entered once here so that the worker threads don't race on logger levels
+    with LoggingContext():
+        with ThreadPoolExecutor(max_workers=min(len(url_sources),
+                                                MAX_CONCURRENT_DOWNLOADS)) as executor:
+            futures = [(indices, executor.submit(download_to_cache, cache_folder, recipe_path,
+                                                 source_dicts[indices[0]], verbose))
+                       for indices in url_sources.values()]
+            for indices, future in futures:
+                for i in indices:
+                    downloads[i] = future.result()
+    return downloads
+
+
+def _git_remote_refs(git, mirror_dir, stderr=None):
+    """The refs advertised by the remote of mirror_dir, or None if they can't be listed."""
+    try:
+        return check_output_env([git, 'ls-remote', 'origin'], cwd=mirror_dir, stderr=stderr)
+    except CalledProcessError:
+        return None
+
+
+def _git_cached_remote_refs(mirror_dir, refs=None):
+    """Read (or, given refs, store) the remote refs seen at the last fetch into mirror_dir."""
+    path = join(mirror_dir, 'conda_build_remote_refs')
+    if refs is not None:
+        with open(path, 'wb') as f:
+            f.write(refs)
+        return refs
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except (IOError, OSError):
+        return None
+
+
+def _git_is_partial_clone(git, repo_dir):
+    try:
+        check_output_env([git, 'config', '--get', 'remote.origin.promisor'], cwd=repo_dir)
+        return True
+    except CalledProcessError:
+        return False
+
+
+def _git_enable_lazy_fetch(git, checkout_dir, git_url, git_filter, stdout=None, stderr=None):
+    """A checkout that shares its objects with a partial mirror fetches the blobs it needs from
+    the upstream repository - the mirror can't serve blobs it doesn't have."""
+    for args in (['config', 'core.repositoryformatversion', '1'],
+                 ['remote', 'add', 'conda_build_upstream', git_url],
+                 ['config', 'remote.conda_build_upstream.promisor', 'true'],
+                 ['config', 'remote.conda_build_upstream.partialclonefilter', git_filter],
+                 ['config', 'extensions.partialclone', 'conda_build_upstream']):
+        check_call_env([git] + args, cwd=checkout_dir, stdout=stdout, stderr=stderr)
+
+
+def _git_set_sparse_paths(git, checkout_dir, sparse_paths, stdout=None, stderr=None):
+    check_call_env([git, 'config', 'core.sparseCheckout', 'true'], cwd=checkout_dir,
+                   stdout=stdout, stderr=stderr)
+    git_dir = check_output_env([git, 'rev-parse', '--git-dir'], cwd=checkout_dir).decode('utf-8')
+    info_dir = os.path.join(checkout_dir, git_dir.strip(), 'info')
+    if not isdir(info_dir):
+        os.makedirs(info_dir)
+    with open(os.path.join(info_dir, 'sparse-checkout'), 'w') as f:
+        for path in sparse_paths:
+            f.write('/' + path.strip('/') + '\n')
 
 
 def git_mirror_checkout_recursive(git, mirror_dir, checkout_dir, git_url, git_cache, git_ref=None,
-                                  git_depth=-1, is_top_level=True, verbose=True):
+                                  git_depth=-1, is_top_level=True, verbose=True, git_filter=None,
+                                  git_sparse_paths=None):
     """ Mirror (and checkout) a Git repository recursively.
 
         It's not possible to use `git submodule` on a bare
@@ -179,6 +491,10 @@ def git_mirror_checkout_recursive(git, mirror_dir, checkout_dir, git_url, git_ca
         that case conda-build could be tricked into writing
         to the root of the drive and overwriting the system
         folders unless steps are taken to prevent that.
+
+        git_filter (e.g. blob:none) makes a new mirror a partial clone, and git_sparse_paths
+        limits the top level checkout to those paths.  Either one checks out with a clone that
+        shares the mirror's objects instead of copying them.
     """
 
     if verbose:
@@ -204,8 +520,13 @@ def git_mirror_checkout_recursive(git, mirror_dir, checkout_dir, git_url, git_ca
     if not isdir(os.path.dirname(mirror_dir)):
         os.makedirs(os.path.dirname(mirror_dir))
     if isdir(mirror_dir):
+        # nothing to fetch if the remote still advertises the refs we fetched last time
+        remote_refs = _git_remote_refs(git, mirror_dir, stderr=stderr)
         try:
-            if git_ref != 'HEAD':
+            if remote_refs is not None and remote_refs == _git_cached_remote_refs(mirror_dir):
+                if verbose:
+                    print('git cache of %s is up to date; not fetching' % git_url)
+            elif git_ref != 'HEAD':
                 check_call_env([git, 'fetch'], cwd=mirror_dir, stdout=stdout, stderr=stderr)
             else:
                 # Unlike 'git clone', fetch doesn't automatically update the cache's HEAD,
@@ -218,6 +539,8 @@ def git_mirror_checkout_recursive(git, mirror_dir, checkout_dir, git_url, git_ca
                            cwd=mirror_dir, stdout=stdout, stderr=stderr)
                 check_call_env([git, 'symbolic-ref', 'HEAD', 'refs/heads/_conda_cache_origin_head'],
                            cwd=mirror_dir, stdout=stdout, stderr=stderr)
+            if remote_refs is not None:
+                _git_cached_remote_refs(mirror_dir, remote_refs)
         except CalledProcessError:
             msg = ("Failed to update local git cache. "
                    "Deleting local cached repo: {} ".format(mirror_dir))
@@ -231,6 +554,8 @@ def git_mirror_checkout_recursive(git, mirror_dir, checkout_dir, git_url, git_ca
         args = [git, 'clone', '--mirror']
         if git_depth > 0:
             args += ['--depth', str(git_depth)]
+        if git_filter:
+            args += ['--filter', git_filter]
         try:
             check_call_env(args + [git_url, git_mirror_dir], stdout=stdout, stderr=stderr)
         except CalledProcessError:
@@ -244,9 +569,25 @@ def git_mirror_checkout_recursive(git, mirror_dir, checkout_dir, git_url, git_ca
                 git_url = normpath(git_url)
             check_call_env(args + [git_url, git_mirror_dir], stdout=stdout, stderr=stderr)
         assert isdir(mirror_dir)
-
-    # Now clone from mirror_dir into checkout_dir.
-    check_call_env([git, 'clone', git_mirror_dir, git_checkout_dir], stdout=stdout, stderr=stderr)
+        remote_refs = _git_remote_refs(git, mirror_dir, stderr=stderr)
+        if remote_refs is not None:
+            _git_cached_remote_refs(mirror_dir, remote_refs)
+
+    # Now clone from mirror_dir into checkout_dir.  Submodule mirrors are only checked out to
+    #    read their .gitmodules, so they can always share objects with the mirror.
+    partial = is_top_level and _git_is_partial_clone(git, mirror_dir)
+    deferred_checkout = is_top_level and (partial or bool(git_sparse_paths))
+    args = [git, 'clone']
+    if deferred_checkout or not is_top_level:
+        args.append('--shared')
+    if deferred_checkout:
+        args.append('--no-checkout')
+    check_call_env(args + [git_mirror_dir, git_checkout_dir], stdout=stdout, stderr=stderr)
+    if partial:
+        _git_enable_lazy_fetch(git, checkout_dir, git_url, git_filter or 'blob:none',
+                               stdout=stdout, stderr=stderr)
+    if is_top_level and git_sparse_paths:
+        _git_set_sparse_paths(git, checkout_dir, git_sparse_paths, stdout=stdout, stderr=stderr)
     if is_top_level:
         checkout = git_ref
         if git_url.startswith('.'):
@@ -254,6 +595,8 @@ def git_mirror_checkout_recursive(git, mirror_dir, checkout_dir, git_url, git_ca
             checkout = output.decode('utf-8')
         if verbose:
             print('checkout: %r' % checkout)
+        if deferred_checkout:
+            checkout = checkout or 'HEAD'
         if checkout:
             check_call_env([git, 'checkout', checkout],
                            cwd=checkout_dir, stdout=stdout, stderr=stderr)
@@ -306,6 +649,8 @@ def git_source(source_dict, git_cache, src_dir, recipe_path=None, verbose=True):
 
     git_depth = int(source_dict.get('git_depth', -1))
     git_ref = source_dict.get('git_rev') or 'HEAD'
+    git_filter = source_dict.get('git_filter')
+    git_sparse_paths = ensure_list(source_dict.get('git_sparse_paths'))
 
     git_url = source_dict['git_url']
     if git_url.startswith('~'):
@@ -325,7 +670,8 @@ def git_source(source_dict, git_cache, src_dir, recipe_path=None, verbose=True):
     mirror_dir = join(git_cache, git_dn)
     git_mirror_checkout_recursive(
         git, mirror_dir, src_dir, git_url, git_cache=git_cache, git_ref=git_ref,
-        git_depth=git_depth, is_top_level=True, verbose=verbose)
+        git_depth=git_depth, is_top_level=True, verbose=verbose, git_filter=git_filter,
+        git_sparse_paths=git_sparse_paths)
     return git
 
 
@@ -625,6 +971,90 @@ def apply_patch(src_dir, path, config, git=None):
                 raise
 
 
+def _patched_source_key(recipe_path, source_dicts, downloads):
+    """Identify the result of applying a recipe's patches: the digests of its (url only)
+    sources, where they go, and the digests of the patches in order.  None if the result
+    can't be cached."""
+    if not any(source_dict.get('patches') for source_dict in source_dicts):
+        return None
+    key = []
+    for i, source_dict in enumerate(source_dicts):
+        digest = _source_store_digest(downloads[i][0]) if i in downloads else None
+        if not digest:
+            return None
+        patch_digests = []
+        for patch in ensure_list(source_dict.get('patches', [])):
+            try:
+                patch_digests.append(_hash_file(join(recipe_path, patch), ['sha256'])['sha256'])
+            except (IOError, OSError):
+                return None
+        key.append([digest, source_dict.get('folder'), downloads[i][1], patch_digests])
+    return hashlib.sha256(json.dumps(key).encode('utf-8')).hexdigest()
+
+
+def _get_patched_source(cache_folder, key):
+    patched = join(cache_folder, 'patched', key)
+    if isdir(patched):
+        _touch(patched)
+        return patched
+    return None
+
+
+def _store_patched_source(cache_folder, key, work_dir):
+    patched = join(cache_folder, 'patched', key)
+    if not isdir(os.path.dirname(patched)):
+        os.makedirs(os.path.dirname(patched))
+    tmpdir = join(cache_folder, '.patching-' + uuid4().hex[:8])
+    os.makedirs(tmpdir)
+    try:
+        _copy_tree(work_dir, tmpdir)
+        size = sum(os.path.getsize(join(root, fn)) for root, _, files in os.walk(tmpdir)
+                   for fn in files if not os.path.islink(join(root, fn)))
+        try:
+            os.rename(tmpdir, patched)
+        except OSError:
+            # another build stored the same result first
+            return
+    finally:
+        rm_rf(tmpdir)
+
+    def update(index):
+        index['patched'][key] = size
+    _update_source_index(cache_folder, update)
+
+
+# Sources that have already been unpacked and patched in this process, so that every variant
+#    of a recipe doesn't do it again: {pristine source key: snapshot directory}
+_pristine_sources = {}
+
+
+def _pristine_source_key(recipe_path, source_dicts):
+    """Identify a source section (as rendered for one variant) plus the patches it applies.
+    Local path sources can change underneath us, so those are never reused."""
+    if not any(source_dicts) or any('path' in source_dict for source_dict in source_dicts):
+        return None
+    patch_hashes = []
+    for source_dict in source_dicts:
+        for patch in ensure_list(source_dict.get('patches', [])):
+            try:
+                patch_hashes.append(_hash_file(join(recipe_path, patch), ['sha256'])['sha256'])
+            except (IOError, OSError):
+                return None
+    key = json.dumps([recipe_path, source_dicts, patch_hashes], sort_keys=True, default=str)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def remove_pristine_sources():
+    """Remove the source snapshots kept for reuse between variants.  build_tree does this once
+    it is done with each recipe."""
+    for snapshot in _pristine_sources.values():
+        rm_rf(snapshot)
+    _pristine_sources.clear()
+
+
+atexit.register(remove_pristine_sources)
+
+
 def provide(metadata):
     """
     given a recipe_dir:
@@ -642,15 +1072,43 @@ def provide(metadata):
     else:
         dicts = meta
 
+    # variants that don't change the source section can share one unpacked, patched tree
+    pristine_key = (_pristine_source_key(metadata.path, dicts)
+                    if len(ensure_list(metadata.config.variants)) > 1 else None)
+    snapshot = _pristine_sources.get(pristine_key)
+    if snapshot and isdir(snapshot):
+        if metadata.config.verbose:
+            print("Copying source already unpacked for another variant from %s" % snapshot)
+        if not isdir(metadata.config.work_dir):
+            os.makedirs(metadata.config.work_dir)
+        _copy_tree(snapshot, metadata.config.work_dir)
+        return metadata.config.work_dir
+
     try:
-        for source_dict in dicts:
+        downloads = download_sources(dicts, metadata.config.src_cache, metadata.path,
+                                     verbose=metadata.config.verbose)
+        used_sources = [path for path, _ in downloads.values()]
+
+        # the result of unpacking and patching url sources is kept in the source cache too
+        patched_key = (_patched_source_key(metadata.path, dicts, downloads)
+                       if metadata.config.src_cache_keep_extracted else None)
+        patched = patched_key and _get_patched_source(metadata.config.src_cache, patched_key)
+        if patched:
+            if metadata.config.verbose:
+                print("Copying patched source from %s" % patched)
+            if not isdir(metadata.config.work_dir):
+                os.makedirs(metadata.config.work_dir)
+            _copy_tree(patched, metadata.config.work_dir)
+        for i, source_dict in enumerate([] if patched else dicts):
             folder = source_dict.get('folder')
             src_dir = (os.path.join(metadata.config.work_dir, folder) if folder else
                     metadata.config.work_dir)
             if any(k in source_dict for k in ('fn', 'url')):
-                unpack(source_dict, src_dir, metadata.config.src_cache, recipe_path=metadata.path,
-                    croot=metadata.config.croot, verbose=metadata.config.verbose,
-                    timeout=metadata.config.timeout, locking=metadata.config.locking)
+                unpack(source_dict, src_dir, metadata.config.src_cache,
+                    recipe_path=metadata.path, croot=metadata.config.croot,
+                    verbose=metadata.config.verbose, timeout=metadata.config.timeout,
+                    locking=metadata.config.locking, downloaded=downloads.get(i),
+                    keep_extracted=metadata.config.src_cache_keep_extracted)
             elif 'git_url' in source_dict:
                 git = git_source(source_dict, metadata.config.git_cache, src_dir, metadata.path,
                                 verbose=metadata.config.verbose)
@@ -677,12 +1135,30 @@ def provide(metadata):
                 if not isdir(src_dir):
                     os.makedirs(src_dir)
 
-            patches = ensure_list(source_dict.get('patches', []))
+            patches = [join(metadata.path, patch)
+                       for patch in ensure_list(source_dict.get('patches', []))]
+            # patches are read and their strip levels guessed one at a time: reading is pure
+            #    python, which threads would not speed up, and each patch can create files that
+            #    the next one changes
             for patch in patches:
-                apply_patch(src_dir, join(metadata.path, patch), metadata.config, git)
+                apply_patch(src_dir, patch, metadata.config, git)
+
+        if patched_key and not patched:
+            _store_patched_source(metadata.config.src_cache, patched_key,
+                                  metadata.config.work_dir)
 
     except CalledProcessError:
         shutil.move(metadata.config.work_dir, metadata.config.work_dir + '_failed_provide')
         raise
 
+    if metadata.config.src_cache_max_size:
+        trim_source_cache(metadata.config.src_cache, metadata.config.src_cache_max_size,
+                          keep=set(_source_store_digest(path) for path in used_sources) |
+                          {patched_key})
+
+    if pristine_key:
+        snapshot = tempfile.mkdtemp(prefix='pristine_src_', dir=metadata.config.croot)
+        _copy_tree(metadata.config.work_dir, snapshot)
+        _pristine_sources[pristine_key] = snapshot
+
     return metadata.config.work_dir
@@ -1,6 +1,7 @@
 from __future__ import absolute_import, division, print_function
 
 from collections import OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor
 import contextlib
 import fnmatch
 import hashlib
@@ -409,7 +410,12 @@ def get_recipe_abspath(recipe):
     if isfile(recipe):
         if recipe.lower().endswith(decompressible_exts) or recipe.lower().endswith(CONDA_TARBALL_EXTENSIONS):
             recipe_dir = tempfile.mkdtemp()
-            tar_xf(recipe, recipe_dir)
+            if recipe.lower().endswith('.tar.bz2'):
+                # only info/ of a package is needed to test it; reuse the cached copy
+                copy_into(join(package_info_dir(recipe), 'info'), join(recipe_dir, 'info'),
+                          symlinks=True, locking=False)
+            else:
+                tar_xf(recipe, recipe_dir)
             # At some stage the old build system started to tar up recipes.
             recipe_tarfile = os.path.join(recipe_dir, 'info', 'recipe.tar')
             if isfile(recipe_tarfile):
@@ -706,16 +712,161 @@ decompressible_exts = ('.7z', '.tar', '.tar.bz2', '.tar.gz', '.tar.lzma', '.tar.
                        '.tar.z', '.tgz', '.whl', '.zip', '.rpm', '.deb')
 
 
-def tar_xf(tarball, dir_path):
-    flags = libarchive.extract.EXTRACT_TIME | \
-            libarchive.extract.EXTRACT_PERM | \
-            libarchive.extract.EXTRACT_SECURE_NODOTDOT | \
-            libarchive.extract.EXTRACT_SECURE_SYMLINKS | \
-            libarchive.extract.EXTRACT_SECURE_NOABSOLUTEPATHS
+def _tar_member_path(pathname, strip_components):
+    """Normalize an archive member name, dropping `strip_components` leading components.
+
+    Returns None for members that are stripped away entirely.  Raises for absolute paths and
+    for paths that would escape the extraction directory."""
+    pathname = pathname.replace('\\', '/')
+    if pathname.startswith('/') or re.match(r'^[a-zA-Z]:', pathname):
+        raise RuntimeError("Refusing to extract absolute path: %s" % pathname)
+    parts = [part for part in pathname.split('/') if part not in ('', '.')]
+    if '..' in parts:
+        raise RuntimeError("Refusing to extract path outside of destination: %s" % pathname)
+    parts = parts[strip_components:]
+    return '/'.join(parts) if parts else None
+
+
+def _tar_write_file(entry, dest):
+    """Write a regular file archive entry to dest; returns the number of bytes written."""
+    n_bytes = 0
+    with open(dest, 'wb') as f:
+        for block in entry.get_blocks():
+            f.write(block)
+            n_bytes += len(block)
+    os.chmod(dest, entry.mode & 0o7777 & ~(stat.S_ISUID | stat.S_ISGID))
+    if entry.mtime is not None:
+        os.utime(dest, (entry.mtime, entry.mtime))
+    return n_bytes
+
+
+def _tar_member_wanted(name, members):
+    if members is None:
+        return True
+    if callable(members):
+        return members(name)
+    return name in members or any(name.startswith(member.rstrip('/') + '/') for member in members)
+
+
+def tar_xf(tarball, dir_path, members=None, strip_components=0, progress=None,
+           stop_after_members=False):
+    """Extract tarball (or any other format libarchive reads) into dir_path.
+
+    Entries are written here rather than by libarchive's disk writer, so that extraction never
+    changes the working directory and is safe to run from several threads at once.
+
+    members, if given, is either a collection of member names (a directory name selects
+    everything under it) or a callable taking a member name and returning whether to extract it.
+    Names are matched after strip_components leading path components have been removed, like
+    tar --strip-components.  progress, if given, is called as progress(entries, bytes) after each
+    extracted entry with running totals.  With stop_after_members, the selected members are taken
+    to be stored together, and reading stops at the first unselected entry after them; conda
+    packages store info/ first, so its extraction need not decompress the rest of the package.
+
+    Absolute paths, paths containing '..' and writes through symlinks in the archive are refused,
+    as they are with tar's default safety checks.  A hardlink whose target is not among the
+    extracted members gets the target's contents, read in a second pass over the archive."""
     if not os.path.isabs(tarball):
         tarball = os.path.join(os.getcwd(), tarball)
-    with tmp_chdir(dir_path):
-        libarchive.extract_file(tarball, flags)
+    dir_path = os.path.abspath(dir_path)
+    if not isdir(dir_path):
+        os.makedirs(dir_path)
+    safe_dirs = set()
+    dir_attrs = []
+    extracted = set()
+    # hardlink target member name -> destinations of the links to it, for targets not extracted
+    missing_link_targets = {}
+    n_entries = 0
+    n_bytes = 0
+
+    def _check_parents(name):
+        parent = os.path.dirname(name)
+        while parent and parent not in safe_dirs:
+            if islink(os.path.join(dir_path, *parent.split('/'))):
+                raise RuntimeError("Refusing to extract %s through symlink %s" % (name, parent))
+            parent = os.path.dirname(parent)
+        parent = os.path.dirname(name)
+        while parent and parent not in safe_dirs:
+            safe_dirs.add(parent)
+            parent = os.path.dirname(parent)
+
+    with libarchive.file_reader(tarball) as archive:
+        for entry in archive:
+            name = _tar_member_path(entry.pathname, strip_components)
+            if not name or not _tar_member_wanted(name, members):
+                if stop_after_members and extracted:
+                    break
+                continue
+            _check_parents(name)
+            dest = os.path.join(dir_path, *name.split('/'))
+            parent = os.path.dirname(dest)
+            if not isdir(parent):
+                os.makedirs(parent)
+            # a symlink (even one to a directory) is replaced, never written through
+            replace = islink(dest) or (os.path.lexists(dest) and not isdir(dest))
+            if entry.isdir:
+                if replace:
+                    os.unlink(dest)
+                if not isdir(dest):
+                    os.makedirs(dest)
+                dir_attrs.append((dest, entry.mode, entry.mtime))
+            else:
+                if replace:
+                    os.unlink(dest)
+                if entry.issym:
+                    os.symlink(entry.linkpath, dest)
+                    safe_dirs.discard(name)
+                elif entry.islnk:
+                    target = _tar_member_path(entry.linkpath, strip_components)
+                    if not target:
+                        raise RuntimeError("Hardlink %s points outside of the extracted members: %s"
+                                           % (name, entry.linkpath))
+                    if target in extracted:
+                        target = os.path.join(dir_path, *target.split('/'))
+                        try:
+                            os.link(target, dest)
+                        except OSError:
+                            shutil.copy2(target, dest)
+                    else:
+                        missing_link_targets.setdefault(target, []).append(dest)
+                elif entry.isreg:
+                    n_bytes += _tar_write_file(entry, dest)
+                else:
+                    log = get_logger(__name__)
+                    log.warn("Skipping unsupported archive member type: %s", entry.pathname)
+                    continue
+            extracted.add(name)
+            n_entries += 1
+            if progress:
+                progress(n_entries, n_bytes)
+
+    if missing_link_targets:
+        with libarchive.file_reader(tarball) as archive:
+            for entry in archive:
+                if not entry.isreg:
+                    continue
+                name = _tar_member_path(entry.pathname, strip_components)
+                dests = missing_link_targets.pop(name, None)
+                if not dests:
+                    continue
+                _tar_write_file(entry, dests[0])
+                for dest in dests[1:]:
+                    try:
+                        os.link(dests[0], dest)
+                    except OSError:
+                        shutil.copy2(dests[0], dest)
+                if not missing_link_targets:
+                    break
+        if missing_link_targets:
+            raise RuntimeError("Hardlink target(s) not found in %s: %s"
+                               % (tarball, ', '.join(sorted(missing_link_targets))))
+
+    # directories last, deepest first, so that writing their contents does not disturb their
+    #    mtimes, and read-only directories can still be populated
+    for dest, mode, mtime in reversed(dir_attrs):
+        os.chmod(dest, (mode & 0o7777 & ~(stat.S_ISUID | stat.S_ISGID)) | stat.S_IRWXU)
+        if mtime is not None:
+            os.utime(dest, (mtime, mtime))
 
 
 def file_info(path):
@@ -1000,15 +1151,111 @@ def get_skip_message(m):
         {k: m.config.variant[k] for k in m.get_used_vars()}))
 
 
+def _package_info_cache_root():
+    if cc_conda_build.get('pkg_info_cache_dir'):
+        return abspath(expanduser(expandvars(cc_conda_build.get('pkg_info_cache_dir'))))
+    return join(expanduser('~'), '.conda', 'conda_build_pkg_info')
+
+
+def _package_info_cache_max_packages():
+    return int(cc_conda_build.get('pkg_info_cache_max_packages', 1000))
+
+
+def _trim_package_info_cache(cache_root, max_packages, keep):
+    """Remove the least recently used package folders of the cache beyond max_packages."""
+    package_caches = []
+    for package_key in os.listdir(cache_root):
+        if package_key.startswith('.') or package_key == keep:
+            continue
+        try:
+            package_caches.append((getmtime(join(cache_root, package_key)), package_key))
+        except OSError:
+            # removed by another process
+            pass
+    package_caches.sort(reverse=True)
+    for _, package_key in package_caches[max(max_packages - 1, 0):]:
+        rm_rf(join(cache_root, package_key))
+
+
+def package_info_dir(package_path, cache_root=None, max_packages=None):
+    """Return a folder containing the info/ directory of package_path.  Extraction stops at the
+    end of the first run of info/ entries (see tar_xf's stop_after_members), so in the unusual
+    package that stores more of them further on, those are missing.
+
+    info/ is extracted once into an on-disk cache and reused by later calls, from this process or
+    any other.  Entries are keyed by the package's location and its size, mtime, ctime and inode,
+    so that a rebuilt package is extracted again; the entry for its previous contents is removed
+    at that point, which keeps the cache at one entry per package file.  Each use marks the
+    package's folder as recently used, and the cache keeps at most max_packages (by default the
+    pkg_info_cache_max_packages condarc setting, or 1000) packages, dropping the least recently
+    used ones as new packages are added."""
+    package_path = abspath(package_path)
+    st = os.stat(package_path)
+    mtime = getattr(st, 'st_mtime_ns', st.st_mtime)
+    ctime = getattr(st, 'st_ctime_ns', st.st_ctime)
+    cache_root = cache_root or _package_info_cache_root()
+    package_key = hashlib.sha1(package_path.encode('utf-8')).hexdigest()
+    package_cache = join(cache_root, package_key)
+    entry = join(package_cache, '%d_%s_%s_%d' % (st.st_size, mtime, ctime, st.st_ino))
+    if isdir(entry):
+        try:
+            os.utime(package_cache, None)
+        except OSError:
+            pass
+    else:
+        if not isdir(package_cache):
+            try:
+                os.makedirs(package_cache)
+            except OSError:
+                if not isdir(package_cache):
+                    raise
+        for stale in os.listdir(package_cache):
+            if not stale.startswith('.'):
+                rm_rf(join(package_cache, stale))
+        tmp_dir = tempfile.mkdtemp(prefix='.tmp_', dir=package_cache)
+        try:
+            tar_xf(package_path, tmp_dir, members=['info'], stop_after_members=True)
+            os.rename(tmp_dir, entry)
+        except OSError:
+            # another process got there first
+            if not isdir(entry):
+                raise
+        finally:
+            if isdir(tmp_dir):
+                rm_rf(tmp_dir)
+        if max_packages is None:
+            max_packages = _package_info_cache_max_packages()
+        _trim_package_info_cache(cache_root, max_packages, keep=package_key)
+    return entry
+
+
+def _package_has_info_file(package_path, file_path):
+    path = join(package_info_dir(package_path), *file_path.split('/'))
+    if not isfile(path):
+        return False
+    with open(path, 'rb') as f:
+        return f.read()
+
+
 @memoized
 def package_has_file(package_path, file_path):
+    # internal paths are always forward slashed on all platforms
+    file_path = file_path.replace('\\', '/')
+    if file_path.startswith('info/') and package_path.endswith('.tar.bz2'):
+        try:
+            text = _package_has_info_file(package_path, file_path)
+            # only the first run of info/ entries is cached, so a miss is checked in the package
+            if text is not False:
+                return text
+        except (libarchive.exception.ArchiveError, IOError, OSError, RuntimeError) as e:
+            log = get_logger(__name__)
+            log.debug("Could not use the package info cache for %s (%s); reading the package "
+                      "directly", package_path, e)
     try:
         locks = get_conda_operation_locks()
         with try_acquire_locks(locks, timeout=900):
             with tarfile.open(package_path) as t:
                 try:
-                    # internal paths are always forward slashed on all platforms
-                    file_path = file_path.replace('\\', '/')
                     text = t.extractfile(file_path).read()
                     return text
                 except KeyError:
@@ -1020,6 +1267,32 @@ def package_has_file(package_path, file_path):
                            "Please manually remove this file and try again." % package_path)
 
 
+def map_in_processes(func, items, jobs=1):
+    """Apply func to each of items, in a pool of up to `jobs` worker processes.
+
+    func and items are pickled to the workers, and results are pickled back, so everything
+    involved must be picklable (functools.partial of a module-level function is).  Results are
+    returned in the order of items.  With jobs <= 1, or a single item, everything runs here."""
+    items = list(items)
+    if not jobs or jobs <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    with ProcessPoolExecutor(max_workers=min(jobs, len(items))) as executor:
+        return list(executor.map(func, items))
+
+
+_size_suffixes = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+def parse_size(size):
+    """Convert a size such as 500M, 20G or 1.5T (or a plain number of bytes) to bytes."""
+    if size is None or isinstance(size, int):
+        return size
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*$', str(size), re.IGNORECASE)
+    if not match:
+        raise ValueError("Could not understand size {}.  Use e.g. 500M or 20G.".format(size))
+    return int(float(match.group(1)) * _size_suffixes[match.group(2).upper()])
+
+
 def ensure_list(arg):
     if (isinstance(arg, string_types) or not hasattr(arg, '__iter__')):
         if arg is not None:
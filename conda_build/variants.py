@@ -1,15 +1,20 @@
 """This file handles the parsing of feature specifications from files,
 ending up with a configuration matrix"""
 
+from bisect import bisect_left
 from collections import OrderedDict
-from itertools import product
+try:
+    from collections.abc import Sequence
+except ImportError:
+    from collections import Sequence
+import copy
+import json
 import os
 from os.path import abspath, expanduser, expandvars
 from pkg_resources import parse_version
 import re
 import sys
 
-import six
 import yaml
 
 from conda_build.utils import ensure_list, trim_empty_keys, get_logger
@@ -19,6 +24,11 @@ from conda_build.conda_interface import cc_conda_build
 from conda_build.conda_interface import memoized
 from conda_build.utils import on_win
 
+try:
+    _yaml_base_loader = yaml.CBaseLoader
+except AttributeError:
+    _yaml_base_loader = yaml.BaseLoader
+
 DEFAULT_VARIANTS = {
     'python': '{0}.{1}'.format(sys.version_info.major, sys.version_info.minor),
     'numpy': '1.11',
@@ -111,14 +121,38 @@ def get_default_variant(config):
     return base
 
 
+# parsed config files, keyed by (path, mtime, selector namespace).  Pinning files are shared by
+#    every recipe rendered in a process, so there is no point in parsing them more than once.
+_config_file_cache = {}
+# combined specs, keyed by the config files that went into them and any in-memory variants
+_combined_spec_cache = {}
+
+
+def _selector_namespace_key(namespace):
+    # the os module and os.environ are not serializable.  The environment is merged into the
+    #    namespace anyway, so it is still part of the key.
+    return json.dumps({k: v for k, v in namespace.items() if k not in ('os', 'environ')},
+                      sort_keys=True, default=str)
+
+
+def _parse_config_file(path, namespace, namespace_key):
+    key = (os.path.abspath(path), os.path.getmtime(path), namespace_key)
+    if key not in _config_file_cache:
+        from conda_build.metadata import select_lines
+        with open(path) as f:
+            contents = f.read()
+        contents = select_lines(contents, namespace, variants_in_place=False)
+        content = yaml.load(contents, Loader=_yaml_base_loader) or {}
+        trim_empty_keys(content)
+        _config_file_cache[key] = content
+    # callers are free to modify what they get back
+    return copy.deepcopy(_config_file_cache[key])
+
+
 def parse_config_file(path, config):
-    from conda_build.metadata import select_lines, ns_cfg
-    with open(path) as f:
-        contents = f.read()
-    contents = select_lines(contents, ns_cfg(config), variants_in_place=False)
-    content = yaml.load(contents, Loader=yaml.loader.BaseLoader) or {}
-    trim_empty_keys(content)
-    return content
+    from conda_build.metadata import ns_cfg
+    namespace = ns_cfg(config)
+    return _parse_config_file(path, namespace, _selector_namespace_key(namespace))
 
 
 def validate_spec(spec):
@@ -366,6 +400,8 @@ def _get_zip_groups(combined_variant):
 def filter_by_key_value(variants, key, values, source_name):
     """variants is the exploded out list of dicts, with one value per key in each dict.
     key and values come from subsequent variants before they are exploded out."""
+    if isinstance(variants, VariantSpace):
+        return variants.filter(key, values, source_name)
     reduced_variants = []
     if hasattr(values, 'keys'):
         reduced_variants = variants
@@ -388,45 +424,270 @@ def _split_str(string, char):
     return string.split(char)
 
 
-def dict_of_lists_to_list_of_dicts(dict_of_lists, extend_keys=None):
-    # http://stackoverflow.com/a/5228294/1170370
-    # end result is a collection of dicts, like [{'python': 2.7, 'numpy': 1.11},
-    #                                            {'python': 3.5, 'numpy': 1.11}]
-    dicts = []
-    if not extend_keys:
-        extend_keys = set(ensure_list(dict_of_lists.get('extend_keys')))
-    pass_through_keys = set(['extend_keys', 'zip_keys', 'pin_run_as_build'] +
-                            list(ensure_list(extend_keys)) +
-                            list(_get_zip_key_set(dict_of_lists)))
-    dimensions = {k: v for k, v in dict_of_lists.items() if k not in pass_through_keys}
-    # here's where we add in the zipped dimensions.  Zipped stuff is concatenated strings, to avoid
-    #      being distributed in the product.
-    for group in _get_zip_groups(dict_of_lists):
-        dimensions.update(group)
-
-    # in case selectors nullify any groups - or else zip reduces whole set to nil
-    trim_empty_keys(dimensions)
-
-    for x in product(*dimensions.values()):
-        remapped = dict(six.moves.zip(dimensions, x))
+def _split_zipped(remapped):
+    """Split concatenated zip_keys entries ('a#b': '1#2') of a variant dict into their own keys"""
+    to_del = set()
+    for k in list(remapped):
+        v = remapped[k]
+        if isinstance(k, string_types) and isinstance(v, string_types):
+            keys = _split_str(k, '#')
+            values = _split_str(v, '#')
+            for (_k, _v) in zip(keys, values):
+                remapped[_k] = _v
+            if '#' in k:
+                to_del.add(k)
+    for key in to_del:
+        del remapped[key]
+    return remapped
+
+
+def _iter_bits(mask):
+    bits = bin(mask)[:1:-1]
+    idx = bits.find('1')
+    while idx != -1:
+        yield idx
+        idx = bits.find('1', idx + 1)
+
+
+class VariantSpace(Sequence):
+    """The exploded-out matrix of variants, without exploding it out.
+
+    Behaves like the list of dicts that ``dict_of_lists_to_list_of_dicts`` returns, but stores
+    only the values of each dimension of the cartesian product, the pass-through values that all
+    variants share, and a bitset of the product indices that are still selected.  Filtering by
+    key and value works on that bitset.  Variant dicts are materialized when they are accessed,
+    and are kept so that repeated access (including from filtered copies) gives the same dict.
+    Like the dicts of a list, they may be changed in place: filtering and distinct_values go by
+    the values of the dicts handed out, and spaces derived with with_value (or deepcopy) start
+    from copies of them."""
+    def __init__(self, dict_of_lists, extend_keys=None):
+        if not extend_keys:
+            extend_keys = set(ensure_list(dict_of_lists.get('extend_keys')))
+        pass_through_keys = set(['extend_keys', 'zip_keys', 'pin_run_as_build'] +
+                                list(ensure_list(extend_keys)) +
+                                list(_get_zip_key_set(dict_of_lists)))
+        dimensions = {k: v for k, v in dict_of_lists.items() if k not in pass_through_keys}
+        # here's where we add in the zipped dimensions.  Zipped stuff is concatenated strings, to
+        #      avoid being distributed in the product.
+        for group in _get_zip_groups(dict_of_lists):
+            dimensions.update(group)
+
+        # in case selectors nullify any groups - or else zip reduces whole set to nil
+        trim_empty_keys(dimensions)
+
+        self._dimensions = [(k, list(v)) for k, v in dimensions.items()]
+        self._pass_through = []
         for col in pass_through_keys:
             v = dict_of_lists.get(col)
             if v or v == '':
+                self._pass_through.append((col, v))
+        self._strides = []
+        size = 1
+        for _, values in reversed(self._dimensions):
+            self._strides.insert(0, size)
+            size *= len(values)
+        self._size = size
+        self._mask = (1 << size) - 1
+        self._indices = None
+        self._materialized = {}
+
+    def _derive(self, mask=None, pass_through=None):
+        new = copy.copy(self)
+        new._indices = None
+        if mask is not None:
+            new._mask = mask
+        if pass_through is not None:
+            new._pass_through = pass_through
+            # previously handed out dicts keep any changes made to them, in copies with the
+            #    changed values; the dicts themselves still belong to this space
+            previous = dict(self._pass_through)
+            changed = [(col, v) for col, v in pass_through
+                       if col not in previous or previous[col] is not v]
+            new._materialized = {}
+            for index, variant in self._materialized.items():
+                variant = dict(variant)
+                variant.update(changed)
+                new._materialized[index] = variant
+        return new
+
+    def __deepcopy__(self, memo):
+        # dimension values are never modified in place, so copies can share them.  Only the
+        #    pass-through values (which variant dicts hand out directly) and the variant dicts
+        #    handed out, which may have been changed, need to be copied.
+        new = self._derive()
+        memo[id(self)] = new
+        new._pass_through = copy.deepcopy(self._pass_through, memo)
+        new._materialized = copy.deepcopy(self._materialized, memo)
+        return new
+
+    def _selected_materialized(self):
+        return [index for index in self._materialized if (self._mask >> index) & 1]
+
+    def _selected_values(self, key, source):
+        """key's value in each selected variant (source is from _key_source).  Variants that were
+        handed out give their own value; the others are worked out without materializing them."""
+        if source is None or source == 'pass_through':
+            shared = _split_zipped(dict(self._pass_through)).get(key) if source else None
+        else:
+            digit_values = self._digit_values(source, key)
+            stride = self._strides[source]
+        for index in self._selected():
+            if index in self._materialized:
+                yield self._materialized[index].get(key)
+            elif source is None or source == 'pass_through':
+                yield shared
+            else:
+                yield digit_values[(index // stride) % len(digit_values)]
+
+    def _selected(self):
+        if self._indices is None:
+            self._indices = list(_iter_bits(self._mask))
+        return self._indices
+
+    def _materialize(self, index):
+        if index not in self._materialized:
+            remapped = {}
+            for (k, values), stride in zip(self._dimensions, self._strides):
+                remapped[k] = values[(index // stride) % len(values)]
+            for col, v in self._pass_through:
                 remapped[col] = v
-        # split out zipped keys
-        to_del = set()
-        for k, v in remapped.items():
-            if isinstance(k, string_types) and isinstance(v, string_types):
-                keys = _split_str(k, '#')
-                values = _split_str(v, '#')
-                for (_k, _v) in zip(keys, values):
-                    remapped[_k] = _v
-                if '#' in k:
-                    to_del.add(k)
-        for key in to_del:
-            del remapped[key]
-        dicts.append(remapped)
-    return dicts
+            self._materialized[index] = _split_zipped(remapped)
+        return self._materialized[index]
+
+    def __len__(self):
+        return bin(self._mask).count('1')
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self._materialize(index) for index in self._selected()[idx]]
+        return self._materialize(self._selected()[idx])
+
+    def __iter__(self):
+        for index in self._selected():
+            yield self._materialize(index)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, list(self))
+
+    def _key_source(self, key):
+        """Index of the one dimension that sets key, 'pass_through' if it is a shared value, or
+        None if it comes from nowhere.  Raises KeyError when more than one place sets key."""
+        sources = []
+        for dim, (k, _) in enumerate(self._dimensions):
+            if k == key or (isinstance(k, string_types) and key in _split_str(k, '#')):
+                sources.append(dim)
+        if any(col == key for col, _ in self._pass_through):
+            sources.append('pass_through')
+        if len(sources) > 1:
+            raise KeyError(key)
+        return sources[0] if sources else None
+
+    def _digit_values(self, dim, key):
+        k, values = self._dimensions[dim]
+        return [_split_zipped({k: value}).get(key) for value in values]
+
+    def _digit_mask(self, dim, digits):
+        stride = self._strides[dim]
+        period = stride * len(self._dimensions[dim][1])
+        pattern = 0
+        for digit in digits:
+            pattern |= ((1 << stride) - 1) << (digit * stride)
+        # repeat the pattern once per period across the full product
+        return pattern * (((1 << self._size) - 1) // ((1 << period) - 1))
+
+    def distinct_values(self, key):
+        """Values of key across the selected variants, in order of first appearance"""
+        try:
+            source = self._key_source(key)
+        except KeyError:
+            source = -1
+        if not self._mask:
+            return []
+        if source != -1 and self._selected_materialized():
+            # some variants were handed out, and may have been changed
+            values = self._selected_values(key, source)
+        elif source is None:
+            return []
+        elif source == 'pass_through':
+            values = [_split_zipped(dict(self._pass_through)).get(key)]
+        elif source == -1:
+            values = [variant.get(key) for variant in self]
+        else:
+            digit_values = self._digit_values(source, key)
+            values = [value for digit, value in enumerate(digit_values)
+                      if self._mask & self._digit_mask(source, [digit])]
+        distinct = []
+        for value in values:
+            if value not in distinct:
+                distinct.append(value)
+        return distinct
+
+    def filter(self, key, values, source_name):
+        """Same as filter_by_key_value, returning a new VariantSpace"""
+        if hasattr(values, 'keys'):
+            return self
+        log = get_logger(__name__)
+        try:
+            source = self._key_source(key)
+        except KeyError:
+            # ambiguous key (several dimensions write to it).  Check the variants themselves.
+            mask = 0
+            for index in self._selected():
+                value = self._materialize(index).get(key)
+                if value is not None and value in values:
+                    mask |= 1 << index
+            return self._derive(mask=mask)
+
+        if source is None or source == 'pass_through':
+            value = (_split_zipped(dict(self._pass_through)).get(key)
+                     if source == 'pass_through' else None)
+            kept = value is not None and value in values
+            if not kept:
+                log.debug('Filtering all variants with key {key} not matching target value(s) '
+                          '({tgt_vals}) from {source_name}'.format(key=key, tgt_vals=values,
+                                                                   source_name=source_name))
+            mask = self._mask if kept else 0
+        else:
+            digits = []
+            for digit, value in enumerate(self._digit_values(source, key)):
+                if value is not None and value in values:
+                    digits.append(digit)
+                else:
+                    log.debug('Filtering variants with key {key} not matching target value(s) '
+                              '({tgt_vals}) from {source_name}, actual {actual_val}'.format(
+                                  key=key, tgt_vals=values, source_name=source_name,
+                                  actual_val=value))
+            mask = self._mask & self._digit_mask(source, digits)
+        # variants that were handed out go by their own value, which may have been changed
+        for index in self._selected_materialized():
+            value = self._materialized[index].get(key)
+            if value is not None and value in values:
+                mask |= 1 << index
+            else:
+                mask &= ~(1 << index)
+        return self._derive(mask=mask)
+
+    def with_value(self, key, value):
+        """A new VariantSpace where every variant has key set to value"""
+        pass_through = [(col, value if col == key else v) for col, v in self._pass_through]
+        if not any(col == key for col, _ in pass_through):
+            pass_through.append((key, value))
+        return self._derive(pass_through=pass_through)
+
+
+def dict_of_lists_to_list_of_dicts(dict_of_lists, extend_keys=None):
+    # http://stackoverflow.com/a/5228294/1170370
+    # end result is a collection of dicts, like [{'python': 2.7, 'numpy': 1.11},
+    #                                            {'python': 3.5, 'numpy': 1.11}]
+    return list(VariantSpace(dict_of_lists, extend_keys=extend_keys))
 
 
 def list_of_dicts_to_dict_of_lists(list_of_dicts):
@@ -485,10 +746,14 @@ def get_package_variants(recipedir_or_metadata, config=None, variants=None):
                               ignore_system_config=config.ignore_system_variants,
                               exclusive_config_files=config.exclusive_config_files)
 
+    from conda_build.metadata import ns_cfg
+    namespace = ns_cfg(config)
+    namespace_key = _selector_namespace_key(namespace)
+
     specs = OrderedDict(internal_defaults=get_default_variant(config))
 
     for f in files:
-        specs[f] = parse_config_file(f, config)
+        specs[f] = _parse_config_file(f, namespace, namespace_key)
 
     # this is the override of the variants from files and args with values from CLI or env vars
     if hasattr(config, 'variant') and config.variant:
@@ -496,15 +761,21 @@ def get_package_variants(recipedir_or_metadata, config=None, variants=None):
     if variants:
         specs['argument_variants'] = variants
 
-    for f, spec in specs.items():
-        try:
-            validate_spec(spec)
-        except ValueError as e:
-            raise ValueError("Error in config {}: {}".format(f, str(e)))
-
-    # this merges each of the specs, providing a debug message when a given setting is overridden
-    #      by a later spec
-    combined_spec = combine_specs(specs, log_output=config.verbose)
+    # files are identified by their path and mtime, everything else by its contents
+    combined_spec_key = json.dumps([(source, os.path.getmtime(source) if source in files else spec)
+                                    for source, spec in specs.items()] + [namespace_key],
+                                   sort_keys=True, default=str)
+    if combined_spec_key not in _combined_spec_cache:
+        for f, spec in specs.items():
+            try:
+                validate_spec(spec)
+            except ValueError as e:
+                raise ValueError("Error in config {}: {}".format(f, str(e)))
+
+        # this merges each of the specs, providing a debug message when a given setting is
+        #      overridden by a later spec
+        _combined_spec_cache[combined_spec_key] = combine_specs(specs, log_output=config.verbose)
+    combined_spec = copy.deepcopy(_combined_spec_cache[combined_spec_key])
 
     extend_keys = set(ensure_list(combined_spec.get('extend_keys')))
     extend_keys.update({'zip_keys', 'extend_keys'})
@@ -513,7 +784,7 @@ def get_package_variants(recipedir_or_metadata, config=None, variants=None):
     specs = specs.copy()
     del specs['internal_defaults']
 
-    combined_spec = dict_of_lists_to_list_of_dicts(combined_spec, extend_keys=extend_keys)
+    combined_spec = VariantSpace(combined_spec, extend_keys=extend_keys)
     for source, source_specs in reversed(specs.items()):
         for k, vs in source_specs.items():
             if k not in extend_keys:
@@ -530,44 +801,149 @@ def get_vars(variants, loop_only=False):
     to the matrix dimensionality"""
     special_keys = {'pin_run_as_build', 'zip_keys', 'ignore_version'}
     special_keys.update(set(ensure_list(variants[0].get('extend_keys'))))
-    loop_vars = [k for k in variants[0] if k not in special_keys and
-                (not loop_only or
-                any(variant[k] != variants[0][k] for variant in variants[1:]))]
+    if isinstance(variants, VariantSpace):
+        loop_vars = [k for k in variants[0] if k not in special_keys and
+                    (not loop_only or len(variants.distinct_values(k)) > 1)]
+    else:
+        loop_vars = [k for k in variants[0] if k not in special_keys and
+                    (not loop_only or
+                    any(variant[k] != variants[0][k] for variant in variants[1:]))]
     return loop_vars
 
 
+# patterns used by _VariableUsageIndex to tokenize recipe text.  Each mirrors one of the
+#    per-key regexes that find_used_variables_in_text used to build, so that results stay identical.
+_word_re = re.compile(r"^\w+$")
+_jinja_open_re = re.compile(r"\{\s*")
+_pin_call_re = re.compile(r"pin_[a-z]+\(\s*?['\"]")
+_compiler_call_re = re.compile(r"\{\s*compiler\(['\"]([^'\"]*)['\"][^\{]*?\}")
+_conditional_re = re.compile(r"(?<!\{)\{%\s*(?:el)?if\s*")
+_requirement_re = re.compile(r"^\s+-\s+(\S+)(?:\s*$|\s+[\[#])")
+_selector_token_re = re.compile(r"(?<!\w)(\w+)(?=[=\s<>!\]])")
+_compiler_key_re = re.compile(r'(.*?)_compiler(_version)?$')
+
+
+def _has_prefix(sorted_strings, prefix):
+    idx = bisect_left(sorted_strings, prefix)
+    return idx < len(sorted_strings) and sorted_strings[idx].startswith(prefix)
+
+
+class _VariableUsageIndex(object):
+    """Everything in a recipe text that can refer to a variant key, collected in one pass.
+
+    Jinja2 expressions and conditionals match any key that is a prefix of their contents, so
+    those are kept sorted and searched with bisect.  Everything else is a plain set lookup."""
+    def __init__(self, recipe_text):
+        expressions = set()
+        conditionals = set()
+        self.compilers = set()
+        self.requirements = set()
+        self.selectors = set()
+        for line in recipe_text.splitlines():
+            if '{' in line:
+                for match in _jinja_open_re.finditer(line):
+                    starts = [match.end()]
+                    pin_match = _pin_call_re.match(line, match.end())
+                    if pin_match:
+                        starts.append(pin_match.end())
+                    for start in starts:
+                        end = line.find('}}', start)
+                        if end != -1:
+                            head = line[start:end]
+                            if '"' not in head and "'" not in head:
+                                expressions.add(head)
+                self.compilers.update(_compiler_call_re.findall(line))
+                for match in _conditional_re.finditer(line):
+                    end = line.find('%', match.end())
+                    if end != -1 and line[end + 1:end + 2] == '}':
+                        conditionals.add(line[match.end():end])
+            match = _requirement_re.match(line)
+            if match:
+                self.requirements.add(match.group(1).replace('-', '_'))
+            self.selectors.update(self._selector_tokens(line))
+        self.expressions = sorted(expressions)
+        self.conditionals = sorted(conditionals)
+
+    @staticmethod
+    def _selector_tokens(line):
+        # the selector is the first bracket in the line, preceded by whitespace, optionally
+        #    with a comment character in between
+        first = len(line)
+        for char in '#[':
+            idx = line.find(char)
+            if idx != -1 and idx < first:
+                first = idx
+        if first == len(line):
+            return []
+        if line[first] == '#':
+            if not (line[first + 1:first + 2].isspace() and line[first + 2:first + 3] == '['):
+                return []
+            bracket = first + 2
+        elif first > 0 and line[first - 1].isspace():
+            bracket = first
+        else:
+            return []
+        end = line.find(']', bracket)
+        selector = line[bracket + 1:end + 1] if end != -1 else line[bracket + 1:]
+        return _selector_token_re.findall(selector)
+
+    def uses(self, key, selectors=False):
+        if selectors:
+            return key in self.selectors
+        compiler_match = _compiler_key_re.match(key)
+        return ((compiler_match and compiler_match.group(1) in self.compilers) or
+                _has_prefix(self.expressions, key) or
+                key in self.requirements or
+                _has_prefix(self.conditionals, key))
+
+
+@memoized
+def _get_variable_usage_index(recipe_text):
+    return _VariableUsageIndex(recipe_text)
+
+
+def _find_used_variable_in_lines(v, recipe_lines, selectors=False):
+    """Regex-based detection of a single key.  Only needed for keys that are not plain words,
+    which the tokenized index can not represent."""
+    all_res = []
+    compiler_match = _compiler_key_re.match(v)
+    if compiler_match and not selectors:
+        compiler_lang = compiler_match.group(1)
+        compiler_regex = (
+            r"\{\s*compiler\([\'\"]%s[\"\'][^\{]*?\}" % re.escape(compiler_lang)
+        )
+        all_res.append(compiler_regex)
+        variant_lines = [line for line in recipe_lines if v in line or compiler_lang in line]
+    else:
+        variant_lines = [line for line in recipe_lines if v in line.replace('-', '_')]
+    if not variant_lines:
+        return False
+    v_regex = re.escape(v)
+    v_req_regex = '[-_]'.join(map(re.escape, v.split('_')))
+    variant_regex = r"\{\s*(?:pin_[a-z]+\(\s*?['\"])?%s[^'\"]*?\}\}" % v_regex
+    selector_regex = r"^[^#\[]*?\#?\s\[[^\]]*?(?<![_\w\d])%s[=\s<>!\]]" % v_regex
+    conditional_regex = r"(?:^|[^\{])\{%\s*(?:el)?if\s*" + v_regex + r"\s*(?:[^%]*?)?%\}"
+    # plain req name, no version spec.  Look for end of line after name, or comment or selector
+    requirement_regex = r"^\s+\-\s+%s\s*(?:\s[\[#]|$)" % v_req_regex
+    if selectors:
+        all_res.extend([selector_regex])
+    else:
+        all_res.extend([variant_regex, requirement_regex, conditional_regex])
+    # consolidate all re's into one big one for speedup
+    all_res = r"|".join(all_res)
+    return any(re.search(all_res, line) for line in variant_lines)
+
+
 @memoized
 def find_used_variables_in_text(variant, recipe_text, selectors=False):
+    index = _get_variable_usage_index(recipe_text)
     used_variables = set()
-    recipe_lines = recipe_text.splitlines()
     for v in variant:
-        all_res = []
-        compiler_match = re.match(r'(.*?)_compiler(_version)?$', v)
-        if compiler_match and not selectors:
-            compiler_lang = compiler_match.group(1)
-            compiler_regex = (
-                r"\{\s*compiler\([\'\"]%s[\"\'][^\{]*?\}" % re.escape(compiler_lang)
-            )
-            all_res.append(compiler_regex)
-            variant_lines = [line for line in recipe_lines if v in line or compiler_lang in line]
-        else:
-            variant_lines = [line for line in recipe_lines if v in line.replace('-', '_')]
-        if not variant_lines:
-            continue
-        v_regex = re.escape(v)
-        v_req_regex = '[-_]'.join(map(re.escape, v.split('_')))
-        variant_regex = r"\{\s*(?:pin_[a-z]+\(\s*?['\"])?%s[^'\"]*?\}\}" % v_regex
-        selector_regex = r"^[^#\[]*?\#?\s\[[^\]]*?(?<![_\w\d])%s[=\s<>!\]]" % v_regex
-        conditional_regex = r"(?:^|[^\{])\{%\s*(?:el)?if\s*" + v_regex + r"\s*(?:[^%]*?)?%\}"
-        # plain req name, no version spec.  Look for end of line after name, or comment or selector
-        requirement_regex = r"^\s+\-\s+%s\s*(?:\s[\[#]|$)" % v_req_regex
-        if selectors:
-            all_res.extend([selector_regex])
+        if _word_re.match(v):
+            used = index.uses(v, selectors=selectors)
         else:
-            all_res.extend([variant_regex, requirement_regex, conditional_regex])
-        # consolidate all re's into one big one for speedup
-        all_res = r"|".join(all_res)
-        if any(re.search(all_res, line) for line in variant_lines):
+            used = _find_used_variable_in_lines(v, recipe_text.splitlines(), selectors=selectors)
+        if used:
             used_variables.add(v)
     return used_variables
 
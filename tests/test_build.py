@@ -195,3 +195,20 @@ def test_rewrite_output(testing_workdir, testing_config, capsys):
         assert "LIBDIR=$PREFIX/lib" in stdout
         assert "PWD=$SRC_DIR" in stdout
         assert "BUILD_PREFIX=$BUILD_PREFIX" in stdout
+
+
+def test_prefetch_test_packages_solves_test_and_downstream_envs(testing_metadata, monkeypatch):
+    testing_metadata.meta['requirements']['run'] = ['zlib']
+    testing_metadata.meta['test']['requires'] = ['pytest']
+    testing_metadata.meta['test']['downstreams'] = ['some_downstream']
+    solved = []
+
+    def get_install_actions(prefix, specs, env, **kw):
+        solved.append(sorted(str(spec) for spec in specs))
+        return {'PREFIX': prefix, 'LINK': []}
+
+    monkeypatch.setattr(build.environ, 'get_install_actions', get_install_actions)
+    monkeypatch.setattr(build, 'execute_download_actions', lambda *args, **kw: {})
+    output_metas = [({'name': testing_metadata.name()}, testing_metadata)]
+    build.start_test_package_prefetch(testing_metadata, output_metas).join()
+    assert solved == [['pytest', 'zlib'], ['some_downstream', 'zlib']]
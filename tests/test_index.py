@@ -1,17 +1,20 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+import hashlib
+import io
 import json
 from logging import getLogger
 import os
 from os.path import dirname, isdir, join, isfile
+import pytest
 import requests
 import shutil
 import tarfile
 
 from conda_build import api
 from conda_build.index import update_index
-from conda_build.conda_interface import subdir
+from conda_build.conda_interface import subdir, conda_46
 from .utils import metadata_dir
 
 log = getLogger(__name__)
@@ -429,3 +432,502 @@ def test_patch_instructions_with_missing_subdir(testing_workdir):
     url = "https://anaconda.org/conda-forge/{0}/20180828/download/noarch/{0}-20180828-0.tar.bz2".format(pkg)
     patch_instructions = download(url, os.path.join(os.getcwd(), "patches.tar.bz2"))
     api.update_index('.', patch_generator=patch_instructions)
+
+
+class _Record(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def test_get_run_exports_from_index():
+    from conda_build import index
+    channel = _Record(scheme='https', name='some-channel', location='conda.example.com')
+    record = _Record(channel=channel, name='zlib', version='1.2.11', subdir='linux-64',
+                     fn='zlib-1.2.11-0.tar.bz2', url=None)
+    per_version = {'some-channel': {'packages': {'zlib': {
+        'run_exports': {'1.2.11': {'weak': ['zlib >=1.2.11,<1.3.0a0']}}}}}}
+    reference = {'some-channel': {'packages': {'zlib': {
+        'reference_package': 'linux-64/zlib-1.2.11-0.tar.bz2',
+        'run_exports': {'weak': ['zlib >=1.2.11,<1.3.0a0']}}}}}
+
+    index.run_exports_index.clear()
+    assert index.get_run_exports_from_index(record, per_version) == {
+        'weak': ['zlib >=1.2.11,<1.3.0a0']}
+    index.run_exports_index.clear()
+    assert index.get_run_exports_from_index(record, reference) == {
+        'weak': ['zlib >=1.2.11,<1.3.0a0']}
+    index.run_exports_index.clear()
+    # another build than the reference package can't be answered from channeldata
+    record.fn = 'zlib-1.2.11-1.tar.bz2'
+    assert index.get_run_exports_from_index(record, reference) is None
+    assert index.get_run_exports_from_index(record, {}) is None
+
+
+def test_get_run_exports_reads_legacy_file(testing_workdir):
+    from conda_build import index
+    pkg_dir = os.path.join(testing_workdir, 'legacy-1.0-0')
+    os.makedirs(os.path.join(pkg_dir, 'info'))
+    with open(os.path.join(pkg_dir, 'info', 'index.json'), 'w') as f:
+        json.dump({'name': 'legacy', 'version': '1.0'}, f)
+    with open(os.path.join(pkg_dir, 'info', 'run_exports'), 'w') as f:
+        f.write('libfoo >=1.2,<2\nlegacy >=1.0\n')
+    tarball = os.path.join(testing_workdir, 'legacy-1.0-0.tar.bz2')
+    with tarfile.open(tarball, 'w:bz2') as tar:
+        tar.add(os.path.join(pkg_dir, 'info'), arcname='info')
+
+    expected = {'weak': ['libfoo >=1.2,<2']}
+    assert index.get_run_exports(pkg_dir) == expected
+    assert index.get_run_exports(tarball) == expected
+
+    # and so the index cache that get_run_exports_from_index reads has them too
+    cache_path = os.path.join(testing_workdir, 'run_exports.json')
+    index._cache_run_exports(tarball, cache_path)
+    with open(cache_path) as f:
+        assert json.load(f) == expected
+
+
+def test_build_index_lookups():
+    from conda_build.index import BuildIndex
+    records = [_Record(name='zlib', dist_name='zlib-1.2.11-0'),
+               _Record(name='zlib', dist_name='zlib-1.2.11-1'),
+               _Record(name='xz', dist_name='xz-5.2.4-0')]
+    build_index = BuildIndex((record, record) for record in records)
+    assert build_index.get_by_dist_name('zlib-1.2.11-1') is records[1]
+    assert build_index.get_by_dist_name('zlib-1.2.12-0') is None
+    assert set(r.dist_name for r in build_index.get_by_name('zlib')) == {'zlib-1.2.11-0',
+                                                                         'zlib-1.2.11-1'}
+    extra = _Record(name='bzip2', dist_name='bzip2-1.0.8-0')
+    build_index[extra] = extra
+    assert build_index.get_by_name('bzip2') == [extra]
+
+    # every way of changing the index drops the lookups built before
+    assert build_index.pop(extra) is extra
+    assert build_index.get_by_name('bzip2') == []
+    assert build_index.setdefault(extra, extra) is extra
+    assert build_index.get_by_dist_name('bzip2-1.0.8-0') is extra
+    build_index.popitem()
+    assert len(build_index) == 3
+    assert sum(len(build_index.get_by_name(name)) for name in ('zlib', 'xz', 'bzip2')) == 3
+    build_index.clear()
+    assert build_index.get_by_name('zlib') == []
+    build_index |= {extra: extra}
+    assert build_index.get_by_name('bzip2') == [extra]
+
+
+def _write_package(channel, subdir, record):
+    """Put a package holding only info/index.json (made from record) in channel/subdir."""
+    fn = '%(name)s-%(version)s-%(build)s.tar.bz2' % record
+    info = json.dumps(dict(record, subdir=subdir)).encode('utf-8')
+    # written next to the channel and moved in, so that it never shows up half-written
+    tmp_path = os.path.join(os.path.dirname(channel.rstrip(os.sep)), fn)
+    with tarfile.open(tmp_path, 'w:bz2') as tar:
+        tar_info = tarfile.TarInfo('info/index.json')
+        tar_info.size = len(info)
+        tar.addfile(tar_info, io.BytesIO(info))
+    shutil.move(tmp_path, os.path.join(channel, subdir, fn))
+    return fn
+
+
+def test_watch_updates_index_as_packages_change(testing_metadata):
+    import threading
+    import time
+    from conda_build.index import ChannelIndex
+
+    out_file = api.build(testing_metadata)[0]
+    channel = os.path.join(testing_metadata.config.croot, 'watched')
+    pkg_subdir = os.path.basename(os.path.dirname(out_file))
+    os.makedirs(os.path.join(channel, pkg_subdir))
+    repodata_path = os.path.join(channel, pkg_subdir, 'repodata.json')
+    repodata2_path = os.path.join(channel, pkg_subdir, 'repodata2.json')
+
+    def wait_for(predicate, path=repodata_path):
+        deadline = time.time() + 60
+        while time.time() < deadline:
+            try:
+                with open(path) as f:
+                    if predicate(json.load(f)['packages']):
+                        return True
+            except (IOError, ValueError):
+                pass
+            time.sleep(0.1)
+        return False
+
+    stop_event = threading.Event()
+    channel_index = ChannelIndex(channel, None)
+    watcher = threading.Thread(target=channel_index.watch, args=(None, ),
+                               kwargs=dict(interval=0.1, debounce=0.2, stop_event=stop_event))
+    watcher.start()
+    try:
+        assert wait_for(lambda packages: not packages)
+        shutil.copy(out_file, os.path.join(channel, pkg_subdir))
+        fn = os.path.basename(out_file)
+        assert wait_for(lambda packages: fn in packages)
+        os.remove(os.path.join(channel, pkg_subdir, fn))
+        assert wait_for(lambda packages: fn not in packages)
+
+        # a package whose dependency only shows up later, in another subdir
+        app_fn = _write_package(channel, pkg_subdir, {'name': 'watched-app', 'version': '1.0',
+                                                       'build': '0', 'build_number': 0,
+                                                       'depends': ['watched-dep']})
+        assert wait_for(lambda packages: app_fn in packages)
+        _write_package(channel, 'noarch', {'name': 'watched-dep', 'version': '1.0', 'build': '0',
+                                           'build_number': 0, 'depends': [], 'noarch': 'generic'})
+        if conda_46:
+            # pkg_subdir's own packages did not change, but its repodata2 did
+            assert wait_for(lambda packages: any(record['fn'] == app_fn for record in packages),
+                            path=repodata2_path)
+    finally:
+        stop_event.set()
+        watcher.join()
+
+
+def _apply_repodata_delta(repodata, patch):
+    for op in patch:
+        parent, key = op['path'].rsplit('/', 1)
+        key = key.replace('~1', '/').replace('~0', '~')
+        target = repodata['packages'] if parent == '/packages' else repodata
+        if op['op'] == 'remove':
+            del target[key]
+        else:
+            target[key] = op['value']
+    return repodata
+
+
+def test_repodata_deltas_chain_between_generations(testing_metadata):
+    out_file = api.build(testing_metadata)[0]
+    channel = os.path.join(testing_metadata.config.croot, 'delta_channel')
+    pkg_subdir = os.path.basename(os.path.dirname(out_file))
+    subdir_path = os.path.join(channel, pkg_subdir)
+    os.makedirs(subdir_path)
+    repodata_path = os.path.join(subdir_path, 'repodata.json')
+    deltas_path = os.path.join(subdir_path, 'repodata_deltas.jsonl')
+
+    generations = []
+    update_index(channel)
+    generations.append(open(repodata_path, 'rb').read())
+    shutil.copy(out_file, subdir_path)
+    update_index(channel)
+    generations.append(open(repodata_path, 'rb').read())
+    os.remove(os.path.join(subdir_path, os.path.basename(out_file)))
+    update_index(channel)
+    generations.append(open(repodata_path, 'rb').read())
+
+    with open(deltas_path) as f:
+        deltas = [json.loads(line) for line in f]
+    assert len(deltas) == 2
+    assert [op['op'] for op in deltas[0]['patch']] == ['add']
+    assert [op['op'] for op in deltas[1]['patch']] == ['remove']
+    for delta, old, new in zip(deltas, generations, generations[1:]):
+        assert delta['from'] == hashlib.sha256(old).hexdigest()
+        assert delta['to'] == hashlib.sha256(new).hexdigest()
+        assert (_apply_repodata_delta(json.loads(old.decode('utf-8')), delta['patch']) ==
+                json.loads(new.decode('utf-8')))
+
+
+def test_repodata_shards_hold_each_package_name(testing_metadata):
+    from conda_build.repodata_shards import load_repodata_shards
+    out_file = api.build(testing_metadata)[0]
+    channel = os.path.join(testing_metadata.config.croot, 'shard_channel')
+    pkg_subdir = os.path.basename(os.path.dirname(out_file))
+    subdir_path = os.path.join(channel, pkg_subdir)
+    os.makedirs(subdir_path)
+    shutil.copy(out_file, subdir_path)
+    update_index(channel, write_shards=True)
+
+    with open(os.path.join(subdir_path, 'repodata_shards.json')) as f:
+        manifest = json.load(f)
+    name = testing_metadata.name()
+    assert list(manifest['shards']) == [name]
+    shard_path = os.path.join(subdir_path, 'shards', manifest['shards'][name] + '.json')
+    with open(shard_path, 'rb') as f:
+        assert hashlib.sha256(f.read()).hexdigest() == manifest['shards'][name]
+    with open(os.path.join(subdir_path, 'repodata.json')) as f:
+        repodata = json.load(f)
+
+    loaded = load_repodata_shards(channel, pkg_subdir, [name, 'not-in-channel'])
+    assert loaded[pkg_subdir]['packages'] == repodata['packages']
+
+    # removing the package drops it from the manifest, but its shard is kept for a generation,
+    #    for clients holding the previous manifest
+    os.remove(os.path.join(subdir_path, os.path.basename(out_file)))
+    update_index(channel, write_shards=True)
+    assert load_repodata_shards(channel, pkg_subdir, [name])[pkg_subdir]['packages'] == {}
+    assert os.path.isfile(shard_path)
+    update_index(channel, write_shards=True)
+    assert os.path.isfile(shard_path)
+
+    # dependencies are followed into noarch, and the next manifest lets go of the old shard
+    app_fn = _write_package(channel, pkg_subdir, {'name': 'shard-app', 'version': '1.0',
+                                                  'build': '0', 'build_number': 0,
+                                                  'depends': ['shard-dep']})
+    dep_fn = _write_package(channel, 'noarch', {'name': 'shard-dep', 'version': '1.0',
+                                                'build': '0', 'build_number': 0, 'depends': [],
+                                                'noarch': 'generic'})
+    update_index(channel, write_shards=True)
+    assert not os.path.isfile(shard_path)
+    loaded = load_repodata_shards(channel, pkg_subdir, ['shard-app'])
+    assert list(loaded[pkg_subdir]['packages']) == [app_fn]
+    assert list(loaded['noarch']['packages']) == [dep_fn]
+
+
+def test_verify_reports_corrupt_packages(testing_metadata):
+    out_file = api.build(testing_metadata)[0]
+    channel = os.path.join(testing_metadata.config.croot, 'verify_channel')
+    pkg_subdir = os.path.basename(os.path.dirname(out_file))
+    subdir_path = os.path.join(channel, pkg_subdir)
+    os.makedirs(subdir_path)
+    shutil.copy(out_file, subdir_path)
+    update_index(channel)
+    fn = os.path.basename(out_file)
+    stat_cache_path = os.path.join(subdir_path, '.cache', 'stat.json')
+
+    report, = api.verify_index(channel)
+    assert report['checked'] == 1
+    assert report['failed'] == 0
+
+    pkg_path = os.path.join(subdir_path, fn)
+    with open(pkg_path, 'rb') as f:
+        content = f.read()
+    with open(pkg_path, 'wb') as f:
+        f.write(content[:len(content) // 2])
+    report, = api.verify_index(channel)
+    assert report['failed'] == 1
+    problems = report['packages'][0]['problems']
+    assert any(problem.startswith('sha256') for problem in problems)
+    assert any(problem.startswith('archive does not decompress') for problem in problems)
+    # the cache is left alone unless asked
+    with open(stat_cache_path) as f:
+        assert fn in json.load(f)
+
+    api.verify_index(channel, invalidate_cache=True)
+    with open(stat_cache_path) as f:
+        assert fn not in json.load(f)
+
+
+def test_verify_streams_conda_packages(testing_workdir):
+    import zipfile
+    from conda_build import index
+
+    def tarball(name, content):
+        buf = io.BytesIO()
+        with tarfile.open(fileobj=buf, mode='w:bz2') as t:
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            t.addfile(info, io.BytesIO(content))
+        return buf.getvalue()
+
+    package_path = os.path.join(testing_workdir, 'a-1.0-0.conda')
+    with zipfile.ZipFile(package_path, 'w') as zf:
+        zf.writestr('metadata.json', b'{}')
+        zf.writestr('pkg-a-1.0-0.tar.bz2', tarball('lib/a.so', os.urandom(100000)))
+        zf.writestr('info-a-1.0-0.tar.bz2', tarball('info/index.json', b'{"name": "a"}'))
+    result = index._verify_package(('noarch', 'a-1.0-0.conda', package_path, {'name': 'a'}, False))
+    assert result['problems'] == []
+
+    # a damaged zip member is reported as that, and any other failure is reported too
+    with open(package_path, 'rb') as f:
+        content = bytearray(f.read())
+    content[len(content) // 3] ^= 0xff
+    with open(package_path, 'wb') as f:
+        f.write(bytes(content))
+    result = index._verify_package(('noarch', 'a-1.0-0.conda', package_path, {'name': 'a'}, False))
+    assert result['problems'] and 'CRC' in result['problems'][0]
+    with open(package_path, 'wb') as f:
+        f.write(b'not a zip')
+    result = index._verify_package(('noarch', 'a-1.0-0.conda', package_path, {'name': 'a'}, False))
+    assert result['problems'][0].startswith('archive does not decompress')
+
+
+def test_verify_expects_removed_packages(testing_workdir):
+    channel = os.path.join(testing_workdir, 'channel')
+    os.makedirs(os.path.join(channel, subdir))
+    kept_fn = _write_package(channel, subdir, {'name': 'kept', 'version': '1.0', 'build': '0',
+                                               'build_number': 0, 'depends': []})
+    removed_fn = _write_package(channel, subdir, {'name': 'gone', 'version': '1.0',
+                                                  'build': '0', 'build_number': 0,
+                                                  'depends': []})
+    with open(os.path.join(channel, subdir, 'patch_instructions.json'), 'w') as f:
+        json.dump({'patch_instructions_version': 1, 'remove': [removed_fn]}, f)
+    update_index(channel)
+    stat_cache_path = os.path.join(channel, subdir, '.cache', 'stat.json')
+
+    report, = api.verify_index(channel, subdir=subdir)
+    assert report['checked'] == 2
+    assert report['failed'] == 0
+    results = {result['fn']: result for result in report['packages']}
+    assert results[kept_fn]['removed'] is False
+    assert results[removed_fn]['removed'] is True
+    assert results[removed_fn]['problems'] == []
+
+    # its archive is still checked, but a broken removed package is no failure of the index
+    removed_path = os.path.join(channel, subdir, removed_fn)
+    with open(removed_path, 'rb') as f:
+        content = f.read()
+    with open(removed_path, 'wb') as f:
+        f.write(content[:len(content) // 2])
+    with open(stat_cache_path) as f:
+        stat_cache = json.load(f)
+    report, = api.verify_index(channel, subdir=subdir, invalidate_cache=True)
+    assert report['failed'] == 0
+    problems = [result['problems'] for result in report['packages']
+                if result['fn'] == removed_fn][0]
+    assert any(problem.startswith('archive does not decompress') for problem in problems)
+    with open(stat_cache_path) as f:
+        assert json.load(f) == stat_cache
+
+
+@pytest.mark.skipif(not conda_46, reason="namespaces are only added with conda 4.6+")
+def test_add_namespace_to_spec_is_memoized():
+    from collections import defaultdict
+    from conda_build import index
+    namemap = {'python': 'python:python', 'numpy': 'python:numpy'}
+    missing = defaultdict(list)
+    first = [index._add_namespace_to_spec('pkg.tar.bz2', {}, dep, namemap, missing, 'linux-64')
+             for dep in ('python >=3.6', 'numpy 1.11*', 'not-in-channel')]
+    assert 'python >=3.6' in index._spec_names
+    second = [index._add_namespace_to_spec('pkg.tar.bz2', {}, dep, namemap, missing, 'noarch')
+              for dep in ('python >=3.6', 'numpy 1.11*', 'not-in-channel')]
+    assert first == second
+    assert missing == {'not-in-channel': ['linux-64/pkg.tar.bz2', 'noarch/pkg.tar.bz2']}
+
+    # the caches stay bounded
+    old_size = index.MATCHSPEC_CACHE_SIZE
+    index.MATCHSPEC_CACHE_SIZE = 2
+    try:
+        for version in range(5):
+            index._add_namespace_to_spec('pkg.tar.bz2', {}, 'python %d.*' % version, namemap,
+                                         missing, 'linux-64')
+        assert len(index._spec_names) <= 2
+        assert len(index._namespaced_specs) <= 2
+    finally:
+        index.MATCHSPEC_CACHE_SIZE = old_size
+
+
+def test_reference_packages_share_parsed_versions():
+    from conda_build import index
+    packages = [dict(name='a', version=version, build_number=0, subdir=pkg_subdir,
+                     fn='a-%s-0.tar.bz2' % version)
+                for version in ('1.9', '1.10', '1.10.0a1') for pkg_subdir in ('linux-64', 'noarch')]
+    version_keys = {}
+    reference_packages = index._gather_channeldata_reference_packages(packages, version_keys)
+    assert [(rec['version'], rec['subdir']) for rec in reference_packages] == [('1.10', 'noarch')]
+    assert set(version_keys) == {'1.9', '1.10', '1.10.0a1'}
+
+
+def test_compact_records_share_strings():
+    from conda_build import index
+    strings = {}
+    first, second = (index._compact_record(json.loads(text), strings) for text in (
+        '{"name": "a", "depends": ["python >=3.6", "six"], "build_number": 0}',
+        '{"name": "b", "depends": ["python >=3.6"], "build_number": 0}'))
+    assert first == {"name": "a", "depends": ["python >=3.6", "six"], "build_number": 0}
+    assert first['depends'][0] is second['depends'][0]
+    assert [k for k in first if k == 'depends'][0] is [k for k in second if k == 'depends'][0]
+
+
+def test_apply_instructions_leaves_original_records_alone():
+    from conda_build import index
+    record = {"name": "a", "depends": ["six"], "license": "MIT"}
+    untouched = {"name": "b", "depends": []}
+    repodata = {"packages": {"a-1-0.tar.bz2": record, "b-1-0.tar.bz2": untouched}}
+    patched = index._apply_instructions("noarch", dict(repodata, packages=dict(repodata['packages'])), {
+        "packages": {"a-1-0.tar.bz2": {"license": "BSD"}},
+        "revoke": ["a-1-0.tar.bz2"],
+    })
+    assert patched['packages']["a-1-0.tar.bz2"]['license'] == "BSD"
+    assert patched['packages']["a-1-0.tar.bz2"]['depends'] == ["six", "package_has_been_revoked"]
+    assert patched['packages']["b-1-0.tar.bz2"] is untouched
+    assert record == {"name": "a", "depends": ["six"], "license": "MIT"}
+
+
+def test_augment_subdir_job_can_run_in_a_worker_process(testing_workdir):
+    import pickle
+    from collections import defaultdict
+    from functools import partial
+    from conda_build import index
+    repodata_path = join(testing_workdir, 'repodata.json')
+    with open(repodata_path, 'w') as fh:
+        json.dump({"packages": {"a-1-0.tar.bz2": {"name": "a", "version": "1", "build": "0",
+                                                  "build_number": 0, "depends": []}}}, fh)
+    augment = pickle.loads(pickle.dumps(partial(index._augment_subdir_job, {"a": "global:a"},
+                                                defaultdict(set))))
+    result = augment(("noarch", repodata_path, {"remove": ["b-1-0.tar.bz2"]}))
+    repodata, ambiguous_packages, missing_dependencies = pickle.loads(pickle.dumps(result))
+    assert repodata["packages"]["a-1-0.tar.bz2"]["depends2"] == []
+    assert repodata["removed"] == ["b-1-0.tar.bz2"]
+    assert (ambiguous_packages, missing_dependencies) == ({}, {})
+
+
+def test_reference_packages_fold_subdirs_one_at_a_time():
+    from conda_build import index
+    version_key = index._make_version_key({})
+    reference_packages = {}
+    for pkg_subdir, version in (('linux-64', '1.10'), ('noarch', '1.9'), ('osx-64', '1.10')):
+        index._update_reference_packages(reference_packages, [dict(
+            name='a', version=version, build_number=0, subdir=pkg_subdir, depends=['b'],
+            fn='a-%s-0.tar.bz2' % version, license='MIT')], version_key)
+    record, = index._reference_package_records(reference_packages)
+    assert record['reference_package'] == 'osx-64/a-1.10-0.tar.bz2'
+    assert record['subdirs'] == ['linux-64', 'noarch', 'osx-64']
+    # only what channeldata uses is kept
+    assert 'depends' not in record and record['license'] == 'MIT'
+
+
+def test_patch_instructions_cached_until_generator_or_repodata_change(testing_workdir):
+    os.makedirs('linux-64')
+    calls_log = os.path.join(testing_workdir, 'calls.log')
+    func = """
+def _patch_repodata(repodata, subdir):
+    with open(%r, 'a') as f:
+        f.write(subdir + '\\n')
+    return {"patch_instructions_version": 1, "packages": {}, "revoke": [], "remove": []}
+""" % calls_log
+    patch_file = os.path.join(testing_workdir, 'repodata_patch.py')
+    with open(patch_file, 'w') as f:
+        f.write(func)
+
+    def calls():
+        with open(calls_log) as f:
+            return sorted(f.read().split())
+
+    update_index(testing_workdir, patch_generator=patch_file)
+    assert calls() == ['linux-64', 'noarch']
+    # nothing changed: no subdir is patched again
+    update_index(testing_workdir, patch_generator=patch_file)
+    assert calls() == ['linux-64', 'noarch']
+    # a changed generator patches everything again
+    with open(patch_file, 'a') as f:
+        f.write('\n# changed\n')
+    update_index(testing_workdir, patch_generator=patch_file)
+    assert calls() == ['linux-64', 'linux-64', 'noarch', 'noarch']
+    # so does a new or changed module beside it, which it might import
+    with open(os.path.join(testing_workdir, 'patch_helpers.py'), 'w') as f:
+        f.write('REMOVALS = []\n')
+    update_index(testing_workdir, patch_generator=patch_file)
+    assert calls() == ['linux-64'] * 3 + ['noarch'] * 3
+    # and other inputs can't be seen, so the cache can be skipped
+    update_index(testing_workdir, patch_generator=patch_file, patch_cache=False)
+    assert calls() == ['linux-64'] * 4 + ['noarch'] * 4
+
+
+def test_written_file_digests_are_reused(testing_workdir, mocker):
+    from conda_build import index
+    md5_file = mocker.spy(index.utils, 'md5_file')
+    path = os.path.join(testing_workdir, 'repodata.json')
+    assert index._maybe_write(path, '{}', write_newline_end=True)
+    assert not index._maybe_write(path, '{}', write_newline_end=True)
+    assert index._maybe_write(path, '{"a": 1}', write_newline_end=True)
+    md5, size, _ = index._file_digest(path)
+    assert md5 == hashlib.md5(b'{"a": 1}\n').hexdigest()
+    assert size == os.path.getsize(path)
+    # none of that needed to hash the file
+    assert md5_file.call_count == 0
+
+    # whether to write goes by the file, not by the digest remembered for its size and mtime
+    stat_result = os.stat(path)
+    with open(path, 'w') as f:
+        f.write('{"b": 1}\n')
+    os.utime(path, (stat_result.st_atime, stat_result.st_mtime))
+    assert index._maybe_write(path, '{"a": 1}', write_newline_end=True)
+    with open(path) as f:
+        assert f.read() == '{"a": 1}\n'
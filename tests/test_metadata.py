@@ -218,3 +218,53 @@ def test_config_member_decoupling(testing_metadata):
     b = testing_metadata.copy()
     b.config.some_member = '123'
     assert b.config.some_member != testing_metadata.config.some_member
+
+
+def test_copy_decouples_meta(testing_metadata):
+    testing_metadata.meta['requirements'] = {'run': ['python']}
+    b = testing_metadata.copy()
+    assert b.name() == testing_metadata.name()
+    b.meta['requirements']['run'].append('numpy')
+    testing_metadata.get_value('requirements/run').append('zlib')
+    assert b.meta['requirements']['run'] == ['python', 'numpy']
+    assert testing_metadata.meta['requirements']['run'] == ['python', 'zlib']
+
+
+def test_copy_leaves_original_contents_in_place(testing_metadata):
+    testing_metadata.meta['requirements'] = {'run': ['python']}
+    meta = testing_metadata.meta
+    b = testing_metadata.copy()
+    # the original keeps (and does not copy again) its contents; only the copy copies
+    assert testing_metadata.meta is meta
+    assert b.meta is not meta
+    assert b.meta == meta
+
+
+def test_copy_does_not_see_later_changes_to_original(testing_metadata):
+    testing_metadata.meta['requirements'] = {'run': ['python']}
+    run = testing_metadata.meta['requirements']['run']
+    b = testing_metadata.copy()
+    # through references taken before the copy, and through meta
+    run.append('numpy')
+    testing_metadata.meta['requirements']['run'].append('zlib')
+    testing_metadata.meta['about'] = {'summary': 'changed'}
+    assert b.meta['requirements']['run'] == ['python']
+    assert b.meta.get('about') != {'summary': 'changed'}
+    assert testing_metadata.meta['requirements']['run'] == ['python', 'numpy', 'zlib']
+
+
+def test_copies_share_contents_until_one_of_them_reads_meta(testing_metadata):
+    testing_metadata.meta['requirements'] = {'run': ['python']}
+    b = testing_metadata.copy()
+    # b has handed out nothing yet, so its copies share its contents
+    c = b.copy()
+    contents = b._meta
+    assert c._meta is contents
+    # whichever accesses them first makes its own copy; the last one keeps them
+    c.meta['requirements']['run'].append('numpy')
+    assert c.meta is not contents
+    b.get_value('requirements/run').append('zlib')
+    assert b.meta is contents
+    assert b.meta['requirements']['run'] == ['python', 'zlib']
+    assert c.meta['requirements']['run'] == ['python', 'numpy']
+    assert testing_metadata.meta['requirements']['run'] == ['python']
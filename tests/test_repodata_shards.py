@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import hashlib
+import json
+import os
+
+import pytest
+
+from conda_build.repodata_shards import load_repodata_shards, REPODATA_SHARDS_FN, SHARDS_DIR
+
+
+def _write_shards(channel, subdir, packages_by_name, corrupt=()):
+    shards_path = os.path.join(channel, subdir, SHARDS_DIR)
+    os.makedirs(shards_path)
+    shards = {}
+    for name, packages in packages_by_name.items():
+        content = json.dumps({'info': {'subdir': subdir}, 'packages': packages}).encode('utf-8')
+        shards[name] = hashlib.sha256(content).hexdigest()
+        with open(os.path.join(shards_path, shards[name] + '.json'), 'wb') as f:
+            f.write(content + b' ' if name in corrupt else content)
+    with open(os.path.join(channel, subdir, REPODATA_SHARDS_FN), 'w') as f:
+        json.dump({'info': {'subdir': subdir}, 'repodata_version': 1, 'shards': shards}, f)
+
+
+def _record(name, depends=()):
+    return {name + '-1.0-0.tar.bz2': {'name': name, 'version': '1.0', 'build': '0',
+                                      'build_number': 0, 'depends': list(depends)}}
+
+
+def test_load_repodata_shards_follows_dependencies_across_subdirs(testing_workdir):
+    _write_shards(testing_workdir, 'linux-64', {
+        'app': _record('app', ['lib >=1', 'helper']),
+        'lib': _record('lib'),
+        'unrelated': _record('unrelated'),
+    })
+    _write_shards(testing_workdir, 'noarch', {'helper': _record('helper', ['lib'])})
+
+    loaded = load_repodata_shards(testing_workdir, 'linux-64', ['app', 'not-in-channel'])
+    assert sorted(loaded) == ['linux-64', 'noarch']
+    assert sorted(loaded['linux-64']['packages']) == ['app-1.0-0.tar.bz2', 'lib-1.0-0.tar.bz2']
+    assert list(loaded['noarch']['packages']) == ['helper-1.0-0.tar.bz2']
+    assert loaded['linux-64']['info'] == {'subdir': 'linux-64'}
+    assert loaded['linux-64']['repodata_version'] == 1
+
+    assert list(load_repodata_shards(testing_workdir, 'noarch', ['helper'])) == ['noarch']
+
+
+def test_load_repodata_shards_checks_shard_hashes(testing_workdir):
+    _write_shards(testing_workdir, 'noarch', {'app': _record('app')}, corrupt=['app'])
+    with pytest.raises(RuntimeError):
+        load_repodata_shards(testing_workdir, 'noarch', ['app'])
@@ -1,3 +1,4 @@
+import hashlib
 import os
 import subprocess
 import tarfile
@@ -7,7 +8,7 @@ import pytest
 from conda_build import source
 from conda_build.conda_interface import TemporaryDirectory
 from conda_build.source import download_to_cache
-from conda_build.utils import reset_deduplicator
+from conda_build.utils import reset_deduplicator, rm_rf
 from .utils import thisdir
 
 
@@ -42,6 +43,57 @@ def test_multiple_url_sources_into_same_folder(testing_metadata):
     assert os.path.exists(os.path.join(testing_metadata.config.work_dir, 'f1', 'b'))
 
 
+def test_download_sources_fetches_each_url_once(testing_workdir):
+    a = os.path.join(thisdir, 'archives', 'a.tar.bz2')
+    b = os.path.join(thisdir, 'archives', 'b.tar.bz2')
+    source_dicts = [{'folder': 'f1', 'url': a}, {'folder': 'f2', 'url': b},
+                    {'folder': 'f3', 'url': a}, {'path': '.'}]
+    downloads = source.download_sources(source_dicts, testing_workdir, '')
+    assert sorted(downloads) == [0, 1, 2]
+    assert downloads[0] == downloads[2]
+    assert downloads[1][1] == 'b.tar.bz2'
+    assert all(os.path.isfile(path) for path, _ in downloads.values())
+
+
+def test_source_unpacked_once_for_all_variants(testing_metadata, monkeypatch):
+    testing_metadata.meta['source'] = {'url': os.path.join(thisdir, 'archives', 'a.tar.bz2')}
+    testing_metadata.config.variants = [{'python': '2.7'}, {'python': '3.6'}]
+    source.provide(testing_metadata)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("source should have been reused")
+    monkeypatch.setattr(source, 'unpack', fail)
+    other_variant = testing_metadata.copy()
+    other_variant.config.variant = {'python': '3.6'}
+    rm_rf(other_variant.config.work_dir)
+    source.provide(other_variant)
+    assert os.path.exists(os.path.join(other_variant.config.work_dir, 'a'))
+
+    snapshots = list(source._pristine_sources.values())
+    assert snapshots
+    source.remove_pristine_sources()
+    assert not source._pristine_sources
+    assert not any(os.path.exists(snapshot) for snapshot in snapshots)
+
+
+def test_patched_source_is_cached(testing_metadata, testing_workdir, monkeypatch):
+    with open(os.path.join(testing_workdir, 'fill-a.patch'), 'w') as f:
+        f.write('--- a/a\n+++ b/a\n@@ -0,0 +1 @@\n+patched\n')
+    testing_metadata.path = testing_workdir
+    testing_metadata.meta['source'] = {'url': os.path.join(thisdir, 'archives', 'a.tar.bz2'),
+                                       'patches': ['fill-a.patch']}
+    testing_metadata.config.src_cache_keep_extracted = True
+    source.provide(testing_metadata)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("patches should not have been applied again")
+    monkeypatch.setattr(source, 'apply_patch', fail)
+    rm_rf(testing_metadata.config.work_dir)
+    source.provide(testing_metadata)
+    with open(os.path.join(testing_metadata.config.work_dir, 'a')) as f:
+        assert f.read() == 'patched\n'
+
+
 def test_extract_tarball_with_subfolders_moves_files(testing_metadata):
     """Ensure that tarballs that contain only a single folder get their contents
     hoisted up one level"""
@@ -97,6 +149,24 @@ def test_git_repo_with_single_subdir_does_not_enter_subdir(testing_metadata):
     assert os.path.basename(testing_metadata.config.work_dir) != 'one_folder'
 
 
+def test_git_sparse_paths_only_checks_out_those_paths(testing_metadata, testing_workdir):
+    repo = os.path.join(testing_workdir, 'repo')
+    for folder in ('keep', 'skip'):
+        os.makedirs(os.path.join(repo, folder))
+        with open(os.path.join(repo, folder, 'file.txt'), 'w') as f:
+            f.write(folder)
+    git_env = dict(os.environ, GIT_AUTHOR_NAME='a', GIT_AUTHOR_EMAIL='a@b',
+                   GIT_COMMITTER_NAME='a', GIT_COMMITTER_EMAIL='a@b')
+    subprocess.check_call(['git', 'init', '-q'], cwd=repo)
+    subprocess.check_call(['git', 'add', '.'], cwd=repo)
+    subprocess.check_call(['git', 'commit', '-qm', 'initial'], cwd=repo, env=git_env)
+    testing_metadata.meta['source'] = {'git_url': repo, 'git_sparse_paths': ['keep']}
+    source.provide(testing_metadata)
+    work_dir = testing_metadata.config.work_dir
+    assert os.path.isfile(os.path.join(work_dir, 'keep', 'file.txt'))
+    assert not os.path.exists(os.path.join(work_dir, 'skip'))
+
+
 def test_source_user_expand(testing_workdir):
     with TemporaryDirectory(dir=os.path.expanduser('~')) as tmp:
         with TemporaryDirectory() as tbz_srcdir:
@@ -112,6 +182,37 @@ def test_source_user_expand(testing_workdir):
                     download_to_cache(tmp2, '', source_dict)
 
 
+def test_source_cache_is_content_addressed(testing_workdir):
+    archive = os.path.join(thisdir, 'archives', 'a.tar.bz2')
+    with open(archive, 'rb') as f:
+        contents = f.read()
+    sha256 = hashlib.sha256(contents).hexdigest()
+    md5 = hashlib.md5(contents).hexdigest()
+    cache = os.path.join(testing_workdir, 'src_cache')
+    path, fn = download_to_cache(cache, '', {'url': archive, 'sha256': sha256})
+    assert fn == 'a.tar.bz2'
+    assert os.path.basename(path) == sha256 + '.tar.bz2'
+    # same content under another name and hash type is stored once
+    assert download_to_cache(cache, '', {'url': archive, 'fn': 'other.tar.bz2',
+                                         'md5': md5})[0] == path
+    assert os.listdir(os.path.join(cache, 'sha256')) == [os.path.basename(path)]
+
+    source.trim_source_cache(cache, '1', keep={sha256})
+    assert os.path.isfile(path)
+    source.trim_source_cache(cache, '1')
+    assert not os.path.isfile(path)
+
+
+def test_unpack_keep_extracted(testing_workdir):
+    cache = os.path.join(testing_workdir, 'src_cache')
+    source_dict = {'url': os.path.join(thisdir, 'archives', 'a.tar.bz2')}
+    for work in ('work1', 'work2'):
+        source.unpack(source_dict, os.path.join(testing_workdir, work), cache, '',
+                      croot=testing_workdir, keep_extracted=True)
+        assert os.path.exists(os.path.join(testing_workdir, work, 'a'))
+    assert len(os.listdir(os.path.join(cache, 'extracted'))) == 1
+
+
 def test_hoist_same_name(testing_workdir):
     testdir = os.path.join(testing_workdir, 'test', 'test')
     outer_dir = os.path.join(testing_workdir, 'test')
@@ -1,8 +1,10 @@
 import filelock
+import io
 import os
 import stat
 import subprocess
 import sys
+import tarfile
 import unittest
 import zipfile
 
@@ -329,3 +331,156 @@ def test_get_lock(testing_workdir):
     # ...even when not normalized
     lock1_unnormalized = utils.get_lock(os.path.join(testing_workdir, 'foo', '..', 'lock1'))
     assert lock1.lock_file == lock1_unnormalized.lock_file
+
+
+def test_tar_xf_strip_components_members_and_progress(testing_workdir):
+    makefile(os.path.join('pkg-1.0', 'a.txt'), 'hello')
+    makefile(os.path.join('pkg-1.0', 'sub', 'b.txt'), 'bb')
+    with tarfile.open('pkg-1.0.tar.gz', 'w:gz') as t:
+        t.add('pkg-1.0')
+
+    progress = []
+    utils.tar_xf('pkg-1.0.tar.gz', 'out', strip_components=1,
+                 progress=lambda entries, nbytes: progress.append((entries, nbytes)))
+    assert open(os.path.join('out', 'a.txt')).read() == 'hello'
+    assert open(os.path.join('out', 'sub', 'b.txt')).read() == 'bb'
+    assert progress[-1] == (3, 7)
+    # extraction must not depend on (or change) the working directory
+    assert os.getcwd() == testing_workdir
+
+    utils.tar_xf('pkg-1.0.tar.gz', 'only_sub', members=['pkg-1.0/sub'])
+    assert os.listdir(os.path.join('only_sub', 'pkg-1.0')) == ['sub']
+
+    utils.tar_xf('pkg-1.0.tar.gz', 'only_a', strip_components=1,
+                 members=lambda name: name == 'a.txt')
+    assert os.listdir('only_a') == ['a.txt']
+
+
+def test_tar_xf_refuses_unsafe_paths(testing_workdir):
+    with tarfile.open('evil.tar', 'w') as t:
+        info = tarfile.TarInfo('../escaped')
+        info.size = 1
+        t.addfile(info, io.BytesIO(b'x'))
+    with pytest.raises(RuntimeError):
+        utils.tar_xf('evil.tar', 'out')
+    assert not os.path.exists('escaped')
+
+
+@pytest.mark.skipif(utils.on_win, reason="symlinks need privileges on win")
+def test_tar_xf_replaces_symlinks_to_directories(testing_workdir):
+    os.makedirs('outside')
+    os.makedirs('out')
+    os.symlink(os.path.join('..', 'outside'), os.path.join('out', 'sub'))
+    os.makedirs('d')
+    os.symlink('d', 'link_to_d')
+    with tarfile.open('pkg.tar', 'w') as t:
+        t.add('outside', 'sub')
+        t.add('d', 'd')
+        t.add('link_to_d', 'link')
+        info = tarfile.TarInfo('link')
+        info.size = 4
+        t.addfile(info, io.BytesIO(b'file'))
+        info = tarfile.TarInfo('sub/x.txt')
+        info.size = 1
+        t.addfile(info, io.BytesIO(b'x'))
+
+    utils.tar_xf('pkg.tar', 'out')
+    assert not os.path.islink(os.path.join('out', 'sub'))
+    assert open(os.path.join('out', 'sub', 'x.txt')).read() == 'x'
+    assert os.listdir('outside') == []
+    assert not os.path.islink(os.path.join('out', 'link'))
+    assert open(os.path.join('out', 'link')).read() == 'file'
+
+
+def test_tar_xf_hardlink_to_filtered_out_member(testing_workdir):
+    makefile(os.path.join('a', 'real.txt'), 'content')
+    with tarfile.open('pkg.tar', 'w') as t:
+        t.add(os.path.join('a', 'real.txt'), 'a/real.txt')
+        for link in ('b/link1.txt', 'b/link2.txt'):
+            info = tarfile.TarInfo(link)
+            info.type = tarfile.LNKTYPE
+            info.linkname = 'a/real.txt'
+            t.addfile(info)
+
+    utils.tar_xf('pkg.tar', 'out', members=['b'])
+    assert os.listdir('out') == ['b']
+    for link in ('link1.txt', 'link2.txt'):
+        assert open(os.path.join('out', 'b', link)).read() == 'content'
+
+    utils.tar_xf('pkg.tar', 'all')
+    assert open(os.path.join('all', 'b', 'link1.txt')).read() == 'content'
+
+
+def test_package_info_dir_is_cached_until_package_changes(testing_workdir):
+    makefile(os.path.join('pkg', 'info', 'index.json'), '{"name": "pkg"}')
+    makefile(os.path.join('pkg', 'lib', 'big.so'), 'x' * 1000)
+    with tarfile.open('pkg-1.0-0.tar.bz2', 'w:bz2') as t:
+        t.add(os.path.join('pkg', 'info'), 'info')
+        t.add(os.path.join('pkg', 'lib'), 'lib')
+    cache_root = os.path.join(testing_workdir, 'cache')
+
+    info_dir = utils.package_info_dir('pkg-1.0-0.tar.bz2', cache_root=cache_root)
+    # only info/ is extracted
+    assert os.listdir(info_dir) == ['info']
+    with open(os.path.join(info_dir, 'info', 'index.json')) as f:
+        assert f.read() == '{"name": "pkg"}'
+    assert utils.package_info_dir('pkg-1.0-0.tar.bz2', cache_root=cache_root) == info_dir
+
+    makefile(os.path.join('pkg', 'info', 'index.json'), '{"name": "pkg", "rebuilt": true}')
+    os.remove('pkg-1.0-0.tar.bz2')
+    with tarfile.open('pkg-1.0-0.tar.bz2', 'w:bz2') as t:
+        t.add(os.path.join('pkg', 'info'), 'info')
+    new_info_dir = utils.package_info_dir('pkg-1.0-0.tar.bz2', cache_root=cache_root)
+    assert new_info_dir != info_dir
+    assert not os.path.exists(info_dir)
+    with open(os.path.join(new_info_dir, 'info', 'index.json')) as f:
+        assert 'rebuilt' in f.read()
+
+
+def test_package_info_dir_evicts_least_recently_used(testing_workdir):
+    makefile(os.path.join('pkg', 'info', 'index.json'), '{}')
+    cache_root = os.path.join(testing_workdir, 'cache')
+    info_dirs = {}
+    for i, name in enumerate(('a', 'b', 'c')):
+        fn = '%s-1.0-0.tar.bz2' % name
+        with tarfile.open(fn, 'w:bz2') as t:
+            t.add(os.path.join('pkg', 'info'), 'info')
+        info_dirs[name] = utils.package_info_dir(fn, cache_root=cache_root, max_packages=2)
+        # order the uses, whatever the file system's mtime resolution
+        os.utime(os.path.dirname(info_dirs[name]), (1000 + i, 1000 + i))
+    assert not os.path.exists(info_dirs['a'])
+    assert os.path.isdir(info_dirs['b']) and os.path.isdir(info_dirs['c'])
+
+    # using b makes c the least recently used
+    assert utils.package_info_dir('b-1.0-0.tar.bz2', cache_root=cache_root,
+                                  max_packages=2) == info_dirs['b']
+    utils.package_info_dir('a-1.0-0.tar.bz2', cache_root=cache_root, max_packages=2)
+    assert os.path.isdir(info_dirs['b'])
+    assert not os.path.exists(info_dirs['c'])
+    assert len(os.listdir(cache_root)) == 2
+
+
+def test_tar_xf_stop_after_members(testing_workdir):
+    with tarfile.open('pkg.tar', 'w') as t:
+        for name in ('info/index.json', 'lib/big.so', 'info/late.json'):
+            info = tarfile.TarInfo(name)
+            info.size = 2
+            t.addfile(info, io.BytesIO(b'{}'))
+    progress = []
+    utils.tar_xf('pkg.tar', 'out', members=['info'], stop_after_members=True,
+                 progress=lambda entries, nbytes: progress.append(entries))
+    assert os.listdir(os.path.join('out', 'info')) == ['index.json']
+    assert progress == [1]
+
+
+def test_package_has_file_finds_info_files_stored_after_other_files(testing_workdir, mocker):
+    mocker.patch.object(utils, '_package_info_cache_root',
+                        return_value=os.path.join(testing_workdir, 'cache'))
+    with tarfile.open('late-info-1.0-0.tar.bz2', 'w:bz2') as t:
+        for name in ('info/index.json', 'lib/big.so', 'info/late.json'):
+            info = tarfile.TarInfo(name)
+            info.size = 2
+            t.addfile(info, io.BytesIO(b'{}'))
+    package_path = os.path.join(testing_workdir, 'late-info-1.0-0.tar.bz2')
+    assert utils.package_has_file(package_path, 'info/late.json') == b'{}'
+    assert utils.package_has_file(package_path, 'info/missing.json') is False
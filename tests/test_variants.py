@@ -54,6 +54,23 @@ def test_use_selectors_in_variants(testing_workdir, testing_config):
     variants.get_package_variants(testing_workdir, testing_config)
 
 
+def test_parse_config_file_is_cached(testing_workdir, testing_config):
+    config_file = os.path.join(testing_workdir, 'conda_build_config.yaml')
+    with open(config_file, 'w') as f:
+        f.write("python:\n  - 2.7\n  - 3.6\n")
+    first = variants.parse_config_file(config_file, testing_config)
+    assert first == {'python': ['2.7', '3.6']}
+    # returned values are copies; modifying one must not leak into later calls
+    first['python'].append('3.7')
+    assert variants.parse_config_file(config_file, testing_config) == {'python': ['2.7', '3.6']}
+
+    with open(config_file, 'w') as f:
+        f.write("python:\n  - 3.7\n")
+    stat = os.stat(config_file)
+    os.utime(config_file, (stat.st_atime, stat.st_mtime + 10))
+    assert variants.parse_config_file(config_file, testing_config) == {'python': ['3.7']}
+
+
 def test_get_package_variants_from_dictionary_of_lists(testing_config, no_numpy_version):
     testing_config.ignore_system_config = True
     metadata = api.render(os.path.join(thisdir, "variant_recipe"),
@@ -140,6 +157,50 @@ def test_zip_fields():
     assert 'vc' not in ld[1].keys()
 
 
+def test_variant_space_matches_list_of_dicts():
+    v = {'python': ['2.7', '3.5', '3.6'], 'vc': ['9', '14', '14'], 'numpy': ['1.11', '1.16'],
+         'zip_keys': [('python', 'vc')]}
+    space = variants.VariantSpace(v)
+    ld = variants.dict_of_lists_to_list_of_dicts(v)
+    assert len(space) == 6
+    assert list(space) == ld
+    assert space[0] is space[0]
+
+    filtered = variants.filter_by_key_value(space, 'vc', ['14'], 'test')
+    assert isinstance(filtered, variants.VariantSpace)
+    assert list(filtered) == variants.filter_by_key_value(ld, 'vc', ['14'], 'test')
+    assert len(filtered) == 4
+    assert filtered.distinct_values('python') == ['3.5', '3.6']
+    assert set(variants.get_vars(filtered, loop_only=True)) == {'python', 'numpy'}
+
+    filtered = variants.filter_by_key_value(filtered, 'numpy', ['1.16'], 'test')
+    assert [(variant['python'], variant['numpy']) for variant in filtered] == [
+        ('3.5', '1.16'), ('3.6', '1.16')]
+    assert set(variants.get_vars(filtered, loop_only=True)) == {'python'}
+    assert not variants.filter_by_key_value(filtered, 'numpy', ['1.11'], 'test')
+
+
+def test_variant_space_keeps_changes_to_handed_out_variants():
+    import copy
+    space = variants.VariantSpace({'python': ['2.7', '3.6'], 'numpy': ['1.11', '1.16']})
+    edited = space[0]
+    edited['python'] = '3.8'
+    assert space.distinct_values('python') == ['3.8', '2.7', '3.6']
+
+    filtered = variants.filter_by_key_value(space, 'python', ['3.8'], 'test')
+    assert len(filtered) == 1 and filtered[0] is edited
+    assert [v['numpy'] for v in variants.filter_by_key_value(space, 'python', ['2.7'], 'test')] == [
+        '1.16']
+
+    pinned = space.with_value('pin_run_as_build', {'python': {'max_pin': 'x.x'}})
+    assert pinned[0]['python'] == '3.8'
+    assert pinned[0]['pin_run_as_build'] == {'python': {'max_pin': 'x.x'}}
+    assert 'pin_run_as_build' not in edited
+
+    copied = copy.deepcopy(space)
+    assert copied[0] == edited and copied[0] is not edited
+
+
 def test_cross_compilers():
     recipe = os.path.join(recipe_dir, '09_cross')
     ms = api.render(recipe, permit_unsatisfiable_variants=True, finalize=False, bypass_env_check=True)
@@ -194,6 +255,16 @@ def test_ensure_valid_spec_on_run_and_test(testing_workdir, testing_config, capl
     assert "Adding .* to spec 'pytest-mock  1.6'" not in text
 
 
+def test_parallel_render_matches_serial(testing_config):
+    recipe = os.path.join(recipe_dir, '17_multiple_recipes_independent_config')
+    recipes = [os.path.join(recipe, dirname) for dirname in ('a', 'b')]
+    serial = api.get_output_file_paths(recipes, config=testing_config)
+    testing_config.jobs = 2
+    assert api.get_output_file_paths(recipes, config=testing_config) == serial
+    assert len(api.render(os.path.join(recipe_dir, '19_used_variables'), config=testing_config,
+                          finalize=False, bypass_env_check=True)) == 4
+
+
 def test_serial_builds_have_independent_configs(testing_config):
     recipe = os.path.join(recipe_dir, '17_multiple_recipes_independent_config')
     recipes = [os.path.join(recipe, dirname) for dirname in ('a', 'b')]
@@ -454,3 +525,26 @@ def test_different_git_vars():
     versions = [m[0].version() for m in ms]
     assert "1.20.0" in versions
     assert "1.21.11" in versions
+
+
+def test_find_used_variables_in_text():
+    recipe_text = "\n".join([
+        "package:",
+        "  name: {{ name }}",
+        "  version: {{ pin_compatible('numpy') }}",
+        "{% if with_feature %}",
+        "build:",
+        "  skip: True  # [py2k or target_platform == 'win-64']",
+        "requirements:",
+        "  build:",
+        "    - {{ compiler('c') }}",
+        "    - zlib",
+        "    - libpng 1.6",
+        "    - some-thing  # [linux]",
+    ])
+    keys = ('name', 'numpy', 'with_feature', 'py2k', 'target_platform', 'c_compiler',
+            'cxx_compiler', 'zlib', 'libpng', 'some_thing', 'linux', 'unused')
+    assert variants.find_used_variables_in_text(keys, recipe_text) == {
+        'name', 'with_feature', 'c_compiler', 'zlib', 'some_thing'}
+    assert variants.find_used_variables_in_text(keys, recipe_text, selectors=True) == {
+        'py2k', 'target_platform', 'linux'}